@@ -1,111 +1,84 @@
-from flask import Flask, render_template, request, jsonify, redirect, session, url_for, flash, abort, current_app
-from services.google_sheet_service import add_leave, get_all_leaves, get_leaves_by_month, delete_leave, get_leave_summary_by_month, get_leave_summary_by_person
+from flask import Flask, Blueprint, render_template, request, jsonify, redirect, session, url_for, flash, abort, current_app, Response, stream_with_context
+from services.google_sheet_service import get_sheet_cache_stats, SHEET_CACHE_TTL
+from services.leave_service import record_leave, delete_leave, get_all_leaves, get_leaves_page, expand_days, get_leaves_by_month, get_leave_summary_by_month, get_leave_summary_by_person, get_leave_summary_by_type, reconcile_sheet, LEAVE_READ_BACKEND
+from services.summary_service import rebuild_leave_summary
+from services.http_cache import conditional_get, init_http_cache
+from services.export_service import USER_COLUMNS, LEAVE_COLUMNS, iter_user_rows, iter_leave_rows, stream_csv, stream_xlsx, xlsx_available
 import os
+import sys
+import logging
+import threading
 from dotenv import load_dotenv
 from services.auth_service import create_user, authenticate_user, send_verification_email, send_password_reset_email
-from services.data_service import save_leave_to_db
-from services.report_service import run_report_and_push
-from models import db, User, Leave
-import uuid
+from services.job_service import submit_pedx_job, get_job_status, JobConflict
+from models import db, User, Leave, AuthToken
+import time
+from datetime import date
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect, generate_csrf, CSRFError
-from services.telegram_service import send_telegram_message
+from services.outbox_service import start_outbox_worker
+from services.client_registry import get_client_stats
+from services.sheets_scheduler import get_scheduler_stats
+from services.mail_service import get_mail_stats
+from services.user_cache import load_cached_user, invalidate_user, get_user_cache_stats
+from services.leave_import_service import import_leaves, xlsx_available as import_xlsx_available
+from services.user_admin_service import get_users_page, set_admin, LastAdminError, bulk_user_action
+from services.token_service import issue_token, peek_token, consume_token, purge_expired_tokens, start_token_purger
+from services import google_sheet_service, report_service
 from sqlalchemy import text
 
-app = Flask(__name__)
 load_dotenv()
 
-# --- Critical env checks ---
-app.secret_key = os.getenv("SECRET_KEY")
-if not app.secret_key:
-    raise RuntimeError("SECRET_KEY is not set")
-
-# ----- CSRF -----
-app.config.update({
-    "WTF_CSRF_TIME_LIMIT": 3600,           # โทเค็นมีอายุ 1 ชม.
-    "SESSION_COOKIE_SAMESITE": "Lax",
-    "SESSION_COOKIE_SECURE": True,         # ใช้ True เมื่อรันผ่าน HTTPS จริง
-    "REMEMBER_COOKIE_SECURE": True,
-})
+# route ทั้งหมดอยู่ใน blueprint "main" แล้วค่อยผูกกับ app ใน create_app()
+# (cli_group=None → คำสั่ง CLI อยู่ระดับบนสุด เช่น flask rebuild-leave-summary)
+bp = Blueprint("main", __name__, cli_group=None)
 
+# extension สร้างครั้งเดียว แล้ว init_app ใน create_app()
 csrf = CSRFProtect()
-csrf.init_app(app)
+migrate = Migrate()
+login_manager = LoginManager()
+login_manager.login_view = "main.login"  # ถ้ายังไม่ login จะ redirect ไปที่ /login
 
-@app.context_processor                   # [ADD]
+@bp.app_context_processor                # [ADD]
 def inject_csrf_token():
     return dict(csrf_token=generate_csrf)
 
 # [แนะนำ] หน้า error สวย ๆ เวลา CSRF ไม่ผ่าน
-@app.errorhandler(CSRFError)
+@bp.app_errorhandler(CSRFError)
 def handle_csrf_error(e):
     # ถ้ายังไม่มี template แยก จะส่งข้อความตรง ๆ ก็ได้
     return (f"CSRF validation failed: {e.description}", 400)
 
-
-MYSQL_USER = os.getenv("MYSQL_USER")
-MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
-MYSQL_HOST = os.getenv("MYSQL_HOST")
-MYSQL_DB = os.getenv("MYSQL_DB")
-if not all([MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_DB]):
-    raise RuntimeError("Missing one of MYSQL_USER/MYSQL_PASSWORD/MYSQL_HOST/MYSQL_DB")
-
-# --- DB config ---
-# ระบุไดรเวอร์ mysqldb (mysqlclient) + charset ให้ชัด
-app.config["SQLALCHEMY_DATABASE_URI"] = (
-    f"mysql+mysqldb://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DB}"
-    "?charset=utf8mb4"
-)
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-#app.config["ENV"] = os.getenv("FLASK_ENV", "production")
-
-# ให้ต่อ DB ทน ๆ
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_pre_ping": True,
-    "pool_recycle": 1800,
-}
-
-# เพิ่ม config สำหรับ SMTP
-app.config["EMAIL_FROM"] = os.getenv("EMAIL_FROM")
-app.config["EMAIL_PASSWORD"] = os.getenv("EMAIL_PASSWORD")
-app.config["BASE_URL"] = os.getenv("BASE_URL", "http://localhost:5001") # ใช้สำหรับสร้างลิงก์ยืนยัน
-
-# Cookie hardening (ถ้าอยู่หลัง reverse proxy HTTPS ควรเปิด Secure)
-app.config.setdefault("SESSION_COOKIE_SAMESITE", "Lax")
-app.config.setdefault("SESSION_COOKIE_SECURE", True)        # ตั้ง True ถ้าใช้ HTTPS
-app.config.setdefault("REMEMBER_COOKIE_SECURE", True)       # ตั้ง True ถ้าใช้ HTTPS
-
-app.config["REPORT_SPREADSHEET_ID"] = os.getenv("REPORT_SPREADSHEET_ID")
-app.config["REPORT_WORKSHEET"] = os.getenv("REPORT_WORKSHEET")
-
-db.init_app(app)
-migrate = Migrate(app, db) # <--- เพิ่มบรรทัดนี้
-
-# Flask-Login setup
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "login"  # ถ้ายังไม่ login จะ redirect ไปที่ /login
-
 # บอก Flask-Login ว่าจะโหลด user จาก id ด้วยฟังก์ชันไหน
+# ใช้ cache ระยะสั้น (services/user_cache.py) แทน SELECT ทุก request; route ที่แก้ user ต้องเรียก invalidate_user
 @login_manager.user_loader
 def load_user(user_id):
-    # ใช้ API สมัยใหม่ของ SQLAlchemy 2.x
     try:
-        return db.session.get(User, int(user_id))
+        return load_cached_user(user_id)
     except Exception:
         return None
 
 # ------------------------------
 # Healthcheck (ไม่ต้องล็อกอิน)
 # ------------------------------
-@app.route("/health")
+@bp.route("/health")
 def health():
     try:
         db.session.execute(text("SELECT 1"))
         db_ok = True
     except Exception:
         db_ok = False
-    return jsonify({"status": "ok" if db_ok else "degraded", "db": db_ok}), (200 if db_ok else 503)
+    return jsonify({
+        "status": "ok" if db_ok else "degraded",
+        "db": db_ok,
+        "read_backend": LEAVE_READ_BACKEND,
+        "sheet_cache": get_sheet_cache_stats(),  # hit/miss ของ cache ชีต (ต่อ worker)
+        "clients": get_client_stats(),           # HOSxP pool / gspread client reuse + acquire latency
+        "sheets_scheduler": get_scheduler_stats(),  # throttle/429 retry ของ Sheets API (ต่อ worker)
+        "mail": get_mail_stats(),                # SMTP connection reuse (ต่อ worker)
+        "user_cache": get_user_cache_stats(),    # hit rate ของ user loader (ต่อ worker)
+    }), (200 if db_ok else 503)
 
 
 # ------------------------------
@@ -113,7 +86,7 @@ def health():
 # ------------------------------
 
 # หน้า register
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":  # เมื่อกด submit form
         username = request.form["username"]  # ดึงค่าจาก input
@@ -133,51 +106,53 @@ def register():
 
     return render_template("register.html")  # GET -> แสดงฟอร์มลงทะเบียน
 
-@app.route("/verify/<token>")
+@bp.route("/verify/<token>")
 def verify_email(token):
-    user = User.query.filter_by(verify_token=token).first()
+    # token ใช้ได้ครั้งเดียว และหมดอายุตาม VERIFY_TOKEN_TTL_HOURS
+    user = consume_token(token, AuthToken.PURPOSE_VERIFY)
     if not user:
-        flash("ลิงก์ยืนยันไม่ถูกต้อง")
+        db.session.rollback()
+        flash("ลิงก์ยืนยันไม่ถูกต้องหรือหมดอายุแล้ว")
         return redirect("/login")
 
     user.is_verified = True
-    user.verify_token = None
     db.session.commit()
+    invalidate_user(user.id)
     flash("ยืนยันอีเมลเรียบร้อยแล้ว กรุณาเข้าสู่ระบบ")
     return redirect("/login")
 
 
 # หน้า Login
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         user = authenticate_user(request.form["username"], request.form["password"])
         if user:
             login_user(user)
             flash("เข้าสู่ระบบสำเร็จ", "success")
-            return redirect(url_for("index"))
+            return redirect(url_for("main.index"))
         # ไม่บอกละเอียดเกินไป: ปลอดภัยกว่า + ครอบคลุมเคสยังไม่ยืนยันอีเมล
         flash("ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง หรือยังไม่ได้ยืนยันอีเมล", "danger")
-        return redirect(url_for("login"))  # PRG: กันกด refresh แล้วฟอร์มส่งซ้ำ
+        return redirect(url_for("main.login"))  # PRG: กันกด refresh แล้วฟอร์มส่งซ้ำ
 
     # GET: แสดงหน้า login เฉย ๆ (ข้อความจะมาจาก flash ใน base.html)
     return render_template("login.html")
 
 # หน้า Logout
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     logout_user()
     flash("ออกจากระบบแล้ว", "info")
-    return redirect(url_for("login"))
+    return redirect(url_for("main.login"))
 
-@app.route("/")
+@bp.route("/")
 @login_required
 def index():
     return render_template("index.html")
 
 # หน้า forgot password
-@app.route("/forgot", methods=["GET", "POST"])
+@bp.route("/forgot", methods=["GET", "POST"])
 def forgot_password():
     if request.method == "POST":
         username = request.form["username"].strip()
@@ -187,120 +162,130 @@ def forgot_password():
             flash("ไม่พบบัญชีผู้ใช้", "danger")
             return render_template("forgot_password.html")
 
-        # ออกโทเค็นใหม่ทุกครั้ง
-        user.reset_token = str(uuid.uuid4())
-        db.session.commit()
-
         try:
-            send_password_reset_email(user)  # [ADD] ส่งอีเมลจริง
+            send_password_reset_email(user)  # [ADD] ออกโทเค็นใหม่ + เข้าคิวอีเมล (worker ส่งเบื้องหลัง)
             flash("ส่งลิงก์รีเซ็ตรหัสผ่านไปยังอีเมลของคุณแล้ว", "info")
         except Exception:
-            # กันพัง: ถ้าส่งอีเมลไม่ได้ ยังบอกลิงก์ให้ใช้งานได้ทันที
-            app.logger.exception("Failed to send reset email")
-            reset_url = f"{app.config['BASE_URL'].rstrip('/')}/reset/{user.reset_token}"
-            flash(f"อีเมลส่งไม่สำเร็จ แต่คุณสามารถใช้ลิงก์นี้แทน: {reset_url}", "warning")
+            # ไม่แสดงลิงก์บนหน้าเว็บ: ใครรู้ username ก็จะรีเซ็ตรหัสคนอื่นได้
+            db.session.rollback()
+            current_app.logger.exception("Failed to send reset email")
+            flash("ส่งอีเมลไม่สำเร็จ กรุณาลองใหม่ภายหลัง", "danger")
 
     return render_template("forgot_password.html")
 
 
 # หน้า reset pasword
-@app.route("/reset/<token>", methods=["GET", "POST"])
+@bp.route("/reset/<token>", methods=["GET", "POST"])
 def reset_password(token):
-    user = User.query.filter_by(reset_token=token).first()
+    user = peek_token(token, AuthToken.PURPOSE_RESET)
     if not user:
         flash("Invalid or expired token.", "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
 
     if request.method == "POST":
         pwd = request.form.get("password", "").strip()
         if len(pwd) < 8:
             flash("รหัสผ่านต้องยาวอย่างน้อย 8 ตัวอักษร", "danger")
-            return redirect(url_for("reset_password", token=token))
+            return redirect(url_for("main.reset_password", token=token))
 
         try:
+            # consume ใน transaction เดียวกับการตั้งรหัส: ส่งฟอร์มซ้ำ/พร้อมกันจะสำเร็จได้ครั้งเดียว
+            user = consume_token(token, AuthToken.PURPOSE_RESET)
+            if not user:
+                db.session.rollback()
+                flash("Invalid or expired token.", "danger")
+                return redirect(url_for("main.login"))
             user.set_password(pwd)
-            user.reset_token = None
             db.session.commit()
+            invalidate_user(user.id)
         except Exception:
             db.session.rollback()
             flash("เกิดข้อผิดพลาดกับฐานข้อมูล", "danger")
-            return redirect(url_for("reset_password", token=token))
+            return redirect(url_for("main.reset_password", token=token))
 
         flash("ตั้งรหัสผ่านใหม่เรียบร้อยแล้ว", "success")
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
 
     return render_template("reset_password.html", token=token)
 
 #---------------#
 #   หน้า admin   #
 #---------------#
-@app.route("/admin")
+@bp.route("/admin")
 @login_required
 def admin():
     if not getattr(current_user, "is_admin", False):
         flash("Access denied.")
         return redirect("/")
-    users = User.query.all()
-    return render_template("admin.html", users=users)
+    # แบ่งหน้า/ค้นหาฝั่ง server (ไม่ดึงผู้ใช้ทั้งหมดมา render)
+    try:
+        result = get_users_page(
+            request.args.get("page"), request.args.get("per_page"),
+            q=request.args.get("q"), verified=request.args.get("verified"), admin=request.args.get("admin"),
+        )
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect(url_for("main.admin"))
+    return render_template("admin.html", users=result["items"], pager=result)
 
-@app.route("/admin/delete/<int:user_id>", methods=["POST"])
+@bp.route("/admin/delete/<int:user_id>", methods=["POST"])
 @login_required
 def delete_user(user_id):
     if not current_user.is_admin:
         flash("Access denied.", "danger")
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
 
     # กันลบตัวเอง
     if current_user.id == user_id:
         flash("ไม่สามารถลบบัญชีของตัวเองได้", "warning")
-        return redirect(url_for("admin"))
+        return redirect(url_for("main.admin"))
 
     user = User.query.get_or_404(user_id)
     if user.is_admin:
         flash("ไม่สามารถลบผู้ดูแลระบบได้", "warning")
-        return redirect(url_for("admin"))
+        return redirect(url_for("main.admin"))
 
     try:
         db.session.delete(user)
         db.session.commit()
+        invalidate_user(user_id)
         flash("ลบผู้ใช้เรียบร้อย", "success")
     except Exception:
         db.session.rollback()
         flash("ลบไม่สำเร็จ (ปัญหาฐานข้อมูล)", "danger")
 
-    return redirect(url_for("admin"))
+    return redirect(url_for("main.admin"))
 
-@app.route("/admin/resend-verify/<int:user_id>", methods=["POST"])
+@bp.route("/admin/resend-verify/<int:user_id>", methods=["POST"])
 @login_required
 def admin_resend_verify(user_id):
     if not current_user.is_admin:
-        flash("Access denied.", "danger"); return redirect(url_for("index"))
+        flash("Access denied.", "danger"); return redirect(url_for("main.index"))
     user = User.query.get_or_404(user_id)
     if user.is_verified:
         flash("ผู้ใช้นี้ยืนยันอีเมลแล้ว", "info")
-        return redirect(url_for("admin"))
+        return redirect(url_for("main.admin"))
     try:
-        # ถ้าเคยมี verify_token อยู่แล้ว ใช้อันเดิม; ถ้าไม่มีก็ออกใหม่
-        if not user.verify_token:
-            user.verify_token = str(uuid.uuid4())
-            db.session.commit()
-        send_verification_email(user)
-        flash("ส่งลิงก์ยืนยันใหม่แล้ว", "success")
+        # ออก token ใหม่ทุกครั้ง ลิงก์ยืนยันเดิมที่ยังไม่ใช้จะใช้ไม่ได้อีก
+        if send_verification_email(user):
+            flash("ส่งลิงก์ยืนยันใหม่แล้ว", "success")
+        else:
+            flash("ส่งลิงก์ไม่สำเร็จ", "danger")
     except Exception as e:
         current_app.logger.exception(e)
         flash("ส่งลิงก์ไม่สำเร็จ", "danger")
-    return redirect(url_for("admin"))
+    return redirect(url_for("main.admin"))
 
-@app.route("/admin/force-reset/<int:user_id>", methods=["POST"])
+@bp.route("/admin/force-reset/<int:user_id>", methods=["POST"])
 @login_required
 def admin_force_reset(user_id):
     if not current_user.is_admin:
-        flash("Access denied.", "danger"); return redirect(url_for("index"))
+        flash("Access denied.", "danger"); return redirect(url_for("main.index"))
     user = User.query.get_or_404(user_id)
     try:
-        user.reset_token = str(uuid.uuid4())
+        token = issue_token(user, AuthToken.PURPOSE_RESET)
         db.session.commit()
-        reset_url = f"{current_app.config['BASE_URL'].rstrip('/')}/reset/{user.reset_token}"
+        reset_url = f"{current_app.config['BASE_URL'].rstrip('/')}/reset/{token}"
         # โปรดักชัน: ส่งอีเมล reset ให้ user.email; ตอนนี้ log ไว้พอ
         current_app.logger.info("Force reset for user_id=%s: %s", user.id, reset_url)
         flash("ออกลิงก์รีเซ็ตรหัสผ่านแล้ว", "success")
@@ -308,152 +293,303 @@ def admin_force_reset(user_id):
         db.session.rollback()
         current_app.logger.exception(e)
         flash("ทำรายการไม่สำเร็จ", "danger")
-    return redirect(url_for("admin"))
+    return redirect(url_for("main.admin"))
 
-@app.route("/admin/toggle-admin/<int:user_id>", methods=["POST"])
+@bp.route("/admin/toggle-admin/<int:user_id>", methods=["POST"])
 @login_required
 def admin_toggle_admin(user_id):
     if not current_user.is_admin:
-        flash("Access denied.", "danger"); return redirect(url_for("index"))
+        flash("Access denied.", "danger"); return redirect(url_for("main.index"))
     if current_user.id == user_id:
         flash("ไม่สามารถเปลี่ยนสิทธิ์ของตัวเองได้", "warning")
-        return redirect(url_for("admin"))
+        return redirect(url_for("main.admin"))
 
     user = User.query.get_or_404(user_id)
-    # กัน demote จนเหลือ admin คนเดียว
-    admins = User.query.filter_by(is_admin=True).all()
-    if user.is_admin and len(admins) <= 1:
-        flash("ไม่สามารถถอนสิทธิ์แอดมินคนสุดท้ายได้", "warning")
-        return redirect(url_for("admin"))
-
     try:
-        user.is_admin = not user.is_admin
+        # กัน demote จนเหลือ admin คนเดียว: COUNT ... FOR UPDATE ใน transaction เดียวกับการเปลี่ยนสิทธิ์
+        set_admin(user, not user.is_admin)
         db.session.commit()
+        invalidate_user(user.id)
         flash(("เลื่อนเป็นแอดมิน" if user.is_admin else "ถอนสิทธิ์แอดมิน") + "เรียบร้อย", "success")
+    except LastAdminError as e:
+        db.session.rollback()
+        flash(str(e), "warning")
     except Exception as e:
         db.session.rollback()
         current_app.logger.exception(e)
         flash("ทำรายการไม่สำเร็จ", "danger")
-    return redirect(url_for("admin"))
+    return redirect(url_for("main.admin"))
+
+# คำสั่งแบบกลุ่ม: รับ action + user_ids (ฟอร์ม checkbox หรือ JSON) ทำทั้งหมดใน transaction เดียว
+_BULK_STATUS_TEXT = {
+    "ok": "สำเร็จ",
+    "not_found": "ไม่พบผู้ใช้",
+    "self": "ทำกับบัญชีตัวเองไม่ได้",
+    "admin": "ลบผู้ดูแลระบบไม่ได้",
+    "already_verified": "ยืนยันอีเมลแล้ว",
+    "already_admin": "เป็นแอดมินอยู่แล้ว",
+    "not_admin": "ไม่ได้เป็นแอดมิน",
+    "last_admin": "ต้องเหลือแอดมินอย่างน้อย 1 คน",
+}
 
-# Export CSV
-@app.route("/admin/export/users.csv")
+@bp.route("/admin/bulk", methods=["POST"])
 @login_required
-def export_users_csv():
+def admin_bulk():
+    as_json = request.is_json
     if not current_user.is_admin:
-        flash("Access denied.", "danger"); return redirect(url_for("index"))
+        if as_json:
+            return jsonify({"status": "error", "message": "Access denied."}), 403
+        flash("Access denied.", "danger"); return redirect(url_for("main.index"))
+
+    if as_json:
+        body = request.get_json(silent=True) or {}
+        action, ids = body.get("action"), body.get("user_ids")
+        if not isinstance(ids, list):
+            ids = [ids] if ids is not None else []
+    else:
+        action, ids = request.form.get("action"), request.form.getlist("user_ids")
 
-    import csv
-    from io import StringIO
-    si = StringIO()
-    w = csv.writer(si)
-    w.writerow(["id", "username", "email", "is_verified", "is_admin"])
-    for u in User.query.order_by(User.id.asc()).all():
-        w.writerow([u.id, u.username, u.email, int(u.is_verified), int(u.is_admin)])
+    try:
+        result = bulk_user_action(action, ids, current_user.id)
+    except ValueError as e:
+        if as_json:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        flash(str(e), "warning")
+        return redirect(url_for("main.admin"))
+    except Exception as e:
+        current_app.logger.exception(e)
+        if as_json:
+            return jsonify({"status": "error", "message": "DB error"}), 500
+        flash("ทำรายการไม่สำเร็จ", "danger")
+        return redirect(url_for("main.admin"))
+
+    if result["done"] and result["action"] in ("delete", "grant_admin", "revoke_admin"):
+        invalidate_user()  # ล้างทั้ง cache ครั้งเดียวแทนทีละคน
+    if result["action"] == "force_reset" and result["done"]:
+        current_app.logger.info("Bulk force reset by user_id=%s: %d users", current_user.id, result["done"])
+
+    if as_json:
+        return jsonify({"status": "success", "action": result["action"], "done": result["done"],
+                        "results": [{"user_id": uid, "status": st} for uid, st in result["results"].items()]})
+
+    counts = {}
+    for st in result["results"].values():
+        counts[st] = counts.get(st, 0) + 1
+    summary = ", ".join(f"{_BULK_STATUS_TEXT.get(st, st)} {n}" for st, n in counts.items())
+    flash(f"ทำรายการแบบกลุ่มแล้ว: {summary}", "success" if result["done"] else "warning")
+    return redirect(url_for("main.admin"))
+
+# Export CSV / XLSX (stream ทีละ batch จาก DB ไม่สร้างทั้งไฟล์ในหน่วยความจำ)
+_EXPORT_MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
 
-    from flask import Response
+def _export_response(fmt, filename, columns, rows, sheet_title):
+    if fmt == "xlsx":
+        if not xlsx_available():
+            flash("ยังไม่ได้ติดตั้ง openpyxl สำหรับ export XLSX", "warning")
+            return redirect(url_for("main.admin"))
+        body = stream_xlsx(columns, rows, sheet_title)
+    else:
+        body = stream_csv(columns, rows)
     return Response(
-        si.getvalue(),
-        mimetype="text/csv; charset=utf-8",
-        headers={"Content-Disposition": "attachment; filename=users.csv"}
+        stream_with_context(body),
+        mimetype=_EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"},
     )
 
+@bp.route("/admin/export/users.csv", defaults={"fmt": "csv"})
+@bp.route("/admin/export/users.xlsx", defaults={"fmt": "xlsx"})
+@login_required
+def export_users_csv(fmt):
+    if not current_user.is_admin:
+        flash("Access denied.", "danger"); return redirect(url_for("main.index"))
+    return _export_response(fmt, "users", USER_COLUMNS, iter_user_rows(), "users")
+
+@bp.route("/admin/export/leaves.csv", defaults={"fmt": "csv"})
+@bp.route("/admin/export/leaves.xlsx", defaults={"fmt": "xlsx"})
+@login_required
+def export_leaves(fmt):
+    if not current_user.is_admin:
+        flash("Access denied.", "danger"); return redirect(url_for("main.index"))
+    try:
+        date_from = date.fromisoformat(request.args["date_from"]) if request.args.get("date_from") else None
+        date_to = date.fromisoformat(request.args["date_to"]) if request.args.get("date_to") else None
+    except ValueError:
+        flash("รูปแบบวันที่ต้องเป็น YYYY-MM-DD", "warning")
+        return redirect(url_for("main.admin"))
+    return _export_response(fmt, "leaves", LEAVE_COLUMNS, iter_leave_rows(date_from, date_to), "leaves")
+
+# นำเข้าการลาแบบกลุ่มจาก CSV/XLSX (ข้อมูลย้อนหลัง/จากฝ่ายบุคคล)
+@bp.route("/admin/import-leaves", methods=["GET", "POST"])
+@login_required
+def admin_import_leaves():
+    wants_json = request.accept_mimetypes.best == "application/json"
+    if not current_user.is_admin:
+        if wants_json:
+            return jsonify({"status": "error", "message": "Access denied."}), 403
+        flash("Access denied.", "danger"); return redirect(url_for("main.index"))
+    if request.method == "GET":
+        return render_template("leave_import.html", xlsx=import_xlsx_available())
+
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        if wants_json:
+            return jsonify({"status": "error", "message": "กรุณาเลือกไฟล์"}), 400
+        flash("กรุณาเลือกไฟล์", "warning")
+        return redirect(url_for("main.admin_import_leaves"))
+
+    try:
+        report = import_leaves(upload.stream, upload.filename,
+                               dry_run=request.form.get("dry_run") == "1",
+                               imported_by=current_user.username)
+    except ValueError as e:
+        if wants_json:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        flash(str(e), "warning")
+        return redirect(url_for("main.admin_import_leaves"))
+    except Exception as e:
+        current_app.logger.exception(e)
+        if wants_json:
+            return jsonify({"status": "error", "message": "นำเข้าไม่สำเร็จ"}), 500
+        flash("นำเข้าไม่สำเร็จ (ฐานข้อมูล/ชีตมีปัญหา)", "danger")
+        return redirect(url_for("main.admin_import_leaves"))
+
+    if wants_json:
+        return jsonify({"status": "success", **report})
+    return render_template("leave_import.html", xlsx=import_xlsx_available(), report=report)
+
 
 #---------------#
 #   END admin   #
 #---------------#
 
 # ลบบัญชีตัวเอง
-@app.route("/delete_account", methods=["POST"])  # ควรใช้ POST (TODo: เพิ่ม CSRF ในฟอร์ม)
+@bp.route("/delete_account", methods=["POST"])  # ควรใช้ POST (TODo: เพิ่ม CSRF ในฟอร์ม)
 @login_required
 def delete_account():
-    db.session.delete(current_user)
-    db.session.commit()
+    # current_user เป็น snapshot จาก cache → โหลดแถวจริงก่อนลบ
+    user = db.session.get(User, current_user.id)
+    if user is not None:
+        db.session.delete(user)
+        db.session.commit()
+    invalidate_user(current_user.id)
+    logout_user()
     flash("Account deleted.")
     return redirect("/login")
 
 #--------------จัดการ Form--------------------#
 
-@app.route("/submit", methods=["POST"])
+@bp.route("/submit", methods=["POST"])
 @login_required
 def submit():
     data = request.form
-    
-    add_leave(
-        
-        data["name"],
-        data["leave_type"],
-        data["start_date"],
-        data["end_date"],
-        data.get("note", ""),
+
+    # ข้อความ Telegram เข้า outbox พร้อมแถว Leave; worker เบื้องหลังเป็นคนส่ง (ไม่บล็อก request)
+    msg = (
+        f"📢 <b>แจ้งเตือนบันทึกการลา</b>\n"
+        f"👤 <b>ชื่อ:</b> {data['name']}\n"
+        f"📝 <b>ประเภท:</b> {data['leave_type']}\n"
+        f"📅 <b>ช่วง:</b> {data['start_date']} ถึง {data['end_date']}\n"
+        f"🗒️ <b>หมายเหตุ:</b> {data.get('note', '-')}"
     )
 
-    # เพิ่มการบันทึกลง MySQL
+    # บันทึกลงทั้ง MySQL และชีต (ลำดับขึ้นกับ LEAVE_READ_BACKEND ดู services/leave_service.py)
     try:
-        save_leave_to_db(
+        record_leave(
             data["name"], 
             data["leave_type"], 
             data["start_date"], 
             data["end_date"], 
             data.get("note",""),
+            notify_message=msg,
         )
     except ValueError as e:
         return jsonify({"status":"error","message":str(e)}), 400
     except Exception:
         return jsonify({"status":"error","message":"DB error"}), 500
 
-    # ✅ ส่ง Telegram Notification
-    msg = (
-        f"📢 <b>แจ้งเตือนบันทึกการลา</b>\n"
-        f"👤 <b>ชื่อ:</b> {data['name']}\n"
-        f"📝 <b>ประเภท:</b> {data['leave_type']}\n"
-        f"📅 <b>ช่วง:</b> {data['start_date']} ถึง {data['end_date']}\n"
-        f"🗒️ <b>หมายเหตุ:</b> {data.get('note', '-')}"
-    )
-    send_telegram_message(msg)
-
     return jsonify({"status": "success"})
 
-@app.route("/data")
+def _sheet_cache_bucket():
+    # โหมดอ่านจากชีต: ชีตอาจถูกแก้ตรง ๆ นอกแอป → ให้ ETag เปลี่ยนทุกรอบ TTL ของ cache ชีตด้วย
+    if LEAVE_READ_BACKEND == "db":
+        return ""
+    return int(time.time() // max(1.0, SHEET_CACHE_TTL))
+
+@bp.route("/data")
 @login_required
+@conditional_get(extra=_sheet_cache_bucket)
 def data():
-    return jsonify(get_all_leaves())
+    # มี limit/cursor/filter → ตอบแบบแบ่งหน้า {"items", "next_cursor"}; ไม่มี → list ทั้งหมดแบบเดิม
+    paged_keys = ("limit", "cursor", "name", "leave_type", "date_from", "date_to")
+    if not any(k in request.args for k in paged_keys):
+        return jsonify(get_all_leaves())
+    try:
+        page = get_leaves_page(**{k: request.args.get(k) for k in paged_keys})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(page)
 
-@app.route("/calendar")
+@bp.route("/calendar")
 @login_required
+@conditional_get(extra=_sheet_cache_bucket)
 def calendar():
     month = request.args.get("month")  # format: YYYY-MM
-    return jsonify(get_leaves_by_month(month))
+    try:
+        leaves = get_leaves_by_month(month)
+        # expand=days → ส่งการลาแยกรายวันมาด้วย {"leaves": [...], "days": {...}}
+        if request.args.get("expand") == "days":
+            return jsonify({"leaves": leaves, "days": expand_days(leaves, month)})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(leaves)
 
-@app.route("/delete", methods=["POST"])
+@bp.route("/delete", methods=["POST"])
 @login_required
 def delete():
     data = request.json or {}
-    timestamp = data.get("timestamp")
+    leave_id = data.get("id")          # leave id (คอลัมน์ code) — ลบได้ทั้ง MySQL และชีต
+    timestamp = data.get("timestamp")  # แถวเก่าที่ยังไม่มี id
     code = data.get("code")
-    success = delete_leave(timestamp, code)
+    success = delete_leave(leave_id, timestamp, code)
     return jsonify({"success": success})
 
 #------Dashboard------#
-@app.route("/dashboard")
+@bp.route("/dashboard")
 @login_required
+@conditional_get(bucket_seconds=1800, extra=_sheet_cache_bucket)  # หน้า HTML ฝัง CSRF token (อายุ 1 ชม.)
 def dashboard():
     monthly_summary = get_leave_summary_by_month()
     person_summary = get_leave_summary_by_person()
+    type_summary = get_leave_summary_by_type()
     return render_template("dashboard.html",
                            monthly_summary=monthly_summary,
-                           person_summary=person_summary)
+                           person_summary=person_summary,
+                           type_summary=type_summary)
+
+# สร้างตารางสรุป leave_summary ใหม่ทั้งหมดจากตาราง leave (backfill): flask rebuild-leave-summary
+@bp.cli.command("rebuild-leave-summary")
+def rebuild_leave_summary_command():
+    counts = rebuild_leave_summary()
+    print("leave_summary rebuilt: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+
+# mirror ชีตตกหล่น (เช่นงานใน outbox failed ถาวร): เติมแถวที่ code ไม่อยู่ในชีต: flask reconcile-sheet
+@bp.cli.command("reconcile-sheet")
+def reconcile_sheet_command():
+    print(f"sheet rows queued for mirror: {reconcile_sheet()}")
 
 #----------------------#
 # Route Module อื่น     #
 #----------------------#
-@app.route("/pedx/upload", methods=["GET", "POST"])
+@bp.route("/pedx/upload", methods=["GET", "POST"])
 @login_required
 def pedx_upload():
     # แนะนำ: จำกัดเฉพาะ admin
     if not getattr(current_user, "is_admin", False):
         flash("Access denied.", "danger")
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
 
     if request.method == "POST":
         start_date = (request.form.get("start_date") or "").strip()
@@ -461,18 +597,157 @@ def pedx_upload():
             flash("กรุณาเลือกระบุวันที่เริ่มต้น", "warning")
             return render_template("pedx.html")
 
+        # รันเป็นงานเบื้องหลัง ไม่ผูก gunicorn worker ไว้ทั้ง run; หน้าเว็บ poll สถานะเอา
+        worksheet = current_app.config.get("REPORT_WORKSHEET") or ""
         try:
-            result = run_report_and_push(start_date)
-            flash(f"อัปโหลดสำเร็จ: {result['rows']} แถว", "success")
-        except Exception as e:
-            # log จริงก็ได้: app.logger.exception(e)
-            flash(f"อัปโหลดล้มเหลว: {e}", "danger")
+            job_id = submit_pedx_job(current_app._get_current_object(), start_date, worksheet, user_id=current_user.id,
+                                     mode=(request.form.get("mode") or None))
+        except ValueError as e:
+            flash(str(e), "warning")
+            return redirect(url_for("main.pedx_upload"))
+        except JobConflict as e:
+            flash("มีงานอัปโหลดของแผ่นงานนี้กำลังรันอยู่ กรุณารอให้เสร็จก่อน", "warning")
+            return redirect(url_for("main.pedx_upload", job=e.job_id) if e.job_id else url_for("main.pedx_upload"))
+
+        flash("เริ่มงานอัปโหลดแล้ว", "info")
+        return redirect(url_for("main.pedx_upload", job=job_id))
+
+    # GET (job=<id> → แสดงสถานะงานนั้น)
+    return render_template("pedx.html", job_id=request.args.get("job"))
+
+@bp.route("/pedx/jobs/<job_id>")
+@login_required
+def pedx_job_status(job_id):
+    if not getattr(current_user, "is_admin", False):
+        return jsonify({"status": "error", "message": "Access denied."}), 403
+    status = get_job_status(job_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "job not found"}), 404
+    return jsonify(status)
+
+
+# ------------------------------
+# App factory
+# ------------------------------
+# gunicorn "app:create_app()" / FLASK_APP=app (flask หา create_app ให้เอง)
+# ไม่มีการเชื่อมต่อ Google/HOSxP ตอน import หรือตอนสร้าง app: client ทุกตัวเปิดตอนใช้ครั้งแรก
+PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS", "0") == "1"
+
+def _serving() -> bool:
+    """
+    process นี้รับ request จริงไหม: gunicorn / python app.py / flask run = ใช่
+    flask db upgrade, flask purge-tokens ฯลฯ = ไม่ใช่ (ไม่ควรเริ่ม worker ที่ส่ง Telegram/อีเมล)
+    """
+    prog = sys.argv[0] if sys.argv else ""
+    is_flask_cli = os.path.basename(prog) == "flask" or prog.endswith(os.path.join("flask", "__main__.py"))
+    return not is_flask_cli or "run" in sys.argv[1:]
+
+def prewarm_clients():
+    """เปิด client ภายนอกล่วงหน้า (ชีตลา + หัวตาราง, HOSxP pool, gspread ของรายงาน) ล้มได้ไม่กระทบ app"""
+    log = logging.getLogger(__name__)
+    for name, fn in (("leave sheet", google_sheet_service.prewarm), ("report clients", report_service.prewarm)):
+        t0 = time.perf_counter()
+        try:
+            fn()
+            log.info("prewarm %s: %.0f ms", name, (time.perf_counter() - t0) * 1000)
+        except Exception:
+            log.exception("prewarm %s failed (จะลองใหม่ตอนใช้งานจริง)", name)
+
+# ลบ token ยืนยัน/รีเซ็ตที่หมดอายุหรือใช้แล้ว: flask purge-tokens
+@bp.cli.command("purge-tokens")
+def purge_tokens_command():
+    print(f"auth tokens purged: {purge_expired_tokens()}")
+
+# เปิด client ล่วงหน้าด้วยมือ: flask prewarm
+@bp.cli.command("prewarm")
+def prewarm_command():
+    prewarm_clients()
+
+def create_app(config=None):
+    app = Flask(__name__)
+
+    # --- Critical env checks ---
+    app.secret_key = os.getenv("SECRET_KEY")
+    if not app.secret_key:
+        raise RuntimeError("SECRET_KEY is not set")
+
+    # ----- CSRF -----
+    app.config.update({
+        "WTF_CSRF_TIME_LIMIT": 3600,           # โทเค็นมีอายุ 1 ชม.
+        "SESSION_COOKIE_SAMESITE": "Lax",
+        "SESSION_COOKIE_SECURE": True,         # ใช้ True เมื่อรันผ่าน HTTPS จริง
+        "REMEMBER_COOKIE_SECURE": True,
+    })
+
+    MYSQL_USER = os.getenv("MYSQL_USER")
+    MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
+    MYSQL_HOST = os.getenv("MYSQL_HOST")
+    MYSQL_DB = os.getenv("MYSQL_DB")
+    if not all([MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_DB]):
+        raise RuntimeError("Missing one of MYSQL_USER/MYSQL_PASSWORD/MYSQL_HOST/MYSQL_DB")
+
+    # --- DB config ---
+    # ระบุไดรเวอร์ mysqldb (mysqlclient) + charset ให้ชัด
+    app.config["SQLALCHEMY_DATABASE_URI"] = (
+        f"mysql+mysqldb://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DB}"
+        "?charset=utf8mb4"
+    )
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    #app.config["ENV"] = os.getenv("FLASK_ENV", "production")
+
+    # ให้ต่อ DB ทน ๆ
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
+
+    # เพิ่ม config สำหรับ SMTP
+    app.config["EMAIL_FROM"] = os.getenv("EMAIL_FROM")
+    app.config["EMAIL_PASSWORD"] = os.getenv("EMAIL_PASSWORD")
+    app.config["SMTP_HOST"] = os.getenv("SMTP_HOST", "smtp.gmail.com")
+    app.config["SMTP_PORT"] = int(os.getenv("SMTP_PORT", "465"))        # SMTP over SSL
+    app.config["SMTP_TIMEOUT"] = float(os.getenv("SMTP_TIMEOUT", "10"))
+    app.config["SMTP_IDLE_SECONDS"] = float(os.getenv("SMTP_IDLE_SECONDS", "60"))  # ปิด connection ที่ว่างนานกว่านี้
+    app.config["BASE_URL"] = os.getenv("BASE_URL", "http://localhost:5001") # ใช้สำหรับสร้างลิงก์ยืนยัน
+
+    # Cookie hardening (ถ้าอยู่หลัง reverse proxy HTTPS ควรเปิด Secure)
+    app.config.setdefault("SESSION_COOKIE_SAMESITE", "Lax")
+    app.config.setdefault("SESSION_COOKIE_SECURE", True)        # ตั้ง True ถ้าใช้ HTTPS
+    app.config.setdefault("REMEMBER_COOKIE_SECURE", True)       # ตั้ง True ถ้าใช้ HTTPS
+
+    app.config["REPORT_SPREADSHEET_ID"] = os.getenv("REPORT_SPREADSHEET_ID")
+    app.config["REPORT_WORKSHEET"] = os.getenv("REPORT_WORKSHEET")
+
+    # thread เบื้องหลัง (outbox worker, token purger): "1"/"0" บังคับเปิด/ปิด, ไม่ตั้ง = เปิดเฉพาะตอนรับ request
+    bg = os.getenv("ENABLE_BACKGROUND_WORKERS", "").strip()
+    app.config["ENABLE_BACKGROUND_WORKERS"] = (bg == "1") if bg else _serving()
+
+    # ค่าที่ผู้เรียกส่งมาทับค่าจาก env
+    if config:
+        app.config.update(config)
+
+    csrf.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+
+    # gzip/brotli สำหรับ JSON/HTML ขนาดใหญ่
+    init_http_cache(app)
+
+    if app.config["ENABLE_BACKGROUND_WORKERS"]:
+        # worker ส่งแจ้งเตือนจาก outbox (Telegram) เบื้องหลัง 1 ตัวต่อ process
+        start_outbox_worker(app)
+
+        # ลบ token ยืนยัน/รีเซ็ตที่หมดอายุเป็นระยะ (TOKEN_PURGE_INTERVAL, 0 = ปิด)
+        start_token_purger(app)
 
-        return redirect(url_for("pedx_upload"))
+    # prewarm แบบไม่บล็อก: worker รับ request ได้ทันทีแม้ Google/HOSxP ช้าหรือล่ม
+    if PREWARM_CLIENTS:
+        threading.Thread(target=prewarm_clients, name="prewarm", daemon=True).start()
 
-    # GET
-    return render_template("pedx.html")
+    return app
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001, debug=True)  # เปลี่ยนพอร์ตเป็น 5001
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5001, debug=True)  # เปลี่ยนพอร์ตเป็น 5001
@@ -18,8 +18,13 @@ class User(db.Model, UserMixin): # สร้าง model ชื่อ User (แ
     password_hash = db.Column(db.String(128), nullable=False) # คอลัมน์เก็บรหัสผ่านแบบ hash แล้ว
     is_admin = db.Column(db.Boolean, nullable=False, server_default=db.text("0"))  # ระบุว่าเป็น admin หรือไม่ (True/False) ค่า default คือ False
     is_verified = db.Column(db.Boolean, nullable=False, server_default=db.text("0"))  # เพิ่มสถานะยืนยันอีเมล
-    verify_token = db.Column(db.String(100), nullable=True)  # token สำหรับยืนยัน
-    reset_token = db.Column(db.String(100), nullable=True)  # Token ใช้ reset password (optional)
+    # token ยืนยันอีเมล/รีเซ็ตรหัสผ่าน ย้ายไปตาราง auth_token (ดู AuthToken)
+
+    __table_args__ = (
+        # หน้า admin: กรองตามสถานะแล้วเรียงตามชื่อ และนับจำนวนแอดมิน (is_admin นำหน้า)
+        # ค้นหา prefix ของ username/email ใช้ unique index ของคอลัมน์นั้นอยู่แล้ว
+        Index("ix_user_admin_verified_username", "is_admin", "is_verified", "username"),
+    )
 
     def set_password(self, password: str) -> None:
         self.password_hash = generate_password_hash(password, method="pbkdf2:sha256")
@@ -47,15 +52,169 @@ class Leave(db.Model):
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     note = db.Column(db.String(100), nullable=False)
+    # leave id ที่คงที่ (uuid4 hex) เขียนลงคอลัมน์ "code" ในชีตด้วย ใช้ลบให้ตรงกันทั้งสองที่
+    # nullable เพราะแถวเก่าก่อนมี id ยังไม่มีค่า
+    code = db.Column(db.String(32), nullable=True)
 
     __table_args__ = (
         # กันช่วงลาผิดตรรกะ
         CheckConstraint("start_date <= end_date", name="ck_leave_date_range"),
         # ดัชนีที่ช่วยคิวรีรายชื่อ/ช่วงวันที่
         Index("ix_leave_name_dates", "name", "start_date", "end_date"),
+        # ดัชนีสำหรับปฏิทินรายเดือน: end_date >= ต้นเดือน AND start_date <= สิ้นเดือน
+        # (end_date นำหน้า → range scan ตัดประวัติเก่าที่จบไปแล้วทิ้งทั้งหมด)
+        Index("ix_leave_end_start", "end_date", "start_date"),
         # ดัชนีสำหรับหน้า dashboard/order ล่าสุด
         Index("ix_leave_timestamp_desc", "timestamp"),
+        # ค้น/ลบตาม leave id
+        Index("ux_leave_code", "code", unique=True),
     )
 
     def __repr__(self) -> str:
         return f"Leave(name='{self.name}', type='{self.leave_type}', start='{self.start_date}')"
+
+# ตารางสรุปจำนวนการลา (pre-aggregated) ให้ /dashboard อ่านได้ทันทีไม่ต้องนับใหม่ทุกครั้ง
+# อัปเดตแบบ +1/-1 ใน transaction เดียวกับการเพิ่ม/ลบ Leave; สร้างใหม่ทั้งหมดได้ด้วย `flask rebuild-leave-summary`
+class LeaveSummary(db.Model):
+    __tablename__ = "leave_summary"
+
+    DIM_MONTH = "month"    # key = 'YYYY-MM' ของ start_date
+    DIM_PERSON = "person"  # key = name
+    DIM_TYPE = "type"      # key = leave_type
+
+    dimension = db.Column(db.String(10), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, server_default=db.text("0"))
+
+    def __repr__(self) -> str:
+        return f"LeaveSummary({self.dimension}:{self.key}={self.total})"
+
+# เลขเวอร์ชันข้อมูล: เพิ่มทุกครั้งที่มีการเพิ่ม/ลบการลา ใช้สร้าง ETag ให้ทุก gunicorn worker เห็นค่าเดียวกัน
+class DataVersion(db.Model):
+    __tablename__ = "data_version"
+
+    name = db.Column(db.String(30), primary_key=True)  # เช่น "leave"
+    version = db.Column(db.BigInteger, nullable=False, server_default=db.text("0"))
+
+    def __repr__(self) -> str:
+        return f"DataVersion({self.name}={self.version})"
+
+# คิวแจ้งเตือน (transactional outbox): บันทึกใน transaction เดียวกับข้อมูลลา แล้วให้ worker เบื้องหลังส่ง
+class NotificationOutbox(db.Model):
+    __tablename__ = "notification_outbox"
+
+    STATUS_PENDING = "pending"   # รอส่ง
+    STATUS_SENDING = "sending"   # worker จองไว้แล้ว (lease หมดอายุตาม next_attempt_at)
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"     # เกินจำนวนครั้งที่กำหนด ไม่ลองอีก
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(20), nullable=False, server_default="telegram")
+    message = db.Column(db.Text, nullable=False)
+    digest = db.Column(db.Boolean, nullable=False, server_default=db.text("0"))  # รวมส่งเป็นข้อความสรุปได้
+    status = db.Column(db.String(10), nullable=False, server_default=STATUS_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, server_default=db.text("0"))
+    # ข้อความยาวที่ถูกแบ่งหลายชิ้น: ส่งสำเร็จไปแล้วกี่ชิ้น → retry ส่งต่อจากชิ้นถัดไป ไม่ส่งชิ้นแรกๆ ซ้ำ
+    parts_sent = db.Column(db.Integer, nullable=False, server_default=db.text("0"))
+    next_attempt_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
+    last_error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # worker ดึงงานด้วย status + เวลาที่ถึงคิว
+        Index("ix_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+    def __repr__(self) -> str:
+        return f"NotificationOutbox(id={self.id}, channel='{self.channel}', status='{self.status}')"
+
+# งานรันรายงาน PEDX เบื้องหลัง (สถานะเก็บใน DB ให้ทุก gunicorn worker อ่านได้)
+class ReportJob(db.Model):
+    __tablename__ = "report_job"
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    worksheet = db.Column(db.String(100), nullable=False)
+    # = worksheet ระหว่างที่งานยังไม่จบ, NULL เมื่อจบ → unique index กันรันซ้อนบนแผ่นงานเดียวกัน
+    active_worksheet = db.Column(db.String(100), nullable=True)
+    start_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(10), nullable=False, server_default=STATUS_QUEUED)
+    phase = db.Column(db.String(20), nullable=True)   # query / clear / upload / done
+    rows_fetched = db.Column(db.Integer, nullable=False, server_default=db.text("0"))
+    rows_uploaded = db.Column(db.Integer, nullable=False, server_default=db.text("0"))
+    error = db.Column(db.String(255), nullable=True)
+    created_by = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ux_report_job_active", "active_worksheet", unique=True),
+        Index("ix_report_job_created", "created_at"),
+    )
+
+    def __repr__(self) -> str:
+        return f"ReportJob(id='{self.id}', worksheet='{self.worksheet}', status='{self.status}')"
+
+# state ของ PEDX incremental sync: watermark ต่อแผ่นงาน
+class PedxSyncState(db.Model):
+    __tablename__ = "pedx_sync_state"
+
+    worksheet = db.Column(db.String(100), primary_key=True)
+    start_date = db.Column(db.Date, nullable=False)   # ช่วงเริ่มของข้อมูลที่อยู่ในชีตตอนนี้
+    watermark = db.Column(db.Date, nullable=False)    # รอบหน้าดึงตั้งแต่วันนี้ (ลบ lookback)
+    last_run_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
+
+    def __repr__(self) -> str:
+        return f"PedxSyncState(worksheet='{self.worksheet}', watermark='{self.watermark}')"
+
+# VN -> แถวในชีต + hash เนื้อหา ใช้ตัดสินว่าต้องอัปเดตแถวไหน/append อะไรเพิ่ม
+class PedxRow(db.Model):
+    __tablename__ = "pedx_row"
+
+    worksheet = db.Column(db.String(100), primary_key=True)
+    vn = db.Column(db.String(20), primary_key=True)
+    row_number = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(40), nullable=False)  # sha1 hex
+    # วันที่ visit (คอลัมน์ VstDate) ใช้หา VN ที่หายไปจากช่วงที่ดึงรอบ incremental; แถวเก่าก่อนมีคอลัมน์นี้เป็น NULL
+    vstdate = db.Column(db.Date, nullable=True)
+
+    __table_args__ = (
+        Index("ix_pedx_row_worksheet_vstdate", "worksheet", "vstdate"),
+    )
+
+    def __repr__(self) -> str:
+        return f"PedxRow(vn='{self.vn}', row={self.row_number})"
+
+# token ยืนยันอีเมล / รีเซ็ตรหัสผ่าน: เก็บเฉพาะ sha256 ของ token, มีวันหมดอายุ และใช้ได้ครั้งเดียว
+class AuthToken(db.Model):
+    __tablename__ = "auth_token"
+
+    PURPOSE_VERIFY = "verify"
+    PURPOSE_RESET = "reset"
+
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), nullable=False)  # sha256 hex ของ token ในลิงก์
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    purpose = db.Column(db.String(10), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)    # UTC
+    used_at = db.Column(db.DateTime, nullable=True)        # ใช้แล้ว = ใช้ซ้ำไม่ได้
+    created_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        # คลิกลิงก์ = lookup ด้วย hash ตรง ๆ
+        Index("ux_auth_token_hash", "token_hash", unique=True),
+        # ยกเลิก token เก่าของผู้ใช้ตอนออกใหม่
+        Index("ix_auth_token_user_purpose", "user_id", "purpose"),
+        # งาน purge ลบตามวันหมดอายุ
+        Index("ix_auth_token_expires", "expires_at"),
+    )
+
+    def __repr__(self) -> str:
+        return f"AuthToken(user_id={self.user_id}, purpose='{self.purpose}', expires_at='{self.expires_at}')"
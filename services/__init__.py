@@ -1,7 +1,10 @@
 from .telegram_service import send_telegram_message
-from.google_sheet_service import add_leave, get_all_leaves, get_leaves_by_month, delete_leave, get_leave_summary_by_month, get_leave_summary_by_person
+from.google_sheet_service import add_leave, get_all_leaves, get_leaves_by_month, delete_leave, get_leave_summary_by_month, get_leave_summary_by_person, invalidate_sheet_cache, get_sheet_cache_stats
 from .auth_service import send_verification_email, create_user, authenticate_user
 from .data_service import save_leave_to_db
+from .leave_service import record_leave, reads_from_db
+from .outbox_service import enqueue_telegram, start_outbox_worker
+from .summary_service import rebuild_leave_summary
 from .report_service import *
 
 __all__ = [
@@ -12,9 +15,16 @@ __all__ = [
     'delete_leave',
     'get_leave_summary_by_month',
     'get_leave_summary_by_person',
+    'invalidate_sheet_cache',
+    'get_sheet_cache_stats',
     'send_verification_email',
     'create_user',
     'authenticate_user',
     'save_leave_to_db',
+    'record_leave',
+    'reads_from_db',
+    'enqueue_telegram',
+    'start_outbox_worker',
+    'rebuild_leave_summary',
     'run_report_and_push'
 ]
@@ -1,46 +1,56 @@
-from models import db, User  # นำเข้าจาก models.py
+from models import db, User, AuthToken  # นำเข้าจาก models.py
 from flask import current_app
-from uuid import uuid4
-import smtplib
-from email.mime.text import MIMEText
-from email.utils import formataddr
+from .mail_service import enqueue_email
+from .outbox_service import wake_outbox_worker
+from .token_service import issue_token, issue_tokens
 
-def send_verification_email(user) -> bool:
-    token = user.verify_token
-    email = user.email.strip()
+# อีเมลทุกฉบับเข้า outbox (channel="email") แล้ว worker เบื้องหลังส่งผ่าน SMTP connection ที่เปิดค้างไว้
+# request จึงไม่ต้องรอ TLS handshake/login ของ SMTP
+
+def _verification_email(user, token=None):
+    # ออก token ใหม่ทุกครั้ง (DB เก็บแค่ hash จึงส่งลิงก์เดิมซ้ำไม่ได้) ลิงก์เก่าที่ยังไม่ใช้จะถูกยกเลิก
+    token = token or issue_token(user, AuthToken.PURPOSE_VERIFY)
     base = (current_app.config.get("BASE_URL") or "").rstrip("/")
     link = f"{base}/verify/{token}"
+    html = f"กรุณาคลิกลิงก์เพื่อยืนยันอีเมล: <a href=\"{link}\">{link}</a>"
+    return enqueue_email(user.email, "ยืนยันอีเมล", html, sender_name="ระบบจองวันลา")
 
-    msg = MIMEText(f"กรุณาคลิกลิงก์เพื่อยืนยันอีเมล: <a href=\"{link}\">{link}</a>", "html", "utf-8")
-    msg["Subject"] = "ยืนยันอีเมล"
-    msg["From"] = formataddr(("ระบบจองวันลา", current_app.config["EMAIL_FROM"]))
-    msg["To"] = email
-
-    host = current_app.config.get("SMTP_HOST", "smtp.gmail.com")
-    port = int(current_app.config.get("SMTP_PORT", 465))
-    timeout = float(current_app.config.get("SMTP_TIMEOUT", 10.0))
-
+def send_verification_email(user) -> bool:
+    """เข้าคิวอีเมลยืนยัน (commit + ปลุก worker) คืน True เมื่อเข้าคิวสำเร็จ"""
     try:
-        with smtplib.SMTP_SSL(host, port, timeout=timeout) as smtp:
-            smtp.login(current_app.config["EMAIL_FROM"], current_app.config["EMAIL_PASSWORD"])
-            smtp.send_message(msg)
-        return True
+        _verification_email(user)
+        db.session.commit()
     except Exception:
+        db.session.rollback()
         current_app.logger.exception("send_verification_email failed")
         return False
+    wake_outbox_worker()
+    return True
+
+def send_verification_emails(users) -> int:
+    """เข้าคิวอีเมลยืนยันหลายคนใน transaction เดียว (ใช้กับงาน admin แบบกลุ่ม) คืนจำนวนที่เข้าคิว"""
+    users = list(users)
+    tokens = issue_tokens(users, AuthToken.PURPOSE_VERIFY)
+    for user in users:
+        _verification_email(user, tokens[user.id])
+    n = len(users)
+    db.session.commit()
+    if n:
+        wake_outbox_worker()
+    return n
 
 def create_user(username, email, password, is_admin=False):
     username = username.strip()
     email = email.strip().lower()  # ปกติ email ไม่ case-sensitive
     user = User(username=username, email=email, is_admin=is_admin)     # สร้าง object User โดยใส่ username
     user.set_password(password)        # เรียกใช้ method จาก User เพื่อ hash password
-    user.verify_token = str(uuid4())
 
     db.session.add(user)               # ใส่ object นี้ลง session (ยังไม่บันทึกจริง)
+    db.session.flush()                 # ให้ได้ user.id ก่อนออก token
+    _verification_email(user)          # อีเมลยืนยันเข้า outbox ใน transaction เดียวกับ user
     db.session.commit()               # บันทึกลงฐานข้อมูลจริง
-
-    # ไม่ให้การส่งอีเมลพังทั้ง request: log แล้วให้ไปกด "ส่งใหม่" ภายหลังถ้าจำเป็น
-    send_verification_email(user)
+    wake_outbox_worker()
+    return user
 
 def authenticate_user(username, password):
     username = (username or "").strip()
@@ -49,8 +59,8 @@ def authenticate_user(username, password):
         return user                           # คืนค่าผู้ใช้นั้นกลับไป
     return None                               # ถ้าไม่ถูกต้อง คืน None
 
-def send_password_reset_email(user):  # [ADD]
-    token = user.reset_token
+def _password_reset_email(user, token=None):
+    token = token or issue_token(user, AuthToken.PURPOSE_RESET)
     base = current_app.config["BASE_URL"].rstrip("/")
     link = f"{base}/reset/{token}"
 
@@ -60,11 +70,21 @@ def send_password_reset_email(user):  # [ADD]
     <p>หากไม่ได้ร้องขอ คุณสามารถเพิกเฉยอีเมลนี้ได้</p>
     """
 
-    msg = MIMEText(html, "html", "utf-8")
-    msg["Subject"] = "รีเซ็ตรหัสผ่าน (Leave App)"
-    msg["From"] = formataddr(("Leave App", current_app.config["EMAIL_FROM"]))
-    msg["To"] = user.email
+    return enqueue_email(user.email, "รีเซ็ตรหัสผ่าน (Leave App)", html, sender_name="Leave App")
+
+def send_password_reset_email(user):  # [ADD]
+    """ออก token รีเซ็ตใหม่แล้วเข้าคิวอีเมล (commit + ปลุก worker); โยน exception ถ้าเข้าคิวไม่ได้"""
+    _password_reset_email(user)
+    db.session.commit()
+    wake_outbox_worker()
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-        smtp.login(current_app.config["EMAIL_FROM"], current_app.config["EMAIL_PASSWORD"])
-        smtp.send_message(msg)
+def send_password_reset_emails(users) -> int:
+    """เข้าคิวอีเมลรีเซ็ตหลายคนใน transaction เดียว (งาน admin แบบกลุ่ม) คืนจำนวนที่เข้าคิว"""
+    users = list(users)
+    tokens = issue_tokens(users, AuthToken.PURPOSE_RESET)
+    for user in users:
+        _password_reset_email(user, tokens[user.id])
+    db.session.commit()
+    if users:
+        wake_outbox_worker()
+    return len(users)
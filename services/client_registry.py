@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+import threading
+
+import gspread
+import mysql.connector
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+from oauth2client.service_account import ServiceAccountCredentials
+
+logger = logging.getLogger(__name__)
+
+# ---- HOSxP connection pool (ต่อ process) ---- #
+HOSXP_POOL_SIZE = int(os.getenv("HOSXP_POOL_SIZE", "4"))            # mysql.connector จำกัดไม่เกิน 32
+HOSXP_POOL_TIMEOUT = float(os.getenv("HOSXP_POOL_TIMEOUT", "30"))   # วินาทีที่ยอมรอ connection ว่าง
+# ใช้ C extension ถ้าติดตั้งไว้ (เร็วกว่า pure-Python มากตอน fetch แถวจำนวนมาก); บังคับ pure ได้ด้วย HOSXP_USE_PURE=1
+HOSXP_USE_PURE = os.getenv("HOSXP_USE_PURE", "0") == "1" or not getattr(mysql.connector, "HAVE_CEXT", False)
+
+# ---- gspread client (ต่อ process) ---- #
+GS_CLIENT_MAX_AGE = float(os.getenv("GS_CLIENT_MAX_AGE", "3000"))  # authorize ใหม่ก่อน token (1 ชม.) หมด
+
+_lock = threading.Lock()
+_hosxp_pool = None
+_gs_clients = {}  # (creds_file, scopes) -> {"client", "created_at"}
+_stats = {
+    "hosxp_acquires": 0,
+    "hosxp_acquire_waits": 0,   # ครั้งที่ pool เต็มต้องรอ
+    "hosxp_acquire_ms_total": 0.0,
+    "hosxp_acquire_ms_max": 0.0,
+    "hosxp_acquire_ms_last": 0.0,
+    "gs_authorizations": 0,
+    "gs_reuses": 0,
+}
+
+
+def _get_pool(config: dict):
+    global _hosxp_pool
+    if _hosxp_pool is None:
+        with _lock:
+            if _hosxp_pool is None:
+                _hosxp_pool = pooling.MySQLConnectionPool(
+                    pool_name="hosxp",
+                    pool_size=max(1, min(HOSXP_POOL_SIZE, 32)),
+                    pool_reset_session=True,
+                    charset="utf8", use_pure=HOSXP_USE_PURE,
+                    connection_timeout=10, autocommit=True,
+                    **config,
+                )
+    return _hosxp_pool
+
+
+def hosxp_connection(config: dict):
+    """
+    ยืม connection จาก pool (conn.close() = คืนเข้า pool ไม่ได้ปิดจริง)
+    get_connection() เช็ค is_connected() (ping) ให้แล้ว connection ที่หลุดจะถูก reconnect ก่อนส่งออก
+    ถ้า pool เต็มจะรอได้ไม่เกิน HOSXP_POOL_TIMEOUT วินาที
+    config (host/port/user/password/database) ใช้ตอนสร้าง pool ครั้งแรกเท่านั้น
+    """
+    pool = _get_pool(config)
+    t0 = time.perf_counter()
+    deadline = t0 + HOSXP_POOL_TIMEOUT
+    waited = False
+    while True:
+        try:
+            conn = pool.get_connection()
+            break
+        except PoolError:
+            if time.perf_counter() >= deadline:
+                raise
+            waited = True
+            time.sleep(0.05)
+
+    ms = (time.perf_counter() - t0) * 1000
+    with _lock:
+        _stats["hosxp_acquires"] += 1
+        _stats["hosxp_acquire_waits"] += int(waited)
+        _stats["hosxp_acquire_ms_total"] += ms
+        _stats["hosxp_acquire_ms_max"] = max(_stats["hosxp_acquire_ms_max"], ms)
+        _stats["hosxp_acquire_ms_last"] = ms
+    if ms > 1000:
+        logger.warning("HOSxP connection acquire took %.0f ms", ms)
+    return conn
+
+
+def gspread_client(creds_file: str, scopes, force: bool = False):
+    """
+    client ที่ authorize แล้ว ใช้ซ้ำทั้ง process
+    authorize ใหม่เมื่อเปลี่ยนไฟล์/สโคป, อายุเกิน GS_CLIENT_MAX_AGE หรือ force=True (เช่นหลังเจอ 401)
+    """
+    key = (creds_file, tuple(scopes))
+    with _lock:
+        entry = _gs_clients.get(key)
+        client = entry["client"] if entry else None
+        fresh = client is not None and time.monotonic() - entry["created_at"] < GS_CLIENT_MAX_AGE
+        if fresh and not force:
+            # gspread รุ่นใหม่ใช้ AuthorizedSession ที่ refresh token เอง;
+            # รุ่นเก่า (<5) เก็บ credentials ของ oauth2client ไว้ใน client.auth ต้อง login() เองเมื่อหมดอายุ
+            auth = getattr(client, "auth", None)
+            if getattr(auth, "access_token_expired", False):
+                client.login()
+            _stats["gs_reuses"] += 1
+            return client
+
+        creds = ServiceAccountCredentials.from_json_keyfile_name(creds_file, list(scopes))
+        client = gspread.authorize(creds)
+        _gs_clients[key] = {"client": client, "created_at": time.monotonic()}
+        _stats["gs_authorizations"] += 1
+        return client
+
+
+def reset_gspread_client() -> None:
+    with _lock:
+        _gs_clients.clear()
+
+
+def get_client_stats() -> dict:
+    """สถิติ pool/client ของ worker นี้ (ใช้ดูใน /health)"""
+    with _lock:
+        s = dict(_stats)
+    n = s["hosxp_acquires"]
+    s["hosxp_acquire_ms_avg"] = round(s["hosxp_acquire_ms_total"] / n, 2) if n else 0.0
+    for k in ("hosxp_acquire_ms_total", "hosxp_acquire_ms_max", "hosxp_acquire_ms_last"):
+        s[k] = round(s[k], 2)
+    s["hosxp_pool_size"] = max(1, min(HOSXP_POOL_SIZE, 32))
+    s["hosxp_pool_ready"] = _hosxp_pool is not None
+    s["hosxp_c_extension"] = not HOSXP_USE_PURE
+    s["gs_clients_ready"] = len(_gs_clients)
+    return s
@@ -1,13 +1,24 @@
-from models import db, Leave
-from datetime import date
+from sqlalchemy import insert, or_
+from models import db, Leave, LeaveSummary
+from datetime import date, datetime, timedelta, timezone
 from flask import current_app
+from .outbox_service import enqueue_telegram, enqueue_sheet_add, enqueue_sheet_delete, is_urgent_leave_type
+from .summary_service import apply_leave_to_summary, apply_leaves_to_summary, get_summary
+from .http_cache import bump_data_version
 
-def save_leave_to_db(name, leave_type, start_date, end_date, note) -> int:
+def validate_leave(name, leave_type, start_date, end_date, note):
+    """normalize + ตรวจข้อมูลการลา 1 รายการ คืน (name, leave_type, sd, ed, note); ValueError ถ้าไม่ถูกต้อง"""
     # normalize input
     name = (name or "").strip()
     leave_type = (leave_type or "").strip()
     note = (note or "").strip()[:100]  # schema จำกัด 100
 
+    # name/leave_type ตัดทิ้งไม่ได้ (ชื่อ/ประเภทจะผิด) → แจ้งเป็น error แทน
+    if len(name) > 100:
+        raise ValueError("name ยาวเกิน 100 ตัวอักษร")
+    if len(leave_type) > 50:
+        raise ValueError("leave_type ยาวเกิน 50 ตัวอักษร")
+
     # parse & validate dates
     try:
         sd = date.fromisoformat(str(start_date))
@@ -19,21 +30,246 @@ def save_leave_to_db(name, leave_type, start_date, end_date, note) -> int:
     if sd > ed:
         raise ValueError("ช่วงวันลาไม่ถูกต้อง: start_date > end_date")
 
+    return name, leave_type, sd, ed, note
+
+def save_leave_to_db(name, leave_type, start_date, end_date, note, notify_message=None, code=None,
+                     mirror_to_sheet=False) -> int:
+    # notify_message: ถ้าส่งมา จะบันทึกลง outbox ใน transaction เดียวกับแถว Leave
+    # code: leave id ที่คงที่ (ตัวเดียวกับคอลัมน์ code ในชีต)
+    # mirror_to_sheet: งานเขียนชีตเข้า outbox ใน transaction เดียวกัน (backend=db)
+    name, leave_type, sd, ed, note = validate_leave(name, leave_type, start_date, end_date, note)
+
     leave = Leave(
         name=name,
         leave_type=leave_type,
         start_date=sd,
         end_date=ed,
         note=note,
+        code=code or None,
         # timestamp ไม่ต้องใส่ DB จะเติม CURRENT_TIMESTAMP ให้เอง
     )
 
     try:
         db.session.add(leave)
+        apply_leave_to_summary(name, leave_type, sd, +1)
+        bump_data_version()
+        if notify_message:
+            # ประเภทด่วน (TELEGRAM_URGENT_TYPES) ส่งทันที ไม่รอรวมในข้อความสรุป
+            enqueue_telegram(notify_message, urgent=is_urgent_leave_type(leave_type))
+        if mirror_to_sheet:
+            enqueue_sheet_add([{"name": name, "leave_type": leave_type, "start_date": sd,
+                                "end_date": ed, "note": note, "code": code}])
         db.session.commit()
         return leave.id
     except Exception:
         db.session.rollback()
         current_app.logger.exception("save_leave_to_db failed")
         # ส่งต่อให้ route ตอบ 500 หรือจับทำเป็นข้อความได้
-        raise
\ No newline at end of file
+        raise
+
+INSERT_BATCH_ROWS = 500  # แถวต่อ INSERT หลายแถวหนึ่งคำสั่ง
+
+def save_leaves_to_db(rows, notify_message=None, mirror_to_sheet=False, mirror_chunk=INSERT_BATCH_ROWS) -> int:
+    """
+    บันทึกหลายรายการ (นำเข้าแบบกลุ่ม) ใน transaction เดียว
+    rows = dict ที่ผ่าน validate_leave แล้ว: name, leave_type, start_date, end_date (date), note, code
+    INSERT ... VALUES (...), (...) ทีละ INSERT_BATCH_ROWS แถว + ปรับ leave_summary ครั้งเดียว
+    notify_message (ข้อความสรุป 1 ข้อความ) เข้า outbox พร้อมกัน; คืนจำนวนแถวที่บันทึก
+    mirror_to_sheet: งาน mirror ลงชีตเข้า outbox พร้อมกัน ก้อนละ mirror_chunk แถว (1 ก้อน = 1 append_rows)
+    """
+    cols = ("name", "leave_type", "start_date", "end_date", "note", "code")
+    try:
+        for i in range(0, len(rows), INSERT_BATCH_ROWS):
+            part = rows[i:i + INSERT_BATCH_ROWS]
+            db.session.execute(insert(Leave).values([{c: r.get(c) for c in cols} for r in part]))
+        apply_leaves_to_summary((r["name"], r["leave_type"], r["start_date"]) for r in rows)
+        bump_data_version()
+        if notify_message:
+            enqueue_telegram(notify_message)
+        if mirror_to_sheet:
+            step = max(1, mirror_chunk)
+            for i in range(0, len(rows), step):
+                enqueue_sheet_add(rows[i:i + step])
+        db.session.commit()
+        return len(rows)
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("save_leaves_to_db failed")
+        raise
+
+def enqueue_missing_sheet_rows(sheet_codes, chunk_rows=INSERT_BATCH_ROWS) -> int:
+    """
+    reconcile: แถว Leave ที่มี code แต่ไม่อยู่ในชีต → งาน mirror เข้า outbox ใหม่ (ก้อนละ chunk_rows แถว)
+    คืนจำนวนแถวที่ส่งเข้าคิว
+    """
+    cols = (Leave.name, Leave.leave_type, Leave.start_date, Leave.end_date, Leave.note, Leave.code)
+    try:
+        missing = [
+            r._asdict() for r in
+            db.session.query(*cols).filter(Leave.code.isnot(None)).order_by(Leave.id.asc()).yield_per(1000)
+            if r.code not in sheet_codes
+        ]
+        for i in range(0, len(missing), max(1, chunk_rows)):
+            enqueue_sheet_add(missing[i:i + chunk_rows])
+        db.session.commit()
+        return len(missing)
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("enqueue_missing_sheet_rows failed")
+        raise
+
+def touch_data_version() -> None:
+    """เพิ่มเวอร์ชันข้อมูลอย่างเดียว (กรณีแก้เฉพาะชีต เช่นลบแถวเก่าที่ไม่มี leave id)"""
+    try:
+        bump_data_version()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("touch_data_version failed")
+
+def delete_leave_from_db(code, mirror_to_sheet=False) -> bool:
+    """ลบแถว Leave ตาม leave id (ใช้ unique index ux_leave_code); mirror_to_sheet = งานลบในชีตเข้า outbox ด้วย"""
+    code = (code or "").strip()
+    if not code:
+        return False
+    try:
+        leave = Leave.query.filter_by(code=code).first()
+        if leave is None:
+            if mirror_to_sheet:
+                # ไม่มีใน DB แต่อาจยังค้างในชีต → ส่งงานลบไปด้วยเหมือนเดิม
+                enqueue_sheet_delete(code)
+                db.session.commit()
+            return False
+        apply_leave_to_summary(leave.name, leave.leave_type, leave.start_date, -1)
+        bump_data_version()
+        db.session.delete(leave)
+        if mirror_to_sheet:
+            enqueue_sheet_delete(code)
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("delete_leave_from_db failed")
+        raise
+
+def _parse_row_timestamp(value):
+    # Timestamp ที่หน้าเว็บได้จาก leave_to_row ("...Z") → datetime UTC แบบ naive ตามที่ DB เก็บ
+    try:
+        ts = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+def delete_legacy_leave_from_db(timestamp, code=None) -> bool:
+    """
+    ลบแถว Leave เก่าที่ยังไม่มี leave id ด้วย timestamp (โหมด LEAVE_READ_BACKEND=db แสดงแถวเหล่านี้จาก DB)
+    แถวที่มีรหัสลบ (code ที่ไม่ใช่ leave id) ต้องกรอกรหัสตรงกัน เหมือนการลบจากชีต
+    ถ้ามีหลายแถวเวลาเดียวกันจะลบแถวแรก เหมือนการลบจากชีตด้วย timestamp
+    """
+    ts = _parse_row_timestamp(timestamp)
+    if ts is None:
+        return False
+    try:
+        code = (code or "").strip()
+        match_code = (Leave.code == code) if code else or_(Leave.code.is_(None), Leave.code == "")
+        leave = (Leave.query.filter(match_code, Leave.timestamp == ts)
+                 .order_by(Leave.id.asc()).first())
+        if leave is None:
+            return False
+        apply_leave_to_summary(leave.name, leave.leave_type, leave.start_date, -1)
+        bump_data_version()
+        db.session.delete(leave)
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("delete_legacy_leave_from_db failed")
+        raise
+
+# ---- อ่านข้อมูลลาจาก MySQL (ใช้แทนการอ่านจาก Google Sheet) ---- #
+# คืนค่า dict รูปแบบเดียวกับแถวในชีต เพื่อให้ script.js / template ใช้ต่อได้ทันที
+
+def _fmt_ts(ts) -> str:
+    # DB เก็บเป็น UTC แบบ naive → ส่งออกเป็น ISO 8601 ลงท้าย Z เหมือนที่ add_leave เขียนลงชีต
+    if ts is None:
+        return ""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+def leave_to_row(leave) -> dict:
+    return {
+        "Timestamp": _fmt_ts(leave.timestamp),
+        "Name": leave.name,
+        "Leave Type": leave.leave_type,
+        "Start Date": leave.start_date.isoformat(),
+        "End Date": leave.end_date.isoformat(),
+        "Note": leave.note,
+        "code": leave.code or "",
+    }
+
+def month_bounds(month: str):
+    # "YYYY-MM" -> (วันแรกของเดือน, วันสุดท้ายของเดือน)
+    try:
+        y, m = (int(x) for x in str(month).split("-")[:2])
+        first = date(y, m, 1)
+    except (TypeError, ValueError) as e:
+        raise ValueError("month ต้องเป็นรูปแบบ YYYY-MM") from e
+    nxt = date(y + (m == 12), m % 12 + 1, 1)
+    return first, nxt - timedelta(days=1)
+
+def get_all_leaves_from_db():
+    # เรียงตามลำดับที่บันทึก (เหมือนลำดับแถวในชีต)
+    rows = Leave.query.order_by(Leave.timestamp.asc(), Leave.id.asc()).all()
+    return [leave_to_row(lv) for lv in rows]
+
+def query_leaves_page(limit, after=None, name=None, leave_type=None, date_from=None, date_to=None):
+    """
+    keyset pagination เรียงใหม่ -> เก่า ตาม (timestamp, id) ใช้ ix_leave_timestamp_desc
+    (InnoDB ต่อ primary key ท้าย secondary index อยู่แล้ว จึงครอบ id ด้วย)
+    after = (timestamp, id) ของแถวสุดท้ายในหน้าก่อน
+    คืน (rows, has_more)
+    """
+    q = Leave.query
+    if after is not None:
+        ts, last_id = after
+        q = q.filter(db.or_(
+            Leave.timestamp < ts,
+            db.and_(Leave.timestamp == ts, Leave.id < last_id),
+        ))
+    if name:
+        # prefix match ใช้ ix_leave_name_dates ได้
+        q = q.filter(Leave.name.startswith(name, autoescape=True))
+    if leave_type:
+        q = q.filter(Leave.leave_type == leave_type)
+    # ช่วงวันที่: เอาการลาที่ทับซ้อนกับช่วง [date_from, date_to]
+    if date_from:
+        q = q.filter(Leave.end_date >= date_from)
+    if date_to:
+        q = q.filter(Leave.start_date <= date_to)
+
+    items = q.order_by(Leave.timestamp.desc(), Leave.id.desc()).limit(limit + 1).all()
+    return items[:limit], len(items) > limit
+
+def get_leaves_by_month_from_db(month):
+    # การลาที่ทับซ้อนกับเดือน (รวมกรณีลาคร่อมทั้งเดือน) ใช้ ix_leave_end_start
+    first, last = month_bounds(month)
+    rows = (
+        Leave.query
+        .filter(Leave.end_date >= first, Leave.start_date <= last)
+        .order_by(Leave.start_date.asc(), Leave.id.asc())
+        .all()
+    )
+    return [leave_to_row(lv) for lv in rows]
+
+def get_leave_summary_by_month_from_db():
+    # อ่านจากตารางสรุป leave_summary (ดู services/summary_service.py) ไม่ต้องนับใหม่
+    return [{"month": m, "total": c} for m, c in get_summary(LeaveSummary.DIM_MONTH)]
+
+def get_leave_summary_by_person_from_db():
+    return [{"name": n, "total": c} for n, c in get_summary(LeaveSummary.DIM_PERSON)]
+
+def get_leave_summary_by_type_from_db():
+    return [{"leave_type": t, "total": c} for t, c in get_summary(LeaveSummary.DIM_TYPE)]
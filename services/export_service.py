@@ -0,0 +1,92 @@
+import csv
+import io
+import tempfile
+from datetime import date
+
+from models import db, User, Leave
+
+try:  # openpyxl เป็น optional: ไม่มีก็ export ได้เฉพาะ CSV
+    from openpyxl import Workbook
+except ImportError:  # pragma: no cover
+    Workbook = None
+
+EXPORT_BATCH_SIZE = 500     # แถวต่อการ query หนึ่งครั้ง
+STREAM_CHUNK_BYTES = 64 * 1024
+
+USER_COLUMNS = ["id", "username", "email", "is_verified", "is_admin"]
+LEAVE_COLUMNS = ["id", "code", "timestamp", "name", "leave_type", "start_date", "end_date", "note"]
+
+
+def xlsx_available() -> bool:
+    return Workbook is not None
+
+
+def _iter_keyset(query, id_col, batch_size=EXPORT_BATCH_SIZE):
+    """ไล่อ่านทีละ batch ด้วย id > last_id (ไม่ใช้ OFFSET) แล้วคืน session ทุก batch กันหน่วยความจำโต"""
+    last_id = 0
+    while True:
+        batch = query.filter(id_col > last_id).order_by(id_col.asc()).limit(batch_size).all()
+        if not batch:
+            return
+        for obj in batch:
+            yield obj
+        last_id = getattr(batch[-1], id_col.key)
+        db.session.expunge_all()
+
+
+def iter_user_rows():
+    for u in _iter_keyset(User.query, User.id):
+        yield [u.id, u.username, u.email, int(u.is_verified), int(u.is_admin)]
+
+
+def iter_leave_rows(date_from: date = None, date_to: date = None):
+    q = Leave.query
+    # ช่วงวันที่: การลาที่ทับซ้อนกับ [date_from, date_to]
+    if date_from:
+        q = q.filter(Leave.end_date >= date_from)
+    if date_to:
+        q = q.filter(Leave.start_date <= date_to)
+    for lv in _iter_keyset(q, Leave.id):
+        yield [
+            lv.id, lv.code or "",
+            lv.timestamp.isoformat(sep=" ") if lv.timestamp else "",
+            lv.name, lv.leave_type,
+            lv.start_date.isoformat(), lv.end_date.isoformat(), lv.note,
+        ]
+
+
+def stream_csv(columns, rows):
+    """yield CSV เป็นก้อน ๆ (ไบต์ utf-8) ทันทีที่ได้แถว → first byte ออกไปก่อนอ่านครบ"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= STREAM_CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def stream_xlsx(columns, rows, sheet_title="data"):
+    """
+    XLSX เป็นไฟล์ zip ต้องเขียนจบก่อนถึงจะส่งได้ → ใช้ openpyxl write_only (เขียนแถวลงไฟล์ชั่วคราวทีละแถว)
+    แล้วค่อยอ่านไฟล์ส่งออกเป็นก้อน หน่วยความจำคงที่ไม่ขึ้นกับจำนวนแถว
+    """
+    if Workbook is None:
+        raise RuntimeError("openpyxl is not installed")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_title)
+    ws.append(columns)
+    for row in rows:
+        ws.append(row)
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
@@ -1,17 +1,31 @@
 import os
+import re
+import atexit
+import logging
+import threading
+import time
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future
 from datetime import datetime, timezone
 from collections import defaultdict
 
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-
 from dotenv import load_dotenv
 
+try:  # ล็อกไฟล์ข้าม process (Linux/Docker); ไม่มีก็ล็อกได้แค่ใน process
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from .client_registry import gspread_client
+from .sheets_scheduler import sheets_call, READ, WRITE, BULK
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
-if not SPREADSHEET_ID:
-    raise RuntimeError("SPREADSHEET_ID is not set")
 
 # SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/spreadsheets"]
 SCOPES = [
@@ -20,10 +34,28 @@ SCOPES = [
 
 CREDS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "dataslothy-365d6e2908af.json")
 
-creds = ServiceAccountCredentials.from_json_keyfile_name(CREDS_FILE, SCOPES)
-gc = gspread.authorize(creds)
+# ---- เปิดชีตแบบ lazy: import โมดูลนี้ไม่ยิง network (boot worker / flask db / test ไม่ต้องมี credentials) ---- #
+_sheet_lock = threading.Lock()
+_sheet_obj = None
+
+
+def _sheet():
+    """worksheet แผ่นแรก เปิดครั้งแรกที่ใช้จริงแล้วเก็บไว้ทั้ง process"""
+    global _sheet_obj
+    if _sheet_obj is None:
+        with _sheet_lock:
+            if _sheet_obj is None:
+                if not SPREADSHEET_ID:
+                    raise RuntimeError("SPREADSHEET_ID is not set")
+                gc = gspread_client(CREDS_FILE, SCOPES)
+                _sheet_obj = sheets_call(lambda: gc.open_by_key(SPREADSHEET_ID).sheet1, kind=READ)  # แผ่นแรก
+    return _sheet_obj
 
-sheet = gc.open_by_key(SPREADSHEET_ID).sheet1  # แผ่นแรก
+
+def prewarm() -> None:
+    """เปิดชีตและโหลดหัวตารางล่วงหน้า (เรียกจาก prewarm ตอน start ถ้าเปิดไว้)"""
+    _sheet()
+    _get_headers()
 
 # ---- จัดการ HEader กับ data ---- #
 # เฮดเดอร์ขั้นต่ำที่คาดหวัง (ตามชีตของคุณ)
@@ -31,30 +63,397 @@ MIN_HEADERS = ["Timestamp", "Name", "Leave Type", "Start Date", "End Date", "Not
 # ถ้ามีคอลัมน์ "code" จะใช้ประกอบการลบด้วย
 OPTIONAL_HEADERS = ["code"]
 
+# ---- Read-through cache ของทั้งชีต ---- #
+# ทุกการอ่าน (data/calendar/dashboard) ใช้ snapshot เดียวกันภายใน TTL
+# TTL=0 คือปิด cache (อ่านชีตทุกครั้งเหมือนเดิม)
+SHEET_CACHE_TTL = float(os.getenv("SHEET_CACHE_TTL", "30"))
+
+_cache_lock = threading.Lock()
+_cache = {
+    "rows": None,        # list[list[str]] ผลจาก get_all_values()
+    "fetched_at": 0.0,   # time.monotonic() ตอนดึงล่าสุด
+    "generation": 0,     # เพิ่มทุกครั้งที่ invalidate กัน fetch เก่าเขียนทับ
+    "inflight": None,    # threading.Event ของ fetch ที่กำลังวิ่งอยู่ (single-flight)
+}
+_cache_stats = {"hits": 0, "misses": 0, "fetches": 0, "waits": 0, "invalidations": 0}
+
+
+def _load_rows():
+    """ดึงทั้งชีตผ่าน cache; ถ้ามี request อื่นกำลัง fetch อยู่ให้รอผลเดียวกัน"""
+    while True:
+        with _cache_lock:
+            rows = _cache["rows"]
+            if rows is not None and time.monotonic() - _cache["fetched_at"] < SHEET_CACHE_TTL:
+                _cache_stats["hits"] += 1
+                return rows
+            inflight = _cache["inflight"]
+            if inflight is None:
+                # เราเป็นคน fetch เอง
+                _cache_stats["misses"] += 1
+                inflight = _cache["inflight"] = threading.Event()
+                generation = _cache["generation"]
+                break
+            _cache_stats["waits"] += 1
+        # มีคนอื่น fetch อยู่ → รอแล้ววนกลับไปอ่าน cache
+        inflight.wait()
+        with _cache_lock:
+            rows = _cache["rows"]
+            if rows is not None and _cache["inflight"] is None:
+                return rows
+        # fetch ของคนอื่นล้ม/ถูก invalidate → ลองใหม่ (อาจได้เป็นคน fetch เอง)
+
+    try:
+        rows = sheets_call(_sheet().get_all_values, kind=READ)
+    except Exception:
+        with _cache_lock:
+            if _cache["inflight"] is inflight:
+                _cache["inflight"] = None
+        inflight.set()
+        raise
+
+    with _cache_lock:
+        _cache_stats["fetches"] += 1
+        # ถ้ามีการเขียนระหว่าง fetch (generation เปลี่ยน) ไม่เก็บผลนี้ลง cache
+        if _cache["generation"] == generation and SHEET_CACHE_TTL > 0:
+            _cache["rows"] = rows
+            _cache["fetched_at"] = time.monotonic()
+        if _cache["inflight"] is inflight:
+            _cache["inflight"] = None
+    inflight.set()
+    return rows
+
+
+def invalidate_sheet_cache():
+    """ล้าง cache ทันทีหลังเขียนชีต (add/delete) เพื่อให้อ่านครั้งถัดไปเห็นข้อมูลใหม่"""
+    with _cache_lock:
+        _cache["rows"] = None
+        _cache["fetched_at"] = 0.0
+        _cache["generation"] += 1
+        _cache_stats["invalidations"] += 1
+
+
+def get_sheet_cache_stats() -> dict:
+    """ตัวนับ hit/miss ของ cache (ใช้ดูใน /health)"""
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["ttl"] = SHEET_CACHE_TTL
+        stats["cached"] = _cache["rows"] is not None
+        stats["age"] = round(time.monotonic() - _cache["fetched_at"], 1) if _cache["rows"] is not None else None
+    return stats
+
+# ---- จบ cache ---- #
+
 def _fetch_headers_and_rows():
-    rows = sheet.get_all_values()
+    rows = _load_rows()
     if not rows:
         raise RuntimeError("Sheet is empty or inaccessible")
     headers = rows[0]
     data = rows[1:]
+    _observe_headers(headers)
     return headers, data
 
+class SheetSchemaError(RuntimeError):
+    """หัวตารางในชีตไม่ครบตาม MIN_HEADERS"""
+
 def _ensure_headers(headers):
     # กัน KeyError ด้วยการ normalize key เท่าที่ใช้
     missing = [h for h in MIN_HEADERS if h not in headers]
     if missing:
-        raise RuntimeError(f"Missing required headers: {missing}")
+        raise SheetSchemaError(f"Missing required headers: {missing}")
 
-# ---- จบ Header ----#
+# ---- Cache หัวตาราง (schema) ---- #
+# อ่านเฉพาะแถว 1 (ไม่ต้องดึงทั้งชีต) เก็บไว้ SHEET_HEADER_TTL วินาที
+# ฝั่งเขียน (append/delete) ใช้ cache เดียวกัน แล้วตรวจความกว้างตารางจาก response ของ append
+# ถ้าไม่ตรงกับหัวตารางที่ใช้ (มีคนเพิ่ม/ลบคอลัมน์) → อ่านแถว 1 ใหม่แล้วเขียนแถวที่เพิ่ง append ทับให้ตรงช่อง
+SHEET_HEADER_TTL = float(os.getenv("SHEET_HEADER_TTL", "3600"))
 
-def add_leave(name, leave_type, start_date, end_date, note):
-    # เวลาเก็บเป็น UTC ISO 8601 (Z) ให้หน้าเว็บไปแปลงเป็นเวลาไทยตอนแสดงผล
-    # ⚠️ จำไว้: script.js และ _alltable.html ต้องแปลงเวลาเป็น Asia/Bangkok (ตามที่คุยกัน)
-    ts_utc = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+_header_lock = threading.Lock()
+_header_cache = {"headers": None, "loaded_at": 0.0}
 
-    headers, _ = _fetch_headers_and_rows()
+def _read_header_row():
+    headers = sheets_call(_sheet().row_values, 1, kind=READ)  # อ่านเฉพาะแถว 1
+    if not headers:
+        raise RuntimeError("Sheet is empty or inaccessible")
     _ensure_headers(headers)
+    return headers
+
+def _get_headers(force: bool = False):
+    """คืนหัวตารางที่ validate แล้ว (จาก cache ถ้ายังไม่หมดอายุ)"""
+    with _header_lock:
+        headers = _header_cache["headers"]
+        fresh = headers is not None and time.monotonic() - _header_cache["loaded_at"] < SHEET_HEADER_TTL
+        if fresh and not force:
+            return headers
+        headers = _read_header_row()
+        _header_cache["headers"] = headers
+        _header_cache["loaded_at"] = time.monotonic()
+        return headers
+
+def _headers_for_write():
+    """หัวตารางสำหรับเขียน (cache ไม่เกิน SHEET_HEADER_TTL; schema ไม่ตรงจะถูกจับหลัง append ใน _append_records)"""
+    return _get_headers()
+
+def _col_number(a1_cell):
+    n = 0
+    for ch in a1_cell:
+        if not ch.isalpha():
+            break
+        n = n * 26 + (ord(ch.upper()) - ord("A") + 1)
+    return n
+
+def _table_width(resp):
+    # response ของ append: {"tableRange": "Sheet1!A1:H120", ...} = ตารางเดิมก่อน append (ไม่มีถ้าชีตว่าง)
+    try:
+        first, last = resp["tableRange"].split("!")[-1].split(":")
+        return _col_number(last) - _col_number(first) + 1
+    except Exception:
+        return None
+
+def _append_records(records, **kw):
+    """
+    append record (dict ตามชื่อคอลัมน์) ด้วยหัวตารางจาก cache คืน response ของ append
+    ตารางในชีตกว้างไม่เท่าหัวตารางที่ใช้ = schema เปลี่ยน → อ่านหัวตารางใหม่ ถ้าต่างจริงเขียนแถวเหล่านั้นทับใหม่ 1 ครั้ง
+    """
+    headers = _headers_for_write()
+    rows = [_row_for(headers, r) for r in records]
+    ws = _sheet()
+    if len(rows) == 1:
+        resp = sheets_call(ws.append_row, rows[0], value_input_option="USER_ENTERED", kind=WRITE, **kw)
+    else:
+        resp = sheets_call(ws.append_rows, rows, value_input_option="USER_ENTERED", kind=WRITE, **kw)
+    width = _table_width(resp)
+    if width is not None and width != len(headers):
+        fresh = _get_headers(force=True)
+        start = _parse_start_row(resp)
+        if fresh != headers and start is not None:
+            logger.warning("sheet header changed during write; rewriting %d rows at row %d", len(rows), start)
+            sheets_call(ws.update, f"A{start}", [_row_for(fresh, r) for r in records],
+                        value_input_option="USER_ENTERED", kind=WRITE, **kw)
+    return resp
+
+def _observe_headers(headers):
+    # ได้แถวหัวตารางมาฟรีจากการอ่านทั้งชีต: ถ้าไม่ตรงกับ cache แปลว่ามีคนแก้คอลัมน์ → อัปเดต cache
+    with _header_lock:
+        cached = _header_cache["headers"]
+        if cached is None or cached == headers:
+            return
+        try:
+            _ensure_headers(headers)
+        except SheetSchemaError:
+            # schema ใหม่ใช้ไม่ได้ → ล้าง cache ให้ฝั่งเขียนอ่านใหม่แล้ว error ชัด ๆ
+            _header_cache["headers"] = None
+            return
+        logger.info("sheet header changed: %r -> %r", cached, headers)
+        _header_cache["headers"] = list(headers)
+        _header_cache["loaded_at"] = time.monotonic()
 
+# ---- จบ Header ----#
+
+# ---- Index: leave id (คอลัมน์ code) -> เลขแถวในชีต ---- #
+# สร้างจาก snapshot ทั้งชีตครั้งเดียว แล้วดูแลต่อเองทุกครั้งที่ append/delete
+# (delete_rows ทำให้แถวหลังจากนั้นเลื่อนขึ้น 1 → ลดเลขแถวใน index ตาม)
+_index_lock = threading.RLock()
+_row_index = {"map": None}   # dict[code, row_number] หรือ None = ต้องสร้างใหม่
+
+# leave id = uuid4 hex 32 ตัว; ค่าอื่นในคอลัมน์ code คือรหัสลบที่ผู้ใช้ตั้งเอง (แถวเก่า) ต้องกรอกยืนยันตอนลบ
+_LEAVE_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+def is_leave_id(code) -> bool:
+    return bool(code) and _LEAVE_ID_RE.fullmatch(str(code).strip()) is not None
+
+def _rebuild_row_index():
+    invalidate_sheet_cache()  # ต้องการเลขแถวที่ตรงกับชีตจริง ณ ตอนนี้
+    headers, data = _fetch_headers_and_rows()
+    mapping = {}
+    if "code" in headers:
+        ci = headers.index("code")
+        for i, row in enumerate(data, start=2):
+            code = row[ci].strip() if len(row) > ci else ""
+            if is_leave_id(code):
+                mapping[code] = i
+    with _index_lock:
+        _row_index["map"] = mapping
+    return mapping
+
+def _index_lookup(code):
+    """คืน (เลขแถว หรือ None, index ถูกสร้างใหม่ในการเรียกนี้หรือไม่)"""
+    with _index_lock:
+        mapping = _row_index["map"]
+    rebuilt = mapping is None
+    if rebuilt:
+        mapping = _rebuild_row_index()
+    return mapping.get(code), rebuilt
+
+def _parse_start_row(resp):
+    # response ของ append: {"updates": {"updatedRange": "Sheet1!A10:G12", ...}}
+    try:
+        rng = resp["updates"]["updatedRange"].split("!")[-1]
+        first = rng.split(":")[0]
+        return int("".join(ch for ch in first if ch.isdigit()))
+    except Exception:
+        return None
+
+def _index_appended(codes, resp):
+    start = _parse_start_row(resp)
+    with _index_lock:
+        mapping = _row_index["map"]
+        if mapping is None:
+            return
+        if start is None:
+            _row_index["map"] = None  # ไม่รู้ตำแหน่งจริง → สร้างใหม่ตอนใช้ครั้งถัดไป
+            return
+        for offset, code in enumerate(codes):
+            if code:
+                mapping[code] = start + offset
+
+def _index_deleted(row_number):
+    with _index_lock:
+        mapping = _row_index["map"]
+        if mapping is None:
+            return
+        for code, r in list(mapping.items()):
+            if r == row_number:
+                del mapping[code]
+            elif r > row_number:
+                mapping[code] = r - 1
+
+# delete_rows ทำให้แถวหลังจากนั้นเลื่อนขึ้น → "ตรวจว่าแถวนี้ใช่ + ลบ" ต้องไม่มีการลบอื่นแทรกกลาง
+# ล็อกทั้งใน process (_index_lock) และข้าม gunicorn worker (flock ไฟล์) การ append ต่อท้ายไม่ทำให้แถวเลื่อนจึงไม่ต้องล็อก
+SHEET_LOCK_FILE = os.getenv("SHEET_LOCK_FILE") or os.path.join(tempfile.gettempdir(), "leave_sheet_rows.lock")
+
+@contextmanager
+def _row_delete_lock():
+    with _index_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(SHEET_LOCK_FILE, "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+# ---- จบ index ---- #
+
+# ---- Batch writer: รวมหลายแถวเป็น append_rows ครั้งเดียว ---- #
+# SHEET_WRITE_MODE=direct (เดิม: append_row ทีละแถว) หรือ batch (รวมแถวภายในหน้าต่างเวลา/จำนวนแถว)
+SHEET_WRITE_MODE = (os.getenv("SHEET_WRITE_MODE", "direct") or "direct").strip().lower()
+SHEET_BATCH_WINDOW = float(os.getenv("SHEET_BATCH_WINDOW", "2"))     # วินาทีที่รอรวมแถว
+SHEET_BATCH_MAX_ROWS = int(os.getenv("SHEET_BATCH_MAX_ROWS", "50"))  # ครบเท่านี้ flush ทันที
+
+
+class _AppendBatcher:
+    """
+    คิว FIFO + flusher thread เดียว → ลำดับแถวในชีตตรงกับลำดับที่ enqueue เสมอ
+    แต่ละแถวได้ Future ของตัวเอง: สำเร็จ = True, ล้มเหลว = exception ของแถวนั้น (ดู _write)
+    """
+
+    def __init__(self, window: float, max_rows: int):
+        self.window = window
+        self.max_rows = max(1, max_rows)
+        self._queue = deque()          # (record, Future, enqueued_at, code) — record แปลงเป็นแถวตอน flush
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # กัน flush ซ้อนกัน (thread กับ atexit)
+        self._thread = None
+        self._closed = False
+
+    def submit(self, record, code=None) -> Future:
+        fut = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("sheet batch writer is shut down")
+            self._queue.append((record, fut, time.monotonic(), code))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sheet-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return fut
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue and self._closed:
+                    return
+                # รอจนครบ window นับจากแถวแรก หรือจนแถวครบ max_rows
+                deadline = self._queue[0][2] + self.window
+                while len(self._queue) < self.max_rows and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+
+    def flush(self) -> int:
+        """เขียนทุกแถวที่ค้างอยู่ (ทีละไม่เกิน max_rows ต่อ request) คืนจำนวนแถวที่เขียนสำเร็จ"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    if not self._queue:
+                        break
+                    n = min(self.max_rows, len(self._queue))
+                    batch = [self._queue.popleft() for _ in range(n)]
+                try:
+                    written += self._write(batch)
+                finally:
+                    invalidate_sheet_cache()
+        return written
+
+    @staticmethod
+    def _append(items):
+        resp = _append_records([record for record, _, _, _ in items])
+        _index_appended([code for _, _, _, code in items], resp)
+        for _, fut, _, _ in items:
+            fut.set_result(True)
+        return len(items)
+
+    def _write(self, batch) -> int:
+        """
+        append ทั้งก้อน ลองซ้ำ 1 ครั้ง ถ้ายังล้มค่อยเขียนทีละแถว
+        แถวที่มีปัญหาจริง (เช่นค่าเสีย) ล้มเฉพาะ Future ของตัวเอง ไม่ลากแถวของ request อื่นในก้อนเดียวกันไปด้วย
+        """
+        for attempt in range(2):
+            try:
+                return self._append(batch)
+            except Exception:
+                logger.warning("sheet batch append failed (%d rows), attempt %d", len(batch), attempt + 1, exc_info=True)
+        written = 0
+        for item in batch:
+            try:
+                written += self._append([item])
+            except Exception as e:
+                logger.exception("sheet append failed for leave id %s", item[3])
+                item[1].set_exception(e)
+        return written
+
+    def shutdown(self) -> int:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        return self.flush()
+
+
+_batcher = _AppendBatcher(SHEET_BATCH_WINDOW, SHEET_BATCH_MAX_ROWS)
+
+
+@atexit.register
+def flush_pending_appends() -> int:
+    """flush แถวที่ค้างในคิวตอน process ปิด (gunicorn restart/graceful shutdown)"""
+    n = _batcher.pending()
+    if n:
+        logger.info("flushing %d queued sheet rows before exit", n)
+    return _batcher.shutdown()
+
+
+def _leave_record(ts_utc, name, leave_type, start_date, end_date, note, code=None) -> dict:
+    # ค่าตามชื่อคอลัมน์ (ยังไม่ผูกกับลำดับ) → แปลงเป็นแถวตอนเขียนจริงด้วยหัวตารางล่าสุด
     record = {
         "Timestamp": ts_utc,
         "Name": (name or "").strip(),
@@ -63,22 +462,93 @@ def add_leave(name, leave_type, start_date, end_date, note):
         "End Date": str(end_date).strip(),
         "Note": (note or "").strip(),
     }
+    # ถ้าชีตมีคอลัมน์ "code" จะได้ leave id ไปด้วย (ใช้ลบแบบไม่ต้อง scan ทั้งชีต)
+    if code:
+        record["code"] = code
+    return record
 
-    # ถ้าชีตมีคอลัมน์ "code" ให้เติมโค้ด (ใช้ timestamp เป็นโค้ดง่าย ๆ หรือจะเปลี่ยนเป็น uuid ก็ได้)
-    #if "code" in headers and "code" not in record:
-    #    record["code"] = ts_utc  # หรือจะใช้ uuid4().hex ก็ได้
 
+def _row_for(headers, record) -> list:
     # จัดเรียงค่าตามลำดับคอลัมน์จริงของชีต
-    row = [record.get(h, "") for h in headers]
+    return [record.get(h, "") for h in headers]
+
+
+def add_leave(name, leave_type, start_date, end_date, note, wait=True, code=None):
+    """
+    เพิ่ม 1 แถวลงชีต (code = leave id เดียวกับแถวใน MySQL เขียนลงคอลัมน์ "code")
+    - direct mode: append_row ทันที
+    - batch mode: เข้าคิว batch writer; wait=True รอผลของแถวนี้ (raise ถ้าก้อนนั้นล้ม),
+      wait=False คืน Future ทันที
+    """
+    # เวลาเก็บเป็น UTC ISO 8601 (Z) ให้หน้าเว็บไปแปลงเป็นเวลาไทยตอนแสดงผล
+    # ⚠️ จำไว้: script.js และ _alltable.html ต้องแปลงเวลาเป็น Asia/Bangkok (ตามที่คุยกัน)
+    ts_utc = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
+    record = _leave_record(ts_utc, name, leave_type, start_date, end_date, note, code)
+
+    if SHEET_WRITE_MODE == "batch":
+        fut = _batcher.submit(record, code)
+        if not wait:
+            return fut
+        return fut.result(timeout=SHEET_BATCH_WINDOW + 60)
+
+    if code and "code" not in _headers_for_write():
+        logger.warning("sheet has no 'code' column; leave id %s is not mirrored", code)
     # ให้ Google แปล format เอง (USER_ENTERED) หรือจะใช้ RAW ก็ได้ถ้าอยากเก็บตามสตริงเป๊ะ
-    sheet.append_row(row, value_input_option="USER_ENTERED")
+    resp = _append_records([record])
+    invalidate_sheet_cache()
+    _index_appended([code], resp)
+    return True
 
 
     #timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     #row = [timestamp, name, leave_type, start_date, end_date, note]
     #sheet.append_row(row)
 
+def add_leaves(records, chunk_rows=None) -> int:
+    """
+    เพิ่มหลายแถว (นำเข้าแบบกลุ่ม) ด้วย append_rows ทีละก้อน ผ่าน token bucket แบบ BULK
+    records = dict ที่มี name, leave_type, start_date, end_date, note, code
+    คืนจำนวนแถวที่เขียน; ก้อนใดล้มจะ raise (ก้อนก่อนหน้าเขียนไปแล้ว)
+    """
+    chunk_rows = max(1, chunk_rows or SHEET_BATCH_MAX_ROWS)
+    ts_utc = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    written = 0
+    if records and "code" not in _headers_for_write():
+        logger.warning("sheet has no 'code' column; leave ids of imported rows are not mirrored")
+    try:
+        for i in range(0, len(records), chunk_rows):
+            part = records[i:i + chunk_rows]
+            resp = _append_records([_leave_record(ts_utc, r["name"], r["leave_type"], r["start_date"],
+                                                  r["end_date"], r["note"], r.get("code")) for r in part],
+                                   priority=BULK)
+            _index_appended([r.get("code") for r in part], resp)
+            written += len(part)
+    finally:
+        invalidate_sheet_cache()
+    return written
+
+# ---- Mirror ถาวรผ่าน outbox (เมื่อใช้ MySQL เป็นแหล่งอ่านหลัก) ---- #
+# แถว Leave กับงาน mirror (channel="sheet") commit ใน transaction เดียวกัน แล้ว outbox worker เป็นคนเขียนชีต
+# ล้มก็ retry ตาม backoff ของ outbox; process ตาย/restart งานก็ยังอยู่ใน DB (ดู outbox_service.deliver_sheet)
+
+def mirror_add_leaves(records, recheck=False, chunk_rows=None) -> int:
+    """
+    append แถวที่ยังไม่มีในชีต (เทียบ code) — ส่งซ้ำได้ไม่เกิดแถวซ้ำ
+    recheck=True (งานที่เคยถูกจองแล้วรอบก่อน อาจ append ไปแล้วก่อน worker ตาย) → สร้าง index จากชีตจริงก่อน
+    chunk_rows = แถวต่อ append_rows (ส่งต่อให้ add_leaves)
+    """
+    if recheck:
+        _rebuild_row_index()
+    pending = [r for r in records if not r.get("code") or _index_lookup(r["code"])[0] is None]
+    if len(pending) < len(records):
+        logger.info("sheet mirror: %d of %d rows already in sheet", len(records) - len(pending), len(records))
+    return add_leaves(pending, chunk_rows) if pending else 0
+
+def sheet_leave_codes() -> set:
+    """leave id ทั้งหมดที่อยู่ในชีตตอนนี้ (อ่านจากชีตจริง ใช้ตอน reconcile)"""
+    return set(_rebuild_row_index())
+
 def get_all_leaves():
     headers, data = _fetch_headers_and_rows()
     _ensure_headers(headers)
@@ -100,11 +570,18 @@ def get_leaves_by_month(month):  # month "YYYY-MM"
     for row in data:
         sd = row[idx["Start Date"]] if len(row) > idx["Start Date"] else ""
         ed = row[idx["End Date"]] if len(row) > idx["End Date"] else ""
-        if sd.startswith(month) or ed.startswith(month):
+        # ทับซ้อนกับเดือน: เริ่มไม่หลังสิ้นเดือน และจบไม่ก่อนต้นเดือน (เทียบสตริง ISO ได้ตรง)
+        if sd and ed and sd[:7] <= month <= ed[:7]:
             out.append(dict(zip(headers, row)))
     return out
 
 def delete_leave(timestamp, code):
+    with _row_delete_lock():
+        # worker อื่นอาจลบแถวไปแล้ว (เลขแถวใน snapshot เลื่อน) → อ่านชีตใหม่ภายใต้ล็อก
+        invalidate_sheet_cache()
+        return _delete_by_timestamp(timestamp, code)
+
+def _delete_by_timestamp(timestamp, code):
     headers, data = _fetch_headers_and_rows()
 
     # หา index ของคอลัมน์ที่ต้องใช้
@@ -128,13 +605,54 @@ def delete_leave(timestamp, code):
             if code and row_code and row_code != code:
                 continue
             # ถ้า code ฝั่งใดฝั่งหนึ่งว่าง → ยอมลบด้วย timestamp
-        sheet.delete_rows(i)
+        sheets_call(_sheet().delete_rows, i, kind=WRITE)
+        invalidate_sheet_cache()
+        _index_deleted(i)
+        return True
+    return False
+
+def delete_leave_by_id(code) -> bool:
+    """
+    ลบแถวที่คอลัมน์ code ตรงกับ leave id โดยใช้ index (ไม่ scan ทั้งชีต)
+    ก่อนลบจะอ่านเซลล์ code ของแถวนั้น 1 เซลล์เพื่อยืนยัน ถ้าไม่ตรง (เช่น worker อื่นลบแถวก่อนหน้าไปแล้ว)
+    จะสร้าง index ใหม่แล้วลองอีกครั้ง
+    """
+    code = (code or "").strip()
+    if not is_leave_id(code):
+        return False
+    if SHEET_WRITE_MODE == "batch":
+        _batcher.flush()  # แถวนี้อาจยังค้างในคิว append
+
+    with _row_delete_lock():
+        headers = _headers_for_write()
+        if "code" in headers and _delete_indexed(code, headers.index("code") + 1):
+            return True
+        # ไม่เจอ/เซลล์ไม่ตรง อาจเพราะหัวตารางใน cache เก่า (คอลัมน์ code ย้าย) → อ่านใหม่แล้วลองอีกครั้งถ้าเปลี่ยนจริง
+        fresh = _get_headers(force=True)
+        if fresh == headers or "code" not in fresh:
+            return False
+        return _delete_indexed(code, fresh.index("code") + 1)
+
+def _delete_indexed(code, code_col) -> bool:
+    for attempt in range(2):
+        row_number, rebuilt = _index_lookup(code)
+        if row_number is None:
+            if attempt == 0 and not rebuilt:
+                _rebuild_row_index()
+                continue
+            return False
+        if (sheets_call(_sheet().cell, row_number, code_col, kind=READ).value or "").strip() != code:
+            _rebuild_row_index()
+            continue
+        sheets_call(_sheet().delete_rows, row_number, kind=WRITE)
+        invalidate_sheet_cache()
+        _index_deleted(row_number)
         return True
     return False
 
 #---ส่วนการดึง dashboard---------#
 #def get_all_data():
-    values = sheet.get_all_values()
+    values = _sheet().get_all_values()
     headers = values[0]
     data = values[1:]
 
@@ -200,3 +718,15 @@ def get_leave_summary_by_person():
         {"name": n, "total": c}
         for n, c in sorted(person_counts.items(), key=lambda x: x[1], reverse=True)
     ]
+
+def get_leave_summary_by_type():
+    rows = get_all_data()
+    type_counts = defaultdict(int)
+    for row in rows:
+        leave_type = (row.get("Leave Type") or "").strip()
+        if leave_type:
+            type_counts[leave_type] += 1
+    return [
+        {"leave_type": t, "total": c}
+        for t, c in sorted(type_counts.items(), key=lambda x: x[1], reverse=True)
+    ]
@@ -0,0 +1,137 @@
+import os
+import gzip
+import time
+import hashlib
+from functools import wraps
+
+from flask import request, session, make_response
+from flask_login import current_user
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from models import db, DataVersion
+
+try:  # brotli เป็น optional: ไม่มีก็ใช้ gzip อย่างเดียว
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+LEAVE_VERSION_KEY = "leave"
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # ไบต์; เล็กกว่านี้ไม่คุ้มบีบ
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/csv"}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # เร็วพอสำหรับ Raspberry Pi แต่ยังเล็กกว่า gzip
+
+
+# ---- Data version ---- #
+
+def bump_data_version(name: str = LEAVE_VERSION_KEY) -> None:
+    """เพิ่มเวอร์ชันใน session ปัจจุบัน (ไม่ commit) ให้ไปพร้อมการเขียนข้อมูลหลัก"""
+    stmt = mysql_insert(DataVersion).values(name=name, version=1)
+    stmt = stmt.on_duplicate_key_update(version=DataVersion.version + 1)
+    db.session.execute(stmt)
+
+
+def current_data_version(name: str = LEAVE_VERSION_KEY) -> int:
+    row = db.session.get(DataVersion, name, populate_existing=True)
+    return row.version if row else 0
+
+
+# ---- Conditional GET (ETag / If-None-Match) ---- #
+
+def _etag_matches(etag: str) -> bool:
+    header = request.headers.get("If-None-Match", "")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # เทียบแบบ weak: ตัด W/ ออกทั้งสองฝั่ง
+    candidates = {c.strip().removeprefix("W/") for c in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def conditional_get(*, bucket_seconds: int = 0, extra=None):
+    """
+    decorator สำหรับ GET ที่ผลลัพธ์ขึ้นกับข้อมูลการลาเท่านั้น
+    ETag = เวอร์ชันข้อมูล + URL (รวม query) + ผู้ใช้; ตรงกับ If-None-Match → 304 ไม่ต้องสร้าง payload ใหม่
+    bucket_seconds: ให้ ETag เปลี่ยนตามช่วงเวลาด้วย (เช่นหน้า HTML ที่ฝัง CSRF token ซึ่งมีอายุ)
+    extra: callable คืนสตริงเพิ่มเติมที่มีผลต่อเนื้อหา (เช่น snapshot ของ cache ชีต)
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            parts = [
+                str(current_data_version()),
+                request.full_path,
+                str(getattr(current_user, "id", "")),
+            ]
+            if bucket_seconds:
+                parts.append(str(int(time.time() // bucket_seconds)))
+            if extra is not None:
+                parts.append(str(extra()))
+            digest = hashlib.sha1("|".join(parts).encode()).hexdigest()[:20]
+            etag = f'W/"{digest}"'
+
+            # มี flash ค้างอยู่ → ต้อง render ใหม่ให้ข้อความแสดง
+            if _etag_matches(etag) and not session.get("_flashes"):
+                resp = make_response("", 304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.headers["ETag"] = etag
+            # private: มีข้อมูลเฉพาะผู้ใช้ที่ล็อกอิน; no-cache: ต้อง revalidate ทุกครั้ง (ได้ 304 ถ้าไม่เปลี่ยน)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+        return wrapper
+    return decorator
+
+
+# ---- Compression (gzip / brotli) ---- #
+
+def _accepts(encoding: str) -> bool:
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        token, _, params = item.strip().partition(";")
+        if token.strip().lower() != encoding:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            key, _, value = p.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+
+def compress_response(resp):
+    """after_request: บีบอัด JSON/HTML/CSV ที่ใหญ่กว่า COMPRESS_MIN_SIZE"""
+    resp.vary.add("Accept-Encoding")
+    if (
+        resp.status_code != 200
+        or resp.direct_passthrough
+        or resp.is_streamed
+        or "Content-Encoding" in resp.headers
+        or resp.mimetype not in COMPRESS_MIMETYPES
+    ):
+        return resp
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return resp
+
+    if brotli is not None and _accepts("br"):
+        body, encoding = brotli.compress(data, quality=BROTLI_QUALITY), "br"
+    elif _accepts("gzip"):
+        body, encoding = gzip.compress(data, compresslevel=GZIP_LEVEL), "gzip"
+    else:
+        return resp
+
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    resp.headers["Content-Length"] = str(len(body))
+    return resp
+
+
+def init_http_cache(app) -> None:
+    app.after_request(compress_response)
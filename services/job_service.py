@@ -0,0 +1,173 @@
+import os
+import time
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+from uuid import uuid4
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ReportJob
+from .pedx_sync_service import sync_pedx, SYNC_MODES
+
+logger = logging.getLogger(__name__)
+
+# ถ้างาน running ไม่อัปเดต heartbeat นานเกินนี้ (เช่น worker ถูก restart) ถือว่าตายแล้ว
+REPORT_JOB_STALE_SECONDS = int(os.getenv("REPORT_JOB_STALE_SECONDS", "300"))
+PROGRESS_FLUSH_SECONDS = 1.0  # เขียน progress ลง DB ไม่ถี่กว่านี้
+# thread แยกต่ออายุ heartbeat ทุกกี่วินาที (ช่วง query HOSxP นานๆ ไม่มี progress เลย)
+REPORT_JOB_HEARTBEAT_SECONDS = float(os.getenv("REPORT_JOB_HEARTBEAT_SECONDS", str(max(5, REPORT_JOB_STALE_SECONDS // 5))))
+STALE_ERROR = "worker หยุดทำงานระหว่างรัน (heartbeat หมดอายุ)"
+
+
+class JobConflict(Exception):
+    """มีงานของแผ่นงานเดียวกันกำลังรันอยู่"""
+
+    def __init__(self, job_id):
+        super().__init__(f"job {job_id} is already running for this worksheet")
+        self.job_id = job_id
+
+
+def _utcnow():
+    # DB เก็บ UTC แบบ naive (ดู models.py)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _stale_cutoff():
+    return _utcnow() - timedelta(seconds=REPORT_JOB_STALE_SECONDS)
+
+
+def _expire_stale(worksheet: str) -> None:
+    cutoff = _stale_cutoff()
+    stale = ReportJob.query.filter(
+        ReportJob.active_worksheet == worksheet,
+        db.func.coalesce(ReportJob.heartbeat_at, ReportJob.created_at) < cutoff,
+    ).all()
+    for job in stale:
+        job.status = ReportJob.STATUS_FAILED
+        job.error = STALE_ERROR
+        job.active_worksheet = None
+        job.finished_at = _utcnow()
+    if stale:
+        db.session.commit()
+
+
+def submit_pedx_job(app, start_date: str, worksheet: str, user_id=None, mode=None) -> str:
+    """
+    สร้างงานแล้วรันใน thread เบื้องหลัง คืน job id ทันที
+    ValueError = start_date ไม่ถูกต้อง, JobConflict = มีงานของแผ่นงานนี้ค้างอยู่
+    """
+    try:
+        sd = date.fromisoformat(start_date)
+    except ValueError as e:
+        raise ValueError("start_date ต้องเป็นรูปแบบ YYYY-MM-DD") from e
+    if mode and mode not in SYNC_MODES:
+        raise ValueError(f"mode ต้องเป็นหนึ่งใน {', '.join(SYNC_MODES)}")
+
+    _expire_stale(worksheet)
+    job = ReportJob(
+        id=uuid4().hex,
+        worksheet=worksheet,
+        active_worksheet=worksheet,
+        start_date=sd,
+        status=ReportJob.STATUS_QUEUED,
+        created_by=user_id,
+        heartbeat_at=_utcnow(),
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # unique index ux_report_job_active: มีงานอื่นถืออยู่ (กันได้แม้มาจากคนละ gunicorn worker)
+        db.session.rollback()
+        running = ReportJob.query.filter_by(active_worksheet=worksheet).first()
+        raise JobConflict(running.id if running else None)
+
+    t = threading.Thread(target=_run_job, args=(app, job.id, start_date, mode), name=f"pedx-job-{job.id[:8]}", daemon=True)
+    t.start()
+    return job.id
+
+
+def _heartbeat_loop(app, job_id: str, stop: threading.Event) -> None:
+    # session แยกจาก thread ที่รันงาน: UPDATE เฉพาะ heartbeat_at แล้ว commit ทันที ไม่แตะ progress ที่ยังไม่ flush
+    with app.app_context():
+        try:
+            while not stop.wait(REPORT_JOB_HEARTBEAT_SECONDS):
+                try:
+                    ReportJob.query.filter(
+                        ReportJob.id == job_id, ReportJob.status == ReportJob.STATUS_RUNNING,
+                    ).update({ReportJob.heartbeat_at: _utcnow()}, synchronize_session=False)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("heartbeat update failed for job %s", job_id)
+        finally:
+            db.session.remove()
+
+
+def _run_job(app, job_id: str, start_date: str, mode=None) -> None:
+    with app.app_context():
+        job = db.session.get(ReportJob, job_id)
+        job.status = ReportJob.STATUS_RUNNING
+        job.started_at = job.heartbeat_at = _utcnow()
+        db.session.commit()
+
+        last_flush = [0.0]
+
+        def progress(phase, rows_fetched=0, rows_uploaded=0):
+            job.phase = phase
+            job.rows_fetched = rows_fetched
+            job.rows_uploaded = rows_uploaded
+            now = time.monotonic()
+            if phase in ("done", "clear") or now - last_flush[0] >= PROGRESS_FLUSH_SECONDS:
+                job.heartbeat_at = _utcnow()
+                db.session.commit()
+                last_flush[0] = now
+
+        # heartbeat เดินตลอดที่ thread นี้ยังมีชีวิต แม้ sync_pedx จะติดอยู่ใน query เดียวนานเกิน REPORT_JOB_STALE_SECONDS
+        stop = threading.Event()
+        threading.Thread(target=_heartbeat_loop, args=(app, job_id, stop),
+                         name=f"pedx-heartbeat-{job_id[:8]}", daemon=True).start()
+        try:
+            result = sync_pedx(start_date, mode=mode, progress=progress)
+            job.status = ReportJob.STATUS_SUCCEEDED
+            job.rows_uploaded = result.get("rows", job.rows_uploaded)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("PEDX job %s failed", job_id)
+            job = db.session.get(ReportJob, job_id)
+            job.status = ReportJob.STATUS_FAILED
+            job.error = f"{type(e).__name__}: {e}"[:255]
+        finally:
+            stop.set()
+            job.active_worksheet = None
+            job.finished_at = job.heartbeat_at = _utcnow()
+            db.session.commit()
+            db.session.remove()
+
+
+def get_job_status(job_id: str):
+    """
+    อ่านอย่างเดียว: งานที่ heartbeat หมดอายุแสดงเป็น failed แต่ไม่เขียน DB
+    (ปลดแผ่นงานจริงตอนส่งงานใหม่ใน submit_pedx_job)
+    """
+    job = db.session.get(ReportJob, job_id, populate_existing=True)
+    if job is None:
+        return None
+    status, error = job.status, job.error
+    if job.active_worksheet and (job.heartbeat_at or job.created_at) < _stale_cutoff():
+        status, error = ReportJob.STATUS_FAILED, STALE_ERROR
+    start = job.started_at or job.created_at
+    end = job.finished_at or _utcnow()
+    return {
+        "id": job.id,
+        "worksheet": job.worksheet,
+        "start_date": job.start_date.isoformat(),
+        "status": status,
+        "phase": job.phase,
+        "rows_fetched": job.rows_fetched,
+        "rows_uploaded": job.rows_uploaded,
+        "elapsed_seconds": round((end - start).total_seconds(), 1) if start else 0,
+        "error": error,
+        "finished": status in (ReportJob.STATUS_SUCCEEDED, ReportJob.STATUS_FAILED),
+    }
@@ -0,0 +1,164 @@
+import io
+import os
+import csv
+import codecs
+import html
+from collections import Counter
+from datetime import date, datetime
+from uuid import uuid4
+
+from . import data_service as db_store
+from .outbox_service import wake_outbox_worker
+
+try:  # openpyxl เป็น optional: ไม่มีก็นำเข้าได้เฉพาะ CSV
+    from openpyxl import load_workbook
+except ImportError:  # pragma: no cover
+    load_workbook = None
+
+# ---- นำเข้าการลาแบบกลุ่มจาก CSV/XLSX (ข้อมูลย้อนหลัง/จากฝ่ายบุคคล) ---- #
+LEAVE_IMPORT_MAX_ROWS = int(os.getenv("LEAVE_IMPORT_MAX_ROWS", "5000"))
+LEAVE_IMPORT_SHEET_CHUNK = int(os.getenv("LEAVE_IMPORT_SHEET_CHUNK", "200"))  # แถวต่องาน mirror ใน outbox = แถวต่อ append_rows
+IMPORT_FORMATS = ("csv", "xlsx")
+
+# หัวคอลัมน์ที่รับ (ตัวพิมพ์เล็ก, ช่องว่าง/ขีด → _) ใช้หัวเดียวกับชีตหรือไฟล์ export ได้เลย
+_COLUMNS = ("name", "leave_type", "start_date", "end_date", "note")
+_REQUIRED = ("name", "leave_type", "start_date", "end_date")
+
+
+def xlsx_available() -> bool:
+    return load_workbook is not None
+
+
+def import_format(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if ext not in IMPORT_FORMATS:
+        raise ValueError("รองรับเฉพาะไฟล์ .csv หรือ .xlsx")
+    if ext == "xlsx" and not xlsx_available():
+        raise ValueError("ยังไม่ได้ติดตั้ง openpyxl สำหรับนำเข้า XLSX")
+    return ext
+
+
+def _norm_header(value) -> str:
+    return str(value or "").strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def _cell(value) -> str:
+    # XLSX อาจให้ datetime/date/ตัวเลขมา → แปลงเป็นสตริงแบบเดียวกับ CSV
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def _iter_csv(stream):
+    # ไม่ห่อด้วย TextIOWrapper: SpooledTemporaryFile ของ Werkzeug บน Python 3.10 ไม่มี readable()/seekable()
+    # วนบรรทัดแบบ bytes แล้ว decode ทีละบรรทัด (ไม่ต้องโหลดทั้งไฟล์)
+    try:
+        yield from csv.reader(codecs.iterdecode(stream, "utf-8-sig"))
+    except UnicodeDecodeError as e:
+        raise ValueError("ไฟล์ CSV ต้องเข้ารหัสเป็น UTF-8") from e
+
+
+def _iter_xlsx(stream):
+    # zipfile ต้อง seek ไปมา → คัดลอกเป็น BytesIO ก่อน (XLSX บีบอัดอยู่แล้ว ไฟล์ไม่ใหญ่)
+    # read_only: อ่านทีละแถวจาก zip ไม่สร้าง cell object ทั้งชีต
+    wb = load_workbook(io.BytesIO(stream.read()), read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
+def iter_import_rows(stream, fmt: str):
+    """
+    อ่านไฟล์ทีละแถว คืน (เลขแถวในไฟล์, dict ตาม _COLUMNS) ข้ามแถวว่าง
+    ValueError ถ้าไม่มีหัวตาราง/ขาดคอลัมน์ที่จำเป็น หรือแถวเกิน LEAVE_IMPORT_MAX_ROWS
+    """
+    rows = _iter_xlsx(stream) if fmt == "xlsx" else _iter_csv(stream)
+    header = next(rows, None)
+    if not header:
+        raise ValueError("ไฟล์ว่างหรือไม่มีหัวตาราง")
+    index = {}
+    for i, h in enumerate(header):
+        key = _norm_header(h)
+        if key in _COLUMNS and key not in index:
+            index[key] = i
+    missing = [c for c in _REQUIRED if c not in index]
+    if missing:
+        raise ValueError("ไม่พบคอลัมน์: " + ", ".join(missing))
+
+    count = 0
+    for line_no, raw in enumerate(rows, start=2):
+        values = {c: _cell(raw[i]) if i < len(raw) else "" for c, i in index.items()}
+        if not any(values.values()):
+            continue
+        count += 1
+        if count > LEAVE_IMPORT_MAX_ROWS:
+            raise ValueError(f"นำเข้าได้ไม่เกิน {LEAVE_IMPORT_MAX_ROWS} แถวต่อไฟล์")
+        yield line_no, values
+
+
+def validate_import(stream, fmt: str):
+    """ตรวจทุกแถวด้วยกฎเดียวกับ save_leave_to_db คืน (แถวที่ใช้ได้, รายการ error ต่อแถว)"""
+    valid, errors = [], []
+    for line_no, values in iter_import_rows(stream, fmt):
+        problems = [f"ต้องระบุ {c}" for c in ("name", "leave_type") if not values.get(c)]
+        try:
+            name, leave_type, sd, ed, note = db_store.validate_leave(
+                values.get("name"), values.get("leave_type"),
+                values.get("start_date"), values.get("end_date"), values.get("note"),
+            )
+        except ValueError as e:
+            problems.append(str(e))
+        if problems:
+            errors.append({"row": line_no, "errors": problems, "values": values})
+            continue
+        valid.append({"row": line_no, "name": name, "leave_type": leave_type,
+                      "start_date": sd, "end_date": ed, "note": note})
+    return valid, errors
+
+
+def _summary_message(rows, imported_by=None) -> str:
+    types = Counter(r["leave_type"] for r in rows)
+    people = len({r["name"] for r in rows})
+    first = min(r["start_date"] for r in rows)
+    last = max(r["end_date"] for r in rows)
+    lines = [
+        "📥 <b>นำเข้าการลาแบบกลุ่ม</b>",
+        f"🧾 <b>จำนวน:</b> {len(rows)} รายการ ({people} คน)",
+        f"📅 <b>ช่วง:</b> {first.isoformat()} ถึง {last.isoformat()}",
+    ]
+    lines += [f"📝 {html.escape(t)}: {n}" for t, n in types.most_common()]
+    if imported_by:
+        lines.append(f"👤 <b>โดย:</b> {html.escape(imported_by)}")
+    return "\n".join(lines)
+
+
+def import_leaves(stream, filename: str, dry_run: bool = False, imported_by=None) -> dict:
+    """
+    นำเข้าการลาจากไฟล์ CSV/XLSX
+    - แถวที่ไม่ผ่านจะไม่ถูกบันทึก และกลับมาใน "errors" (เลขแถวในไฟล์ + เหตุผล)
+    - แถวที่ผ่าน: INSERT หลายแถวใน transaction เดียว พร้อมงาน mirror ชีตเข้า outbox
+      ก้อนละ LEAVE_IMPORT_SHEET_CHUNK แถว (worker append_rows ให้ ซ้ำได้ไม่เกิดแถวซ้ำ)
+      เขียน DB ก่อนเสมอทั้งสอง backend: ล้มกลางทางก็ rollback ทั้งไฟล์ นำเข้าไฟล์เดิมซ้ำได้ไม่เกิดแถวซ้ำในชีต
+    - แจ้งเตือน Telegram สรุป 1 ข้อความต่อไฟล์
+    dry_run=True ตรวจอย่างเดียวไม่บันทึก; ValueError = ไฟล์ใช้ไม่ได้ทั้งไฟล์
+    """
+    fmt = import_format(filename)
+    valid, errors = validate_import(stream, fmt)
+    report = {"rows": len(valid) + len(errors), "valid": len(valid), "imported": 0,
+              "errors": errors, "dry_run": dry_run}
+    if dry_run or not valid:
+        return report
+
+    for r in valid:
+        r["code"] = uuid4().hex  # leave id เดียวกันทั้ง DB และชีต
+    message = _summary_message(valid, imported_by)
+    report["imported"] = db_store.save_leaves_to_db(valid, message, mirror_to_sheet=True,
+                                                    mirror_chunk=LEAVE_IMPORT_SHEET_CHUNK)
+    wake_outbox_worker()
+    return report
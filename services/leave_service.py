@@ -0,0 +1,218 @@
+import os
+import json
+import logging
+import base64
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+
+from . import google_sheet_service as sheet_store
+from . import data_service as db_store
+from .outbox_service import wake_outbox_worker
+
+logger = logging.getLogger(__name__)
+
+# แหล่งอ่านข้อมูลลา: "sheet" (เดิม) หรือ "db" (MySQL ตาราง leave, ชีตเป็น mirror เบื้องหลัง)
+LEAVE_READ_BACKEND = (os.getenv("LEAVE_READ_BACKEND", "sheet") or "sheet").strip().lower()
+if LEAVE_READ_BACKEND not in ("sheet", "db"):
+    raise RuntimeError(f"LEAVE_READ_BACKEND must be 'sheet' or 'db', got {LEAVE_READ_BACKEND!r}")
+
+
+def reads_from_db() -> bool:
+    return LEAVE_READ_BACKEND == "db"
+
+
+def get_all_leaves():
+    if reads_from_db():
+        return db_store.get_all_leaves_from_db()
+    return sheet_store.get_all_leaves()
+
+
+# ---- /data แบบแบ่งหน้า (cursor) + filter ---- #
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 200
+
+
+def _encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, dict):
+            raise ValueError
+        return payload
+    except Exception as e:
+        raise ValueError("cursor ไม่ถูกต้อง") from e
+
+
+def _parse_date(value, field):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError as e:
+        raise ValueError(f"{field} ต้องเป็นรูปแบบ YYYY-MM-DD") from e
+
+
+def get_leaves_page(limit=None, cursor=None, name=None, leave_type=None, date_from=None, date_to=None) -> dict:
+    """
+    คืน {"items": [...], "next_cursor": str|None, "limit": n} เรียงจากบันทึกล่าสุดไปเก่าสุด
+    name = prefix ของชื่อ, leave_type = ตรงตัว, date_from/date_to = การลาที่ทับซ้อนช่วงนี้
+    ValueError = พารามิเตอร์ไม่ถูกต้อง (route ตอบ 400)
+    """
+    try:
+        limit = int(limit) if limit not in (None, "") else PAGE_DEFAULT_LIMIT
+    except ValueError as e:
+        raise ValueError("limit ต้องเป็นตัวเลข") from e
+    limit = max(1, min(limit, PAGE_MAX_LIMIT))
+    name = (name or "").strip() or None
+    leave_type = (leave_type or "").strip() or None
+    d_from = _parse_date(date_from, "date_from")
+    d_to = _parse_date(date_to, "date_to")
+    state = _decode_cursor(cursor) if cursor else {}
+
+    if reads_from_db():
+        after = None
+        if state:
+            try:
+                after = (datetime.fromisoformat(state["t"]), int(state["i"]))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError("cursor ไม่ถูกต้อง") from e
+        leaves, has_more = db_store.query_leaves_page(limit, after, name, leave_type, d_from, d_to)
+        next_cursor = None
+        if has_more and leaves:
+            last = leaves[-1]
+            next_cursor = _encode_cursor({"t": last.timestamp.isoformat(), "i": last.id})
+        return {"items": [db_store.leave_to_row(lv) for lv in leaves], "next_cursor": next_cursor, "limit": limit}
+
+    # ชีต: กรองจาก snapshot ที่ cache ไว้ แล้วใช้ offset เป็น cursor
+    try:
+        offset = int(state.get("o", 0))
+    except (TypeError, ValueError) as e:
+        raise ValueError("cursor ไม่ถูกต้อง") from e
+    rows = []
+    for row in reversed(sheet_store.get_all_leaves()):
+        if name and not (row.get("Name") or "").startswith(name):
+            continue
+        if leave_type and (row.get("Leave Type") or "").strip() != leave_type:
+            continue
+        if d_from and (row.get("End Date") or "") < d_from.isoformat():
+            continue
+        if d_to and (row.get("Start Date") or "") > d_to.isoformat():
+            continue
+        rows.append(row)
+    page = rows[offset:offset + limit]
+    next_offset = offset + limit
+    next_cursor = _encode_cursor({"o": next_offset}) if next_offset < len(rows) else None
+    return {"items": page, "next_cursor": next_cursor, "limit": limit}
+
+
+def get_leaves_by_month(month):
+    if reads_from_db():
+        return db_store.get_leaves_by_month_from_db(month)
+    return sheet_store.get_leaves_by_month(month)
+
+
+def expand_days(rows, month) -> dict:
+    """
+    แตกการลาเป็นรายวันภายในเดือน: {"YYYY-MM-DD": ["ชื่อ (ประเภท)", ...]}
+    หน้าเว็บเอาไปวาดปฏิทินได้เลยไม่ต้องไล่ช่วงวันเอง
+    """
+    first, last = db_store.month_bounds(month)
+    days = {}
+    for row in rows:
+        try:
+            sd = date.fromisoformat(str(row.get("Start Date", ""))[:10])
+            ed = date.fromisoformat(str(row.get("End Date", ""))[:10])
+        except ValueError:
+            continue
+        label = f"{row.get('Name', '')} ({row.get('Leave Type', '')})"
+        d = max(sd, first)
+        end = min(ed, last)
+        while d <= end:
+            days.setdefault(d.isoformat(), []).append(label)
+            d += timedelta(days=1)
+    return days
+
+
+def get_leave_summary_by_month():
+    if reads_from_db():
+        return db_store.get_leave_summary_by_month_from_db()
+    return sheet_store.get_leave_summary_by_month()
+
+
+def get_leave_summary_by_person():
+    if reads_from_db():
+        return db_store.get_leave_summary_by_person_from_db()
+    return sheet_store.get_leave_summary_by_person()
+
+
+def get_leave_summary_by_type():
+    if reads_from_db():
+        return db_store.get_leave_summary_by_type_from_db()
+    return sheet_store.get_leave_summary_by_type()
+
+
+def record_leave(name, leave_type, start_date, end_date, note, notify_message=None) -> int:
+    """
+    บันทึกการลา 1 รายการลงทั้ง MySQL และ Google Sheet
+    - backend=db: MySQL ก่อน (validate + commit) งาน mirror ลงชีตเข้า outbox ใน transaction เดียวกัน
+      แล้ว outbox worker เขียนชีต (retry จนสำเร็จ ไม่หายตอน restart)
+    - backend=sheet: validate แล้วเขียนชีตก่อนแบบเดิม แล้วบันทึก MySQL
+    notify_message จะเข้า outbox ใน transaction เดียวกับแถว Leave แล้ว worker เป็นคนส่ง
+    ทั้งสองที่ได้ leave id (code) เดียวกัน
+    ValueError = ข้อมูลไม่ถูกต้อง (route ตอบ 400)
+    """
+    code = uuid4().hex
+    if reads_from_db():
+        leave_id = db_store.save_leave_to_db(name, leave_type, start_date, end_date, note, notify_message,
+                                             code=code, mirror_to_sheet=True)
+        wake_outbox_worker()
+        return leave_id
+
+    # validate ก่อนเขียนชีต: ข้อมูลที่ DB ไม่รับต้องไม่เหลือเป็นแถวกำพร้าในชีต
+    name, leave_type, start_date, end_date, note = db_store.validate_leave(name, leave_type, start_date, end_date, note)
+    sheet_store.add_leave(name, leave_type, start_date, end_date, note, code=code)
+    leave_id = db_store.save_leave_to_db(name, leave_type, start_date, end_date, note, notify_message, code=code)
+    if notify_message:
+        wake_outbox_worker()
+    return leave_id
+
+
+def reconcile_sheet() -> int:
+    """ส่งแถวใน MySQL ที่ code หายไปจากชีตกลับเข้าคิว mirror (flask reconcile-sheet) คืนจำนวนแถว"""
+    n = db_store.enqueue_missing_sheet_rows(sheet_store.sheet_leave_codes())
+    if n:
+        wake_outbox_worker()
+    return n
+
+
+def delete_leave(leave_id=None, timestamp=None, code=None) -> bool:
+    """
+    ลบการลาออกจากทั้ง MySQL และชีตด้วย leave id
+    แถวเก่าที่ยังไม่มี id: ลบจากชีตด้วย timestamp (+ code ยืนยัน) แบบเดิม
+    """
+    if leave_id and not sheet_store.is_leave_id(leave_id):
+        return False  # รหัสลบที่ผู้ใช้ตั้งเองไม่ใช่ id → ต้องลบผ่าน timestamp + code
+    if leave_id:
+        if reads_from_db():
+            ok = db_store.delete_leave_from_db(leave_id, mirror_to_sheet=True)
+            wake_outbox_worker()
+            return ok
+        ok = sheet_store.delete_leave_by_id(leave_id)
+        return db_store.delete_leave_from_db(leave_id) or ok
+    if reads_from_db():
+        # แถวที่แสดงมาจาก DB: timestamp เป็นของ DB (ชีตมี timestamp ของตัวเอง) → ลบแถวใน DB เป็นหลัก
+        ok = db_store.delete_legacy_leave_from_db(timestamp, code)
+        try:
+            sheet_store.delete_leave(timestamp, code)  # ถ้าชีตมีแถวเวลาเดียวกันก็ลบตาม
+        except Exception:
+            logger.exception("legacy sheet delete failed for timestamp %s", timestamp)
+        return ok
+    ok = sheet_store.delete_leave(timestamp, code)
+    if ok:
+        db_store.touch_data_version()
+    return ok
@@ -0,0 +1,136 @@
+import json
+import time
+import smtplib
+import logging
+import threading
+from email.mime.text import MIMEText
+from email.utils import formataddr
+
+from flask import current_app
+
+from models import db, NotificationOutbox
+from .telegram_service import SendResult
+
+logger = logging.getLogger(__name__)
+
+# ---- คิวอีเมลผ่าน outbox (channel="email") + SMTP connection ที่ login ค้างไว้ใช้ซ้ำ ---- #
+# ค่า SMTP_HOST/SMTP_PORT/SMTP_TIMEOUT/SMTP_IDLE_SECONDS อ่านจาก app.config (ตั้งใน create_app)
+
+_smtp_lock = threading.Lock()
+_smtp = {"conn": None, "key": None, "last_used": 0.0}
+_stats = {"sent": 0, "connects": 0, "reconnects": 0}
+
+
+def _settings() -> dict:
+    cfg = current_app.config
+    return {
+        "host": cfg.get("SMTP_HOST", "smtp.gmail.com"),
+        "port": int(cfg.get("SMTP_PORT", 465)),
+        "timeout": float(cfg.get("SMTP_TIMEOUT", 10.0)),
+        "idle": float(cfg.get("SMTP_IDLE_SECONDS", 60.0)),
+        "user": cfg.get("EMAIL_FROM"),
+        "password": cfg.get("EMAIL_PASSWORD"),
+    }
+
+
+def enqueue_email(to: str, subject: str, html: str, sender_name: str = "ระบบจองวันลา") -> NotificationOutbox:
+    """เพิ่มอีเมลลง outbox ใน session ปัจจุบัน (ไม่ commit) ให้ commit ไปพร้อมข้อมูลหลักแล้วค่อย wake worker"""
+    payload = {"to": (to or "").strip(), "subject": subject, "html": html, "sender_name": sender_name}
+    item = NotificationOutbox(channel="email", message=json.dumps(payload, ensure_ascii=False))
+    db.session.add(item)
+    return item
+
+
+def redact_email_payload(message: str) -> str:
+    """
+    payload ของอีเมลที่ส่งเสร็จ/ล้มถาวรแล้ว: ลบเนื้อหา (มีลิงก์พร้อม token ดิบ) เหลือผู้รับ/หัวเรื่องไว้ตรวจย้อนหลัง
+    """
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        payload = {}
+    return json.dumps({"to": payload.get("to", ""), "subject": payload.get("subject", ""),
+                       "sender_name": payload.get("sender_name", ""), "html": "", "redacted": True},
+                      ensure_ascii=False)
+
+
+def _build(payload: dict, sender: str) -> MIMEText:
+    msg = MIMEText(payload["html"], "html", "utf-8")
+    msg["Subject"] = payload["subject"]
+    msg["From"] = formataddr((payload.get("sender_name") or "", sender))
+    msg["To"] = payload["to"]
+    return msg
+
+
+def _close_locked() -> None:
+    conn = _smtp["conn"]
+    _smtp.update(conn=None, key=None)
+    if conn is not None:
+        try:
+            conn.quit()
+        except Exception:
+            pass
+
+
+def _connection(s: dict):
+    """connection ที่ login แล้ว; เปิดใหม่ถ้ายังไม่มี, ตั้งค่าเปลี่ยน หรือว่างนานจน server น่าจะตัดไปแล้ว"""
+    key = (s["host"], s["port"], s["user"])
+    conn = _smtp["conn"]
+    if conn is not None and (_smtp["key"] != key or time.monotonic() - _smtp["last_used"] > s["idle"]):
+        _close_locked()
+        conn = None
+    if conn is None:
+        conn = smtplib.SMTP_SSL(s["host"], s["port"], timeout=s["timeout"])
+        conn.login(s["user"], s["password"])
+        _smtp.update(conn=conn, key=key)
+        _stats["connects"] += 1
+    return conn
+
+
+def deliver_email(message: str) -> SendResult:
+    """ส่ง 1 ฉบับ (เรียกจาก outbox worker) ใช้ connection เดิมต่อเนื่อง; หลุดกลางทางจะต่อใหม่แล้วลองอีกครั้ง"""
+    try:
+        payload = json.loads(message)
+    except ValueError as e:
+        return SendResult(False, error=f"bad email payload: {e}")
+    s = _settings()
+    if not s["user"] or not s["password"]:
+        return SendResult(False, error="EMAIL_FROM/EMAIL_PASSWORD is missing")
+    msg = _build(payload, s["user"])
+
+    with _smtp_lock:
+        for attempt in range(2):
+            try:
+                _connection(s).send_message(msg)
+                _smtp["last_used"] = time.monotonic()
+                _stats["sent"] += 1
+                return SendResult(True)
+            # ลำดับ except สำคัญ: SMTPException เป็น subclass ของ OSError
+            except smtplib.SMTPRecipientsRefused as e:
+                # ผู้รับใช้ไม่ได้ ไม่ใช่ปัญหาของ connection → ไม่ต้องต่อใหม่/ส่งซ้ำ
+                return SendResult(False, error=f"recipient refused: {e}"[:200])
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused) as e:
+                err = e
+            except smtplib.SMTPException as e:
+                _close_locked()
+                return SendResult(False, error=f"{type(e).__name__}: {e}"[:200])
+            except OSError as e:
+                err = e  # socket timeout/reset
+            # connection ค้างตาย/ถูกตัด → ทิ้งแล้วต่อใหม่ 1 ครั้ง
+            _close_locked()
+            if attempt == 0:
+                _stats["reconnects"] += 1
+                continue
+            return SendResult(False, error=f"{type(err).__name__}: {err}"[:200])
+
+
+def close_idle_connection() -> None:
+    """ปิด connection ที่ว่างเกิน SMTP_IDLE_SECONDS (worker เรียกทุกรอบ)"""
+    with _smtp_lock:
+        if _smtp["conn"] is not None and time.monotonic() - _smtp["last_used"] > _settings()["idle"]:
+            _close_locked()
+
+
+def get_mail_stats() -> dict:
+    with _smtp_lock:
+        return dict(_stats, connected=_smtp["conn"] is not None)
@@ -0,0 +1,358 @@
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import and_, or_, update
+
+from models import db, Leave, NotificationOutbox
+from . import google_sheet_service as sheet_store
+from .telegram_service import MAX_LEN, SendResult, deliver_once, pack_messages
+from .mail_service import deliver_email, close_idle_connection, redact_email_payload
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKER_ENABLED = os.getenv("OUTBOX_WORKER_ENABLED", "1") == "1"
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))   # วินาที
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_LEASE_SECONDS = 120  # ถ้า worker ตายระหว่างส่ง แถว "sending" จะกลับมาให้ส่งใหม่หลังเวลานี้
+# งานชีตผ่าน token bucket ของ sheets_scheduler อาจนานเกิน lease → ต่ออายุ lease เป็นระยะระหว่างทำ
+# (ไม่งั้น worker อื่นจองซ้ำแล้ว append ชนกันได้)
+_LEASE_RENEW_CHANNELS = {"sheet"}
+
+# โหมดสรุป: แจ้งเตือนที่เข้ามาภายใน N วินาทีจากรายการแรก ถูกรวมส่งเป็นข้อความเดียว (0 = ปิด ส่งทีละรายการแบบเดิม)
+TELEGRAM_DIGEST_WINDOW = float(os.getenv("TELEGRAM_DIGEST_WINDOW", "0"))
+TELEGRAM_DIGEST_HEADER = "🗂️ <b>สรุปการลา {n} รายการ</b>\n\n"
+# ประเภทการลาที่ส่งทันทีเสมอ (คั่นด้วย ,)
+TELEGRAM_URGENT_TYPES = {t.strip() for t in os.getenv("TELEGRAM_URGENT_TYPES", "ลาป่วย").split(",") if t.strip()}
+
+_wake = threading.Event()
+_worker_started = False
+_worker_lock = threading.Lock()
+
+
+def _utcnow():
+    # DB เก็บ UTC แบบ naive (ดู models.py)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def is_urgent_leave_type(leave_type: str) -> bool:
+    return (leave_type or "").strip() in TELEGRAM_URGENT_TYPES
+
+
+def enqueue_telegram(message: str, urgent: bool = False) -> NotificationOutbox:
+    """
+    เพิ่มข้อความลง outbox ใน session ปัจจุบัน (ไม่ commit) ให้ commit ไปพร้อมข้อมูลหลัก
+    ถ้าเปิดโหมดสรุปและไม่ urgent: ถึงคิวหลังครบ TELEGRAM_DIGEST_WINDOW แล้วรวมส่งกับรายการอื่นที่รออยู่
+    """
+    digest = TELEGRAM_DIGEST_WINDOW > 0 and not urgent
+    item = NotificationOutbox(channel="telegram", message=message, digest=digest)
+    if digest:
+        item.next_attempt_at = _utcnow() + timedelta(seconds=TELEGRAM_DIGEST_WINDOW)
+    db.session.add(item)
+    return item
+
+
+def _sheet_record(r) -> dict:
+    return {k: str(r.get(k) or "") for k in ("name", "leave_type", "start_date", "end_date", "note", "code")}
+
+
+def enqueue_sheet_add(records) -> NotificationOutbox:
+    """
+    งาน mirror แถวการลาลง Google Sheet (channel="sheet") ใน session ปัจจุบัน (ไม่ commit)
+    commit ไปพร้อมแถว Leave → process ตาย/restart งานก็ไม่หาย worker จะ retry จนสำเร็จ
+    """
+    item = NotificationOutbox(channel="sheet", message=json.dumps(
+        {"op": "add", "rows": [_sheet_record(r) for r in records]}, ensure_ascii=False))
+    db.session.add(item)
+    return item
+
+
+def enqueue_sheet_delete(code: str) -> NotificationOutbox:
+    """งานลบแถวในชีตตาม leave id (ไม่ commit)"""
+    item = NotificationOutbox(channel="sheet", message=json.dumps({"op": "delete", "code": code}))
+    db.session.add(item)
+    return item
+
+
+def deliver_sheet(item) -> SendResult:
+    """
+    ทำงาน mirror 1 แถวของ outbox — ทำซ้ำได้โดยไม่เกิดแถวซ้ำ/ลบผิด
+    - add: ข้ามแถวที่ถูกลบจาก DB ไปแล้ว และแถวที่ code มีในชีตแล้ว
+      (ถูกจองมาแล้วมากกว่า 1 ครั้ง = รอบก่อนอาจ append ไปแล้วก่อนล้ม → อ่าน index จากชีตจริงก่อน)
+    - delete: ไม่พบแถวในชีต = ไม่มีอะไรต้องลบ (งาน add ที่ยังค้างจะข้ามเพราะแถวใน DB ไม่อยู่แล้ว)
+    """
+    try:
+        job = json.loads(item.message)
+        if job["op"] == "add":
+            codes = [r["code"] for r in job["rows"] if r.get("code")]
+            alive = {c for (c,) in db.session.query(Leave.code).filter(Leave.code.in_(codes))} if codes else set()
+            rows = [r for r in job["rows"] if not r.get("code") or r["code"] in alive]
+            if rows:
+                # 1 งาน = 1 ก้อนที่ผู้เรียกแบ่งไว้ (เช่น LEAVE_IMPORT_SHEET_CHUNK) → append_rows ครั้งเดียว
+                sheet_store.mirror_add_leaves(rows, recheck=item.attempts > 1, chunk_rows=len(rows))
+        elif job["op"] == "delete":
+            sheet_store.delete_leave_by_id(job["code"])
+        else:
+            return SendResult(False, error=f"unknown sheet op {job['op']}")
+    except Exception as e:
+        logger.exception("sheet mirror #%s failed", item.id)
+        return SendResult(False, error=f"{type(e).__name__}: {e}")
+    return SendResult(True)
+
+
+def wake_outbox_worker() -> None:
+    """ปลุก worker ให้ส่งทันทีหลัง commit (ไม่ต้องรอรอบ poll)"""
+    _wake.set()
+
+
+def _claim(item_id: int, now, due_only: bool = True) -> bool:
+    # จองแถวแบบ optimistic: ถ้า worker อื่น (gunicorn อีกตัว) จองไปก่อน rowcount จะเป็น 0
+    # due_only=False: รับแถว pending ที่ยังไม่ถึงเวลาด้วย (ใช้ดึงรายการเข้าข้อความสรุปก่อนกำหนด)
+    claimable = (
+        and_(NotificationOutbox.status.in_([NotificationOutbox.STATUS_PENDING, NotificationOutbox.STATUS_SENDING]),
+             NotificationOutbox.next_attempt_at <= now)
+        if due_only else
+        or_(NotificationOutbox.status == NotificationOutbox.STATUS_PENDING,
+            and_(NotificationOutbox.status == NotificationOutbox.STATUS_SENDING,
+                 NotificationOutbox.next_attempt_at <= now))
+    )
+    res = db.session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id == item_id, claimable)
+        .values(
+            status=NotificationOutbox.STATUS_SENDING,
+            attempts=NotificationOutbox.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+        )
+    )
+    db.session.commit()
+    return res.rowcount == 1
+
+
+def _mark_failed_attempt(item, res, now) -> bool:
+    """บันทึกผลส่งไม่สำเร็จ; คืน True ถ้าควรหยุดรอบนี้ (Telegram ขอให้รอ)"""
+    item.last_error = (res.error if res is not None else f"unknown channel {item.channel}")[:255]
+    if res is not None and res.retry_after:
+        # Telegram บอกให้รอ → เลื่อนทั้งแถวนี้ และหยุดรอบนี้ (rate limit เป็นระดับแชต)
+        item.status = NotificationOutbox.STATUS_PENDING
+        item.next_attempt_at = now + timedelta(seconds=res.retry_after)
+        return True
+    if item.attempts >= OUTBOX_MAX_ATTEMPTS or res is None:
+        item.status = NotificationOutbox.STATUS_FAILED
+        _scrub(item)
+        logger.error("outbox #%s failed permanently: %s", item.id, item.last_error)
+    else:
+        item.status = NotificationOutbox.STATUS_PENDING
+        item.next_attempt_at = now + timedelta(seconds=min(300, 2 ** item.attempts))
+    return False
+
+
+def _scrub(item) -> None:
+    # อีเมลยืนยัน/รีเซ็ตมีลิงก์พร้อม token ดิบ → ไม่เก็บไว้ใน outbox หลังจบงาน (DB เก็บแค่ hash ของ token)
+    if item.channel == "email":
+        item.message = redact_email_payload(item.message)
+
+
+def _mark_sent(item, now) -> None:
+    item.status = NotificationOutbox.STATUS_SENT
+    item.sent_at = now
+    item.last_error = None
+    _scrub(item)
+
+
+def _save_parts_sent(item, n) -> None:
+    # commit ทันทีทีละชิ้น: worker ตาย/ชิ้นถัดไปล้ม รอบหน้าก็ยังรู้ว่าส่งถึงชิ้นไหนแล้ว
+    item.parts_sent = n
+    db.session.commit()
+
+
+def _deliver_telegram(item) -> SendResult:
+    return deliver_once(item.message, start_part=item.parts_sent or 0,
+                        on_part=lambda n: _save_parts_sent(item, n))
+
+
+# ช่องทางรับแถว outbox ทั้งแถว (ตัวส่งอ่าน message เอง)
+_CHANNELS = {
+    "telegram": _deliver_telegram,
+    "email": lambda item: deliver_email(item.message),
+    "sheet": deliver_sheet,
+}
+
+
+def _renew_lease_loop(app, item_id: int, stop) -> None:
+    with app.app_context():
+        try:
+            while not stop.wait(OUTBOX_LEASE_SECONDS / 3):
+                try:
+                    db.session.execute(
+                        update(NotificationOutbox)
+                        .where(NotificationOutbox.id == item_id,
+                               NotificationOutbox.status == NotificationOutbox.STATUS_SENDING)
+                        .values(next_attempt_at=_utcnow() + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+                    )
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("outbox #%s lease renewal failed", item_id)
+        finally:
+            db.session.remove()
+
+
+@contextmanager
+def _lease_renewal(item):
+    """ต่ออายุ lease ของแถวที่จองไว้ทุก 1/3 ของ OUTBOX_LEASE_SECONDS จนออกจาก block (เฉพาะช่องทางที่อาจทำนาน)"""
+    if item.channel not in _LEASE_RENEW_CHANNELS:
+        yield
+        return
+    stop = threading.Event()
+    t = threading.Thread(target=_renew_lease_loop, args=(current_app._get_current_object(), item.id, stop),
+                         name=f"outbox-lease-{item.id}", daemon=True)
+    t.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        t.join()
+
+
+def _deliver_single(item_id: int):
+    """คืน None ถ้าไม่ได้ส่ง (worker อื่นจองไป), True ถ้าสำเร็จ, False ถ้าล้ม, "stop" ถ้าโดน rate limit"""
+    if not _claim(item_id, _utcnow()):
+        return None
+    item = db.session.get(NotificationOutbox, item_id)
+    if item is None:
+        return None
+
+    deliver = _CHANNELS.get(item.channel)
+    with _lease_renewal(item):
+        res = deliver(item) if deliver else None
+    now = _utcnow()
+    if res is not None and res.ok:
+        _mark_sent(item, now)
+        db.session.commit()
+        return True
+    stop = _mark_failed_attempt(item, res, now)
+    db.session.commit()
+    return "stop" if stop else False
+
+
+def _deliver_digest(limit: int) -> int:
+    """
+    มีรายการสรุปถึงคิวแล้วอย่างน้อย 1 รายการ → รวมทุกรายการสรุปที่รออยู่ (รวมที่ยังไม่ครบ window) ส่งเป็นข้อความเดียว
+    ถ้ายาวเกิน MAX_LEN แบ่งเป็นหลายก้อนโดยไม่ตัดกลางรายการ; ก้อนที่ส่งสำเร็จ mark sent ทีละก้อน จะได้ไม่ส่งซ้ำตอน retry
+    """
+    now = _utcnow()
+    ids = [
+        row.id for row in
+        NotificationOutbox.query
+        .with_entities(NotificationOutbox.id)
+        .filter(
+            NotificationOutbox.channel == "telegram",
+            NotificationOutbox.digest.is_(True),
+            NotificationOutbox.status.in_([NotificationOutbox.STATUS_PENDING, NotificationOutbox.STATUS_SENDING]),
+        )
+        .order_by(NotificationOutbox.id.asc())
+        .limit(limit)
+        .all()
+    ]
+    db.session.commit()
+
+    claimed = [i for i in ids if _claim(i, now, due_only=False)]
+    items = [it for it in (db.session.get(NotificationOutbox, i) for i in claimed) if it is not None]
+    if not items:
+        return 0
+
+    sent = 0
+    packs = pack_messages([it.message for it in items],
+                          header=TELEGRAM_DIGEST_HEADER.format(n=len(items)) if len(items) > 1 else "")
+    for n, (text, idx) in enumerate(packs):
+        group = [items[i] for i in idx]
+        if len(group) == 1 and len(text) > MAX_LEN:
+            # ข้อความเดี่ยวที่ยาวจนต้องแบ่งชิ้น: ส่งตัวข้อความเอง (ไม่มี header ที่เปลี่ยนตามจำนวนรายการ)
+            # ชิ้นที่แบ่งจึงเหมือนเดิมทุกรอบ → retry ต่อจากชิ้นที่ค้างได้
+            res = _deliver_telegram(group[0])
+        else:
+            res = deliver_once(text)
+        now = _utcnow()
+        if res.ok:
+            for it in group:
+                _mark_sent(it, now)
+            sent += len(group)
+            db.session.commit()
+            continue
+        # ก้อนนี้และก้อนที่เหลือกลับไปรอ (นับ attempt ตามจริงของแต่ละแถว)
+        for _, rest in packs[n:]:
+            for i in rest:
+                _mark_failed_attempt(items[i], res, now)
+        db.session.commit()
+        break
+    return sent
+
+
+def deliver_pending(limit: int = OUTBOX_BATCH_SIZE) -> int:
+    """ส่งข้อความที่ถึงคิว คืนจำนวนที่ส่งสำเร็จ (ต้องเรียกภายใต้ app context)"""
+    now = _utcnow()
+    due = (
+        NotificationOutbox.query
+        .with_entities(NotificationOutbox.id, NotificationOutbox.channel, NotificationOutbox.digest)
+        .filter(
+            NotificationOutbox.status.in_([NotificationOutbox.STATUS_PENDING, NotificationOutbox.STATUS_SENDING]),
+            NotificationOutbox.next_attempt_at <= now,
+        )
+        .order_by(NotificationOutbox.id.asc())
+        .limit(limit)
+        .all()
+    )
+    db.session.commit()  # ปิด transaction อ่าน ไม่ให้ค้าง snapshot
+
+    # รายการเดี่ยว (ด่วน/โหมดปกติ/อีเมล) ก่อน แล้วค่อยข้อความสรุป
+    # อีเมลทั้งรอบส่งผ่าน SMTP connection เดียวกัน (ดู mail_service)
+    sent = 0
+    telegram_blocked = False
+    for row in due:
+        if row.digest or (telegram_blocked and row.channel == "telegram"):
+            continue
+        ok = _deliver_single(row.id)
+        if ok == "stop":
+            telegram_blocked = True  # rate limit ของ Telegram ข้ามเฉพาะ Telegram ไม่กันอีเมล
+            continue
+        sent += ok is True
+    if any(row.digest for row in due) and not telegram_blocked:
+        sent += _deliver_digest(limit)
+    if len(due) >= limit and not telegram_blocked:
+        _wake.set()  # ยังมีค้าง (เช่น admin ส่งอีเมลทีละหลายฉบับ) → รอบถัดไปทันที ไม่รอ poll
+    return sent
+
+
+def _worker_loop(app) -> None:
+    while True:
+        _wake.wait(OUTBOX_POLL_INTERVAL)
+        _wake.clear()
+        with app.app_context():
+            try:
+                deliver_pending()
+                close_idle_connection()
+            except Exception:
+                db.session.rollback()
+                logger.exception("outbox worker iteration failed")
+            finally:
+                db.session.remove()
+
+
+def start_outbox_worker(app) -> bool:
+    """เริ่ม daemon thread 1 ตัวต่อ process (เรียกซ้ำได้ ไม่เริ่มซ้ำ)"""
+    global _worker_started
+    if not OUTBOX_WORKER_ENABLED:
+        return False
+    with _worker_lock:
+        if _worker_started:
+            return True
+        t = threading.Thread(target=_worker_loop, args=(app,), name="outbox-worker", daemon=True)
+        t.start()
+        _worker_started = True
+    return True
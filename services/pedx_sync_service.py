@@ -0,0 +1,191 @@
+import os
+import hashlib
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from models import db, PedxSyncState, PedxRow
+from .report_service import (
+    WORKSHEET_NAME, REPORT_CHUNK_ROWS,
+    run_report_and_push, iter_report_chunks, updated_start_row,
+    _open_worksheet, _col_letter, _noop_progress,
+)
+from .sheets_scheduler import sheets_call, WRITE, BULK
+
+logger = logging.getLogger(__name__)
+
+# full = ล้างแล้วเขียนใหม่ทั้งชีต (แบบเดิม), incremental = เขียนเฉพาะแถวที่เปลี่ยน/เพิ่มใหม่
+REPORT_SYNC_MODE = os.getenv("REPORT_SYNC_MODE", "full").strip().lower()
+# HOSxP ไม่มีคอลัมน์เวลาแก้ไข จึงดึงย้อนหลังจาก watermark ไปอีกกี่วัน เพื่อจับ visit ที่ยังถูกแก้อยู่
+REPORT_DELTA_LOOKBACK_DAYS = int(os.getenv("REPORT_DELTA_LOOKBACK_DAYS", "1"))
+SYNC_MODES = ("full", "incremental")
+_IN_CHUNK = 500  # จำนวน VN ต่อ IN (...) หนึ่งครั้ง
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _row_hash(cells) -> str:
+    return hashlib.sha1("\x1f".join(cells).encode("utf-8")).hexdigest()
+
+
+def _vn(cells) -> str:
+    return cells[0]  # คอลัมน์แรกของ SQL_TEMPLATE คือ VN
+
+
+def _vstdate(cells):
+    # คอลัมน์ที่ 4 ของ SQL_TEMPLATE คือ VstDate
+    try:
+        return date.fromisoformat(str(cells[3])[:10])
+    except (IndexError, ValueError):
+        return None
+
+
+def _load_known(worksheet: str, vns) -> dict:
+    """VN -> PedxRow ของแถวที่เคยเขียนลงชีตแล้ว"""
+    known = {}
+    vns = list(vns)
+    for i in range(0, len(vns), _IN_CHUNK):
+        part = vns[i:i + _IN_CHUNK]
+        for r in PedxRow.query.filter(PedxRow.worksheet == worksheet, PedxRow.vn.in_(part)):
+            known[r.vn] = r
+    return known
+
+
+def _record_appended(worksheet: str, rows, resp) -> None:
+    start = updated_start_row(resp)
+    if start is None:
+        # ไม่รู้ตำแหน่งแถว -> state ใช้ไม่ได้ รอบหน้าต้อง full
+        raise RuntimeError("append response ไม่มี updatedRange; ไม่สามารถบันทึกตำแหน่งแถวได้")
+    if not rows:
+        return
+    # INSERT หลายแถวต่อก้อน (VN ซ้ำจากรอบก่อน → ทับตำแหน่ง/hash) ไม่โหลด object เข้า session
+    stmt = mysql_insert(PedxRow).values([
+        {"worksheet": worksheet, "vn": _vn(cells), "vstdate": _vstdate(cells),
+         "row_number": start + offset, "content_hash": _row_hash(cells)}
+        for offset, cells in enumerate(rows)
+    ])
+    stmt = stmt.on_duplicate_key_update(
+        vstdate=stmt.inserted.vstdate,
+        row_number=stmt.inserted.row_number,
+        content_hash=stmt.inserted.content_hash,
+    )
+    db.session.execute(stmt)
+    db.session.commit()
+
+
+def _save_state(worksheet: str, start_date: date) -> None:
+    state = db.session.get(PedxSyncState, worksheet) or PedxSyncState(worksheet=worksheet, start_date=start_date)
+    state.start_date = start_date
+    state.watermark = date.today()
+    state.last_run_at = _utcnow()
+    db.session.add(state)
+
+
+def _full_sync(worksheet: str, start_date: date, progress) -> dict:
+    PedxRow.query.filter_by(worksheet=worksheet).delete(synchronize_session=False)
+    PedxSyncState.query.filter_by(worksheet=worksheet).delete(synchronize_session=False)
+    db.session.commit()
+
+    result = run_report_and_push(
+        start_date.isoformat(), progress=progress,
+        on_chunk=lambda rows, resp: _record_appended(worksheet, rows, resp),
+    )
+    _save_state(worksheet, start_date)
+    db.session.commit()
+    result["mode"] = "full"
+    return result
+
+
+def _fetch_since(since: date) -> list:
+    rows = []
+    for kind, value in iter_report_chunks(since.isoformat()):
+        if kind == "rows":
+            rows.extend(value)
+    return rows
+
+
+def _delta_sync(worksheet: str, state: PedxSyncState, progress) -> dict:
+    since = max(state.start_date, state.watermark - timedelta(days=REPORT_DELTA_LOOKBACK_DAYS))
+    progress("query")
+    rows = _fetch_since(since)
+    seen = {_vn(c) for c in rows}
+    known = _load_known(worksheet, seen)
+    # VN ที่เคยอยู่ในช่วง since..วันนี้ แต่ query รอบนี้ไม่คืนมาแล้ว (visit ถูกลบ/ย้ายวัน)
+    vanished = [
+        r for r in PedxRow.query.filter(PedxRow.worksheet == worksheet, PedxRow.vstdate >= since)
+        if r.vn not in seen
+    ]
+
+    changed, new = [], []
+    for cells in rows:
+        prev = known.get(_vn(cells))
+        if prev is None:
+            new.append(cells)
+        elif prev.content_hash != _row_hash(cells):
+            changed.append((prev, cells))
+
+    progress("upload", len(rows), 0)
+    ws = _open_worksheet()
+    done = 0
+
+    # แถวที่เปลี่ยน: เขียนทับตำแหน่งเดิมด้วย batch_update (หลายช่วงต่อ 1 request)
+    for i in range(0, len(changed), REPORT_CHUNK_ROWS):
+        part = changed[i:i + REPORT_CHUNK_ROWS]
+        sheets_call(ws.batch_update, [
+            {"range": f"A{p.row_number}:{_col_letter(len(c))}{p.row_number}", "values": [c]}
+            for p, c in part
+        ], value_input_option="USER_ENTERED", kind=WRITE, priority=BULK)
+        for p, c in part:
+            p.content_hash = _row_hash(c)
+        done += len(part)
+        db.session.commit()
+        progress("upload", len(rows), done)
+
+    # แถวที่หายไป: ล้างค่าในชีต (ไม่ delete_rows เพราะแถวหลังจากนั้นจะเลื่อน row_number) แล้วลบ state ทิ้ง
+    # แถวว่างที่เหลือหายไปตอน full sync รอบถัดไป
+    for i in range(0, len(vanished), REPORT_CHUNK_ROWS):
+        part = vanished[i:i + REPORT_CHUNK_ROWS]
+        sheets_call(ws.batch_clear, [f"{r.row_number}:{r.row_number}" for r in part], kind=WRITE, priority=BULK)
+        for r in part:
+            db.session.delete(r)
+        db.session.commit()
+
+    # แถวใหม่: append ท้ายชีต (ไม่แทรกตามลำดับวันที่ เพื่อไม่ให้ตำแหน่งแถวเดิมเลื่อน)
+    for i in range(0, len(new), REPORT_CHUNK_ROWS):
+        block = new[i:i + REPORT_CHUNK_ROWS]
+        resp = sheets_call(ws.append_rows, block, value_input_option="USER_ENTERED", kind=WRITE, priority=BULK)
+        _record_appended(worksheet, block, resp)
+        done += len(block)
+        progress("upload", len(rows), done)
+
+    _save_state(worksheet, state.start_date)
+    db.session.commit()
+    progress("done", len(rows), done)
+    return {"rows": done, "mode": "incremental", "fetched": len(rows),
+            "updated": len(changed), "appended": len(new), "removed": len(vanished),
+            "since": since.isoformat()}
+
+
+def sync_pedx(start_date: str, mode=None, progress=None) -> dict:
+    """
+    ซิงก์รายงาน PEDX ลงชีต
+    - full: ล้างแล้วเขียนใหม่ และบันทึก VN -> แถว/hash ไว้ใช้รอบถัดไป
+    - incremental: ดึงเฉพาะตั้งแต่ watermark (ลบ lookback) แล้ว update แถวที่ hash เปลี่ยน + append แถวใหม่
+      ถ้ายังไม่มี state หรือ start_date ไม่ตรงกับที่อยู่ในชีต จะถอยไปทำ full ให้เอง
+    """
+    progress = progress or _noop_progress
+    mode = (mode or REPORT_SYNC_MODE).strip().lower()
+    if mode not in SYNC_MODES:
+        raise ValueError(f"mode ต้องเป็นหนึ่งใน {', '.join(SYNC_MODES)}")
+    sd = date.fromisoformat(start_date)
+    worksheet = WORKSHEET_NAME
+
+    if mode == "incremental":
+        state = db.session.get(PedxSyncState, worksheet)
+        if state is not None and state.start_date == sd:
+            return _delta_sync(worksheet, state, progress)
+        logger.info("PEDX incremental: ไม่มี state ที่ตรงกับ start_date=%s, ทำ full sync แทน", sd)
+    return _full_sync(worksheet, sd, progress)
@@ -1,7 +1,17 @@
 import os
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
 import gspread
-import mysql.connector
-from oauth2client.service_account import ServiceAccountCredentials
+
+from .client_registry import hosxp_connection, gspread_client, reset_gspread_client
+from .sheets_scheduler import sheets_call, READ, WRITE, BULK
+
+logger = logging.getLogger(__name__)
 
 # โหลดค่า env
 HOSXP = {
@@ -15,6 +25,15 @@ SPREADSHEET_ID = os.getenv("REPORT_SPREADSHEET_ID")
 WORKSHEET_NAME = os.getenv("REPORT_WORKSHEET")
 GOOGLE_SA_FILE = os.getenv("GOOGLE_SA_FILE", "dataslothy-365d6e2908af.json")
 
+# [CHANGE] เขียนเป็นก้อนเล็ก ๆ เพื่อลดเวลาต่อรีเควสต์ และเลี่ยง timeout/429 (ลอง 200–1000 ตามขนาดข้อมูลจริง)
+REPORT_CHUNK_ROWS = int(os.getenv("REPORT_CHUNK_ROWS", "500"))
+REPORT_STREAMING = os.getenv("REPORT_STREAMING", "1") == "1"
+REPORT_QUEUE_DEPTH = int(os.getenv("REPORT_QUEUE_DEPTH", "2"))  # chunk ที่รออัปโหลดได้สูงสุด
+# แบ่งช่วงวันที่เป็นท่อน ๆ แล้ว query พร้อมกัน: none (query เดียวแบบเดิม) | day | week
+REPORT_PARTITION = os.getenv("REPORT_PARTITION", "none").strip().lower()
+REPORT_EXTRACT_WORKERS = int(os.getenv("REPORT_EXTRACT_WORKERS", "3"))  # ควรไม่เกิน HOSXP_POOL_SIZE
+_PARTITION_DAYS = {"day": 1, "week": 7}
+
 # SQL อยู่ฝั่ง server เพื่อลดความเสี่ยง ไม่รับจาก client
 SQL_TEMPLATE = """
 SELECT
@@ -46,15 +65,26 @@ GROUP BY o.vn
 ORDER BY MAX(o.vstdate) DESC, MAX(o.vsttime) DESC, MAX(o.doctor) DESC;
 """.strip()
 
+# query เดียวกันแต่จำกัดช่วงปิดทั้งสองฝั่ง ใช้กับโหมดแบ่งท่อน
+# (ovst หนึ่ง vn มี vstdate เดียว ท่อนวันที่จึงไม่ตัดกลุ่ม GROUP BY o.vn ข้ามท่อน)
+SQL_RANGE_TEMPLATE = SQL_TEMPLATE.replace(
+    "WHERE o.vstdate BETWEEN %s AND CURDATE()", "WHERE o.vstdate BETWEEN %s AND %s"
+)
+if SQL_RANGE_TEMPLATE == SQL_TEMPLATE:
+    # แก้ WHERE ใน SQL_TEMPLATE แล้วลืมแก้ตรงนี้ → โหมดแบ่งท่อนจะดึงถึงวันนี้ทุกท่อน (ข้อมูลซ้ำ)
+    raise RuntimeError("SQL_RANGE_TEMPLATE: ไม่พบเงื่อนไข vstdate ใน SQL_TEMPLATE")
+
+
+GS_SCOPES = (
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+)
+
 
 def _gs_client():
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(GOOGLE_SA_FILE, scope)
-    return gspread.authorize(creds)
+    # client ที่ authorize แล้วใช้ซ้ำทั้ง process (ดู client_registry)
+    return gspread_client(GOOGLE_SA_FILE, GS_SCOPES)
 
 
 def _col_letter(n: int) -> str:
@@ -66,52 +96,298 @@ def _col_letter(n: int) -> str:
     return s
 
 
-def run_report_and_push(start_date: str) -> dict:
+def _hosxp_connect():
+    # ยืมจาก pool; conn.close() คืนเข้า pool (ต้องเรียกเสมอแม้ connection หลุด ไม่งั้น slot จะค้าง)
+    return hosxp_connection(HOSXP)
+
+
+def _release(conn, cur=None) -> None:
+    try:
+        if cur is not None:
+            cur.close()
+    except Exception:
+        pass
+    try:
+        if conn is not None:
+            conn.close()
+    except Exception:
+        pass
+
+
+def _open_worksheet():
+    try:
+        sh = sheets_call(_gs_client().open_by_key, SPREADSHEET_ID, kind=READ, priority=BULK)
+    except gspread.exceptions.APIError as e:
+        if getattr(getattr(e, "response", None), "status_code", None) != 401:
+            raise
+        # token ของ client ที่ cache ไว้ใช้ไม่ได้แล้ว → authorize ใหม่แล้วลองอีกครั้ง
+        reset_gspread_client()
+        sh = sheets_call(_gs_client().open_by_key, SPREADSHEET_ID, kind=READ, priority=BULK)
+    return sheets_call(sh.worksheet, WORKSHEET_NAME, kind=READ, priority=BULK)
+
+
+def prewarm() -> None:
+    """เติม HOSxP pool และ authorize gspread ล่วงหน้า (ข้ามถ้ายังไม่ได้ตั้งค่า)"""
+    if HOSXP["host"]:
+        _release(_hosxp_connect())
+    if SPREADSHEET_ID:
+        _gs_client()
+
+
+def _clear_data_rows(ws, col_count: int) -> None:
+    # เคลียร์ข้อมูลเดิม (แถว 2 ลงไป) — ใช้ row_count เพื่อลดการอ่านทั้งชีต
+    last_row = ws.row_count
+    last_col_letter = _col_letter(col_count)
+    if last_row > 1:
+        sheets_call(ws.batch_clear, [f"A2:{last_col_letter}{last_row}"], kind=WRITE, priority=BULK)
+
+
+def _to_cells(row) -> list:
+    return ["" if x is None else str(x) for x in row]
+
+
+def _noop_progress(phase, rows_fetched=0, rows_uploaded=0):
+    pass
+
+
+def updated_start_row(resp):
+    """เลขแถวแรกที่ append ลงไป จาก response {"updates": {"updatedRange": "Sheet!A10:P12"}}"""
+    try:
+        first = resp["updates"]["updatedRange"].split("!")[-1].split(":")[0]
+        return int("".join(ch for ch in first if ch.isdigit()))
+    except Exception:
+        return None
+
+
+# ---- ดึงข้อมูลจาก HOSxP: ให้ผลเป็น ("columns", n) ตามด้วย ("rows", [cells...]) ทีละ chunk ---- #
+def _iter_single(start_date: str):
+    conn = cur = None
+    try:
+        conn = _hosxp_connect()
+        cur = conn.cursor()
+        cur.execute(SQL_TEMPLATE, (start_date,))
+        # ส่งจำนวนคอลัมน์ก่อน ให้ฝั่งชีตเคลียร์ได้ทันทีโดยไม่ต้องรอแถวแรก
+        yield "columns", len(cur.description or [])
+        while True:
+            rows = cur.fetchmany(REPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            yield "rows", [_to_cells(r) for r in rows]
+    finally:
+        _release(conn, cur)
+
+
+def _hosxp_today() -> date:
+    # ใช้ CURDATE() ของ HOSxP ให้ขอบบนตรงกับ query แบบเดิม (เครื่องเราอาจคนละ timezone)
+    conn = cur = None
+    try:
+        conn = _hosxp_connect()
+        cur = conn.cursor()
+        cur.execute("SELECT CURDATE()")
+        return cur.fetchone()[0]
+    finally:
+        _release(conn, cur)
+
+
+def _partitions(start: date, end: date, days: int) -> list:
+    """ช่วง [lo, hi] แบบปิด เรียงจากใหม่ไปเก่า (ตรงกับ ORDER BY vstdate DESC)"""
+    parts = []
+    hi = end
+    while hi >= start:
+        lo = max(start, hi - timedelta(days=days - 1))
+        parts.append((lo, hi))
+        hi = lo - timedelta(days=1)
+    return parts
+
+
+def _fetch_partition(lo: date, hi: date):
+    conn = cur = None
+    t0 = time.perf_counter()
+    try:
+        conn = _hosxp_connect()
+        cur = conn.cursor()
+        cur.execute(SQL_RANGE_TEMPLATE, (lo, hi))
+        rows = [_to_cells(r) for r in cur.fetchall()]
+        cols = len(cur.description or [])
+    finally:
+        _release(conn, cur)
+    timing = {"from": lo.isoformat(), "to": hi.isoformat(), "rows": len(rows),
+              "ms": round((time.perf_counter() - t0) * 1000, 1)}
+    logger.info("PEDX partition %(from)s..%(to)s: %(rows)d rows in %(ms).0f ms", timing)
+    return cols, rows, timing
+
+
+def _iter_partitioned(start_date: str, days: int, timings: list):
+    """
+    query ทีละท่อนบน thread pool ขนาด REPORT_EXTRACT_WORKERS แล้วส่งผลออกตามลำดับท่อน (ใหม่ -> เก่า)
+    ผลรวมจึงเรียงเหมือน query เดียว; ส่ง query ล่วงหน้าไม่เกิน 2 เท่าของ worker เพื่อคุมหน่วยความจำ
+    """
+    parts = _partitions(date.fromisoformat(start_date), _hosxp_today(), days)
+    workers = max(1, REPORT_EXTRACT_WORKERS)
+    ex = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pedx-extract")
+    pending = deque()
+    try:
+        todo = iter(parts)
+        for lo, hi in todo:
+            pending.append(ex.submit(_fetch_partition, lo, hi))
+            if len(pending) >= workers * 2:
+                break
+        sent_columns = False
+        while pending:
+            cols, rows, timing = pending.popleft().result()
+            nxt = next(todo, None)
+            if nxt is not None:
+                pending.append(ex.submit(_fetch_partition, *nxt))
+            timings.append(timing)
+            if not sent_columns:
+                sent_columns = True
+                yield "columns", cols
+            for i in range(0, len(rows), REPORT_CHUNK_ROWS):
+                yield "rows", rows[i:i + REPORT_CHUNK_ROWS]
+        if not sent_columns:
+            yield "columns", 0  # ช่วงว่าง
+    finally:
+        for f in pending:
+            f.cancel()
+        ex.shutdown(wait=False)
+
+
+def iter_report_chunks(start_date: str, timings=None):
+    """
+    แหล่งข้อมูลของรายงาน: query เดียว (REPORT_PARTITION=none) หรือแบ่งท่อนรายวัน/รายสัปดาห์
+    timings: list ที่จะถูกเติมเวลาต่อท่อน {"from", "to", "rows", "ms"} (เฉพาะโหมดแบ่งท่อน)
+    """
+    days = _PARTITION_DAYS.get(REPORT_PARTITION)
+    if days is None:
+        return _iter_single(start_date)
+    return _iter_partitioned(start_date, days, timings if timings is not None else [])
+
+
+def _partition_summary(timings: list) -> dict:
+    if not timings:
+        return {}
+    ms = [t["ms"] for t in timings]
+    return {"partition": REPORT_PARTITION, "partitions": len(timings),
+            "partition_ms_max": max(ms), "partition_ms_avg": round(sum(ms) / len(ms), 1),
+            "partition_timings": timings}
+
+
+def run_report_and_push(start_date: str, progress=None, on_chunk=None) -> dict:
     """
     รัน query จาก start_date แล้วอัปโหลดผลลัพธ์ (ไม่มี header) ลง worksheet ชื่อ WORKSHEET_NAME
     เคลียร์ข้อมูลเก่าตั้งแต่แถว 2 ลงไป (เก็บหัวตารางเดิมไว้)
+    REPORT_STREAMING=1 (ค่าเริ่มต้น): อ่านทีละ chunk และอัปโหลดไปพร้อมกัน หน่วยความจำคงที่
+    progress(phase, rows_fetched, rows_uploaded): callback รายงานความคืบหน้า (phase: query/clear/upload/done)
+    on_chunk(rows, append_response): เรียกหลัง append แต่ละก้อน (ใช้บันทึก state ของ incremental sync)
     """
+    progress = progress or _noop_progress
+    if REPORT_STREAMING:
+        return _run_streaming(start_date, progress, on_chunk)
+    return _run_buffered(start_date, progress, on_chunk)
+
+
+def _run_buffered(start_date: str, progress=_noop_progress, on_chunk=None) -> dict:
+    """โหมดเดิม: fetchall ทั้งหมดก่อนแล้วค่อยอัปโหลด"""
     # 1) Query DB
-    conn = None
-    try:
-        conn = mysql.connector.connect(
-            host=HOSXP["host"], port=HOSXP["port"],
-            user=HOSXP["user"], password=HOSXP["password"],
-            database=HOSXP["database"], charset="utf8", use_pure=True,
-            connection_timeout=10, autocommit=True,
-        )
-        cur = conn.cursor()
-        cur.execute(SQL_TEMPLATE, (start_date,))
-        rows = cur.fetchall()  # list[tuple]
-    finally:
-        try:
-            if conn and conn.is_connected():
-                cur.close(); conn.close()
-        except Exception:
-            pass
+    progress("query")
+    timings = []
+    payload, col_count = [], 0
+    for kind, value in iter_report_chunks(start_date, timings):
+        if kind == "columns":
+            col_count = value
+        else:
+            payload.extend(value)  # แปลงเป็น list of lists (string) แล้ว
 
     # 2) เข้าถึงชีต
-    gc = _gs_client()
-    sh = gc.open_by_key(SPREADSHEET_ID)
-    ws = sh.worksheet(WORKSHEET_NAME)
+    progress("clear", len(payload))
+    ws = _open_worksheet()
 
     # 3) เคลียร์ข้อมูลเดิม (แถว 2 ลงไป)
-    # 3) เคลียร์ข้อมูลเดิม (แถว 2 ลงไป) — ใช้ row_count เพื่อลดการอ่านทั้งชีต
-    last_row = ws.row_count
-    col_count = len(rows[0]) if rows else 26  # ถ้าอยากแม่นยำขึ้น ใช้ len(ws.row_values(1)) แทน 26 ได้
-    last_col_letter = _col_letter(col_count)
-    if last_row > 1:
-        ws.batch_clear([f"A2:{last_col_letter}{last_row}"])
-
+    _clear_data_rows(ws, col_count or 26)
 
-    # 4) แปลงผลลัพธ์เป็น list of lists (string)
-    payload = [list(map(lambda x: "" if x is None else str(x), r)) for r in rows]
+    # 4) อัปโหลด
     if payload:
         # [CHANGE] เขียนเป็นก้อนเล็ก ๆ เพื่อลดเวลาต่อรีเควสต์ และเลี่ยง timeout/429
-        CHUNK = 500  # ลอง 200–1000 ตามขนาดข้อมูลจริง
-        for i in range(0, len(payload), CHUNK):
-            block = payload[i:i+CHUNK]
-            ws.append_rows(block, value_input_option="USER_ENTERED")
+        for i in range(0, len(payload), REPORT_CHUNK_ROWS):
+            block = payload[i:i+REPORT_CHUNK_ROWS]
+            resp = sheets_call(ws.append_rows, block, value_input_option="USER_ENTERED", kind=WRITE, priority=BULK)
+            if on_chunk:
+                on_chunk(block, resp)
+            progress("upload", len(payload), i + len(block))
+
+    progress("done", len(payload), len(payload))
+    return {"rows": len(payload), **_partition_summary(timings)}
+
+
+# ---- โหมด streaming: HOSxP -> queue (จำกัดขนาด) -> Google Sheets ---- #
+_END = object()
+
+
+def _put(q, item, stop) -> bool:
+    # put แบบเช็ค stop ทุกวินาที: ถ้าฝั่งอัปโหลดล้มแล้ว producer จะไม่ค้างรอคิวว่างตลอดไป
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
 
-    return {"rows": len(payload)}
 
+def _produce_chunks(start_date, q, stop, counts, timings) -> None:
+    """thread อ่าน HOSxP ทีละ chunk (แปลงเป็น string แล้ว) เข้าคิว"""
+    chunks = iter_report_chunks(start_date, timings)
+    try:
+        for kind, value in chunks:
+            if stop.is_set():
+                return
+            if kind == "rows":
+                counts["fetched"] += len(value)
+            if not _put(q, (kind, value), stop):
+                return
+        _put(q, (_END, None), stop)
+    except Exception as e:
+        _put(q, ("error", e), stop)
+    finally:
+        chunks.close()  # คืน connection / ยกเลิกท่อนที่ยังไม่เริ่ม
+
+
+def _run_streaming(start_date: str, progress=_noop_progress, on_chunk=None) -> dict:
+    q = queue.Queue(maxsize=REPORT_QUEUE_DEPTH)  # peak memory ≈ (depth + 1) chunks
+    stop = threading.Event()
+    counts = {"fetched": 0}  # producer เพิ่มค่า, ฝั่งนี้อ่านไปรายงาน progress
+    timings = []
+    producer = threading.Thread(
+        target=_produce_chunks, args=(start_date, q, stop, counts, timings), name="pedx-producer", daemon=True
+    )
+    producer.start()
+
+    uploaded = 0
+    progress("query")
+    try:
+        kind, value = q.get()
+        if kind == "error":
+            raise value  # query ล้ม → ยังไม่แตะชีต ข้อมูลเดิมอยู่ครบ
+
+        # เปิดชีตหลัง query เริ่มสำเร็จ แล้วเคลียร์ข้อมูลเดิม
+        progress("clear", counts["fetched"])
+        ws = _open_worksheet()
+        _clear_data_rows(ws, value or 26)
+
+        while True:
+            kind, value = q.get()
+            if kind is _END:
+                break
+            if kind == "error":
+                raise value
+            resp = sheets_call(ws.append_rows, value, value_input_option="USER_ENTERED", kind=WRITE, priority=BULK)
+            if on_chunk:
+                on_chunk(value, resp)
+            uploaded += len(value)
+            progress("upload", counts["fetched"], uploaded)
+    finally:
+        stop.set()
+        producer.join(timeout=5)
+
+    progress("done", counts["fetched"], uploaded)
+    return {"rows": uploaded, **_partition_summary(timings)}
@@ -0,0 +1,164 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import tempfile
+import threading
+
+import gspread
+
+logger = logging.getLogger(__name__)
+
+# ---- Token bucket ของ Google Sheets API แชร์ข้ามทุก gunicorn worker (ผ่านไฟล์ SQLite บนเครื่องเดียวกัน) ---- #
+# โควตา Sheets API: read/write แยกกัน นับต่อนาทีต่อ user (service account = 1 user)
+SHEETS_RATE_DB = os.getenv("SHEETS_RATE_DB") or os.path.join(tempfile.gettempdir(), "sheets_rate.sqlite3")
+SHEETS_READS_PER_MIN = float(os.getenv("SHEETS_READS_PER_MIN", "60"))
+SHEETS_WRITES_PER_MIN = float(os.getenv("SHEETS_WRITES_PER_MIN", "60"))
+SHEETS_BURST = float(os.getenv("SHEETS_BURST", "10"))                # ขนาดถัง (ยิงติดกันได้สูงสุด)
+SHEETS_BULK_RESERVE = float(os.getenv("SHEETS_BULK_RESERVE", "3"))  # token ที่งาน bulk ห้ามแตะ เก็บไว้ให้ interactive
+SHEETS_INTERACTIVE_MAX_WAIT = float(os.getenv("SHEETS_INTERACTIVE_MAX_WAIT", "15"))  # รอ token นานสุด แล้วยิงเลย
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_BACKOFF_BASE = float(os.getenv("SHEETS_BACKOFF_BASE", "1"))
+SHEETS_BACKOFF_MAX = float(os.getenv("SHEETS_BACKOFF_MAX", "32"))
+
+READ, WRITE = "read", "write"
+INTERACTIVE, BULK = "interactive", "bulk"
+_RATES = {READ: SHEETS_READS_PER_MIN, WRITE: SHEETS_WRITES_PER_MIN}
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "throttled": 0, "throttle_wait_s": 0.0, "retries": 0, "rate_limited": 0, "bucket_errors": 0}
+
+
+def _bump(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def _conn():
+    # sqlite connection ใช้ข้าม thread ไม่ได้ → หนึ่ง connection ต่อ thread
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SHEETS_RATE_DB, timeout=5, isolation_level=None)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheets_bucket ("
+            " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL,"
+            " interactive_until REAL NOT NULL DEFAULT 0)"
+        )
+        _local.conn = conn
+    return conn
+
+
+def _try_take(kind: str, priority: str) -> float:
+    """
+    ลองหยิบ 1 token (ใน transaction เดียว กันหลาย process แย่งกัน)
+    คืน 0 ถ้าได้ ไม่งั้นคืนจำนวนวินาทีที่ควรรอก่อนลองใหม่
+    bulk ต้องเหลือ token เกิน SHEETS_BULK_RESERVE และต้องไม่มี interactive รออยู่
+    """
+    rate = _RATES[kind] / 60.0
+    now = time.time()
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT tokens, updated_at, interactive_until FROM sheets_bucket WHERE name = ?", (kind,)
+        ).fetchone()
+        if row is None:
+            tokens, interactive_until = SHEETS_BURST, 0.0
+            conn.execute("INSERT INTO sheets_bucket (name, tokens, updated_at) VALUES (?, ?, ?)", (kind, tokens, now))
+        else:
+            tokens = min(SHEETS_BURST, row[0] + max(0.0, now - row[1]) * rate)
+            interactive_until = row[2]
+
+        need = 1.0 if priority == INTERACTIVE else 1.0 + SHEETS_BULK_RESERVE
+        wait = 0.0
+        if priority == BULK and now < interactive_until:
+            wait = interactive_until - now
+        elif tokens >= need:
+            tokens -= 1.0
+        else:
+            wait = (need - tokens) / rate
+            if priority == INTERACTIVE:
+                # บอก bulk ให้หลีกทางจนกว่า interactive คนนี้จะได้ token
+                interactive_until = max(interactive_until, now + wait + 0.5)
+
+        conn.execute(
+            "UPDATE sheets_bucket SET tokens = ?, updated_at = ?, interactive_until = ? WHERE name = ?",
+            (tokens, now, interactive_until, kind),
+        )
+        conn.execute("COMMIT")
+        return wait
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _acquire(kind: str, priority: str) -> None:
+    started = time.monotonic()
+    while True:
+        try:
+            wait = _try_take(kind, priority)
+        except sqlite3.Error:
+            # ถังใช้ไม่ได้ (ดิสก์/ล็อก) → ไม่บล็อกงาน ปล่อยให้ backoff ตอนเจอ 429 จัดการแทน
+            logger.exception("sheets rate bucket unavailable; calling without throttling")
+            _bump("bucket_errors")
+            return
+        if wait <= 0:
+            break
+        waited = time.monotonic() - started
+        if priority == INTERACTIVE and waited + wait > SHEETS_INTERACTIVE_MAX_WAIT:
+            break  # ไม่ให้ request ของผู้ใช้ค้างนาน ยิงเลยแล้วพึ่ง retry
+        time.sleep(min(wait, 1.0))
+    waited = time.monotonic() - started
+    if waited > 0.001:
+        _bump("throttled")
+        _bump("throttle_wait_s", waited)
+
+
+def _status(e) -> int:
+    return getattr(getattr(e, "response", None), "status_code", None) or 0
+
+
+def _retry_after(e):
+    try:
+        return float(e.response.headers.get("Retry-After"))
+    except Exception:
+        return None
+
+
+def sheets_call(fn, *args, kind: str = READ, priority: str = INTERACTIVE, **kwargs):
+    """
+    เรียก Sheets API ผ่าน token bucket กลาง
+    kind: READ/WRITE (โควตาแยกกัน), priority: INTERACTIVE (หน้าเว็บ/ลา) หรือ BULK (PEDX)
+    429 → retry แบบ exponential backoff + full jitter (เคารพ Retry-After ถ้ามี)
+    5xx retry เฉพาะการอ่าน เพราะการเขียนอาจสำเร็จไปแล้ว (append ซ้ำได้)
+    """
+    retryable = {429} if kind == WRITE else {429, 500, 502, 503}
+    for attempt in range(SHEETS_MAX_RETRIES + 1):
+        _acquire(kind, priority)
+        _bump("calls")
+        try:
+            return fn(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = _status(e)
+            if status not in retryable or attempt == SHEETS_MAX_RETRIES:
+                raise
+            if status == 429:
+                _bump("rate_limited")
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempt))
+            _bump("retries")
+            logger.warning("Sheets API %s (%s/%s), retry %d in %.1fs", status, kind, priority, attempt + 1, delay)
+            time.sleep(delay)
+
+
+def get_scheduler_stats() -> dict:
+    """สถิติของ worker นี้ (ใช้ดูใน /health)"""
+    with _stats_lock:
+        s = dict(_stats)
+    s["throttle_wait_s"] = round(s["throttle_wait_s"], 2)
+    s["reads_per_min"] = SHEETS_READS_PER_MIN
+    s["writes_per_min"] = SHEETS_WRITES_PER_MIN
+    return s
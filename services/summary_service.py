@@ -0,0 +1,83 @@
+from collections import Counter
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from models import db, Leave, LeaveSummary
+
+
+def _keys_for(name, leave_type, start_date) -> list:
+    keys = [(LeaveSummary.DIM_MONTH, start_date.strftime("%Y-%m"))]
+    if name:
+        keys.append((LeaveSummary.DIM_PERSON, name))
+    if leave_type:
+        keys.append((LeaveSummary.DIM_TYPE, leave_type))
+    return keys
+
+
+def apply_leave_to_summary(name, leave_type, start_date, delta: int) -> None:
+    """
+    ปรับตัวนับ +delta ใน session ปัจจุบัน (ไม่ commit) ให้ไปพร้อม insert/delete ของ Leave
+    ใช้ INSERT ... ON DUPLICATE KEY UPDATE ของ MySQL → แถวเดียวต่อ key ไม่ต้องอ่านก่อน
+    """
+    for dim, key in _keys_for(name, leave_type, start_date):
+        stmt = mysql_insert(LeaveSummary).values(dimension=dim, key=key, total=max(delta, 0))
+        stmt = stmt.on_duplicate_key_update(total=func.greatest(LeaveSummary.total + delta, 0))
+        db.session.execute(stmt)
+
+
+def apply_leaves_to_summary(leaves) -> None:
+    """
+    แบบหลายรายการ (นำเข้าแบบกลุ่ม): รวมยอด +1 ต่อ key ใน Python ก่อน
+    แล้วเขียนด้วย INSERT ... ON DUPLICATE KEY UPDATE แบบหลายแถวครั้งเดียว (ไม่ commit)
+    leaves = iterable ของ (name, leave_type, start_date)
+    """
+    counts = Counter()
+    for name, leave_type, start_date in leaves:
+        counts.update(_keys_for(name, leave_type, start_date))
+    if not counts:
+        return
+    stmt = mysql_insert(LeaveSummary).values([
+        {"dimension": dim, "key": key, "total": n} for (dim, key), n in counts.items()
+    ])
+    stmt = stmt.on_duplicate_key_update(total=LeaveSummary.total + stmt.inserted.total)
+    db.session.execute(stmt)
+
+
+def rebuild_leave_summary() -> dict:
+    """นับใหม่ทั้งหมดจากตาราง leave (ใช้ตอน backfill/แก้ข้อมูลตรง ๆ ใน DB) คืนจำนวนแถวต่อมิติ"""
+    month_key = func.date_format(Leave.start_date, "%Y-%m")
+    sources = {
+        LeaveSummary.DIM_MONTH: (month_key, None),
+        LeaveSummary.DIM_PERSON: (Leave.name, Leave.name != ""),
+        LeaveSummary.DIM_TYPE: (Leave.leave_type, Leave.leave_type != ""),
+    }
+    counts = {}
+    try:
+        LeaveSummary.query.delete(synchronize_session=False)
+        for dim, (key_expr, cond) in sources.items():
+            sel = select(db.literal(dim), key_expr, func.count(Leave.id))
+            if cond is not None:
+                sel = sel.where(cond)
+            sel = sel.group_by(key_expr)
+            res = db.session.execute(
+                insert(LeaveSummary).from_select(["dimension", "key", "total"], sel)
+            )
+            counts[dim] = res.rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return counts
+
+
+def get_summary(dimension: str) -> list:
+    """คืน [(key, total), ...] ที่ total > 0"""
+    q = LeaveSummary.query.filter(
+        LeaveSummary.dimension == dimension, LeaveSummary.total > 0
+    )
+    if dimension == LeaveSummary.DIM_MONTH:
+        q = q.order_by(LeaveSummary.key.asc())
+    else:
+        q = q.order_by(LeaveSummary.total.desc(), LeaveSummary.key.asc())
+    return [(row.key, row.total) for row in q.all()]
@@ -1,6 +1,6 @@
 import os, time
 import requests
-from typing import Optional
+from typing import NamedTuple, Optional
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
@@ -13,11 +13,27 @@ MAX_LEN = 4096
 
 _session = requests.Session()  # reuse TCP
 
+class SendResult(NamedTuple):
+    ok: bool
+    retry_after: Optional[float] = None  # วินาทีที่ Telegram ขอให้รอ (เฉพาะ 429)
+    error: Optional[str] = None
+
+def _retry_after(r) -> Optional[float]:
+    # Telegram ส่งทั้ง header Retry-After และ parameters.retry_after ใน body
+    try:
+        return float(r.json()["parameters"]["retry_after"])
+    except Exception:
+        pass
+    try:
+        return float(r.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
 def _send_once(text: str, *, disable_notification: bool = False,
-               reply_to_message_id: Optional[int] = None, timeout: float = 10.0) -> bool:
+               reply_to_message_id: Optional[int] = None, timeout: float = 10.0) -> SendResult:
     if not BOT_TOKEN or not CHAT_ID:
         print("❌ TELEGRAM_BOT_TOKEN/CHAT_ID is missing")
-        return False
+        return SendResult(False, error="TELEGRAM_BOT_TOKEN/CHAT_ID is missing")
 
     url = f"{API_BASE}/bot{BOT_TOKEN}/sendMessage"
     payload = {
@@ -32,25 +48,18 @@ def _send_once(text: str, *, disable_notification: bool = False,
     try:
         r = _session.post(url, data=payload, timeout=timeout)
         if r.status_code == 429:
-            # rate limit → caller จะจัดการ sleep เอง
-            return False
+            # rate limit → caller จะจัดการ sleep เอง ตาม retry_after
+            return SendResult(False, retry_after=_retry_after(r), error="429 Too Many Requests")
         if r.ok:
-            return True
+            return SendResult(True)
         print(f"[Telegram] {r.status_code} {r.text}")
-        return False
+        return SendResult(False, error=f"{r.status_code} {r.text[:200]}")
     except Exception as e:
         print("❌ Telegram exception:", e)
-        return False
-
-def send_telegram_message(message: str, *,
-                          disable_notification: bool = False,
-                          reply_to_message_id: Optional[int] = None,
-                          split_long: bool = True,
-                          max_retries: int = 3) -> bool:
-    """ส่งข้อความ HTML; คืน True ถ้าสำเร็จ (ถ้า split_long=True และยาว จะส่งหลายชิ้นให้ครบ)"""
-    if not message:
-        return True  # ไม่ต้องส่งอะไร
+        return SendResult(False, error=f"{type(e).__name__}: {e}"[:200])
 
+def split_message(message: str, split_long: bool = True) -> list:
+    """แบ่งข้อความยาวเกิน MAX_LEN ตามบรรทัด (หรือตัดท้ายถ้า split_long=False)"""
     texts = []
     if split_long and len(message) > MAX_LEN:
         # แบ่งตามบรรทัดเพื่อให้อ่านง่าย
@@ -66,22 +75,68 @@ def send_telegram_message(message: str, *,
             texts.append("".join(buf))
     else:
         texts = [message if len(message) <= MAX_LEN else (message[:MAX_LEN-3] + "...")]
+    return texts
+
+def send_telegram_message(message: str, *,
+                          disable_notification: bool = False,
+                          reply_to_message_id: Optional[int] = None,
+                          split_long: bool = True,
+                          max_retries: int = 3) -> bool:
+    """ส่งข้อความ HTML; คืน True ถ้าสำเร็จ (ถ้า split_long=True และยาว จะส่งหลายชิ้นให้ครบ)"""
+    if not message:
+        return True  # ไม่ต้องส่งอะไร
+
+    texts = split_message(message, split_long)
 
     # ส่งทีละชิ้น พร้อม retry 429 แบบสุภาพ
     for part in texts:
         for attempt in range(1, max_retries + 1):
-            ok = _send_once(part, disable_notification=disable_notification,
-                            reply_to_message_id=reply_to_message_id)
-            if ok:
+            res = _send_once(part, disable_notification=disable_notification,
+                             reply_to_message_id=reply_to_message_id)
+            if res.ok:
                 break
-            # ถ้าโดน 429, Telegram จะให้ header Retry-After; เราเดาแบบ backoff ขั้นต่ำ
-            backoff = min(5, attempt * 2)
+            # ถ้าโดน 429 ใช้ Retry-After ที่ Telegram บอก; ไม่งั้นเดาแบบ backoff ขั้นต่ำ
+            backoff = res.retry_after if res.retry_after else min(5, attempt * 2)
             time.sleep(backoff)
         else:
             print("[Telegram] giving up after retries")
             return False
     return True
 
+def pack_messages(messages: list, header: str = "", sep: str = "\n\n") -> list:
+    """
+    รวมหลายข้อความเป็นก้อนละไม่เกิน MAX_LEN โดยไม่ตัดข้อความใดข้อความหนึ่งกลางทาง
+    คืน [(text, [index ของข้อความในก้อนนั้น...]), ...] ให้ผู้เรียกรู้ว่าก้อนไหนมีรายการอะไร
+    header (ถ้ามี) ใส่หน้าทุกก้อน; ข้อความเดี่ยวที่ยาวเกิน MAX_LEN อยู่ก้อนของตัวเอง (deliver_once แบ่งตามบรรทัดให้)
+    """
+    packs = []
+    buf, idx, size = [], [], len(header)
+    for i, m in enumerate(messages):
+        add = len(m) + (len(sep) if buf else 0)
+        if buf and size + add > MAX_LEN:
+            packs.append((header + sep.join(buf), idx))
+            buf, idx, size = [], [], len(header)
+            add = len(m)
+        buf.append(m); idx.append(i)
+        size += add
+    if buf:
+        packs.append((header + sep.join(buf), idx))
+    return packs
+
+def deliver_once(message: str, start_part: int = 0, on_part=None) -> SendResult:
+    """
+    ส่ง 1 รอบแบบไม่ sleep/retry (ให้ outbox worker เป็นคนตัดสินใจเรื่องรอ/ลองใหม่)
+    ข้อความยาวถูกแบ่งหลายชิ้น: start_part = ข้ามชิ้นที่ส่งไปแล้ว, on_part(n) ถูกเรียกทุกครั้งที่ส่งครบ n ชิ้น
+    """
+    parts = split_message(message)
+    for n, part in enumerate(parts[start_part:], start=start_part + 1):
+        res = _send_once(part)
+        if not res.ok:
+            return res
+        if on_part is not None and n < len(parts):
+            on_part(n)
+    return SendResult(True)
+
 
 #---OLD---#
 def send_telegram_messageOLD(message: str):
@@ -0,0 +1,135 @@
+import os
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_, update
+
+from models import db, User, AuthToken, NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+VERIFY_TOKEN_TTL = timedelta(hours=float(os.getenv("VERIFY_TOKEN_TTL_HOURS", "48")))
+RESET_TOKEN_TTL = timedelta(minutes=float(os.getenv("RESET_TOKEN_TTL_MINUTES", "60")))
+TOKEN_PURGE_INTERVAL = float(os.getenv("TOKEN_PURGE_INTERVAL", "3600"))  # วินาที; 0 = ไม่ purge อัตโนมัติ
+TOKEN_KEEP_USED = timedelta(days=1)  # เก็บ token ที่ใช้แล้วไว้สักพักเผื่อตรวจสอบย้อนหลัง
+
+_TTL = {AuthToken.PURPOSE_VERIFY: VERIFY_TOKEN_TTL, AuthToken.PURPOSE_RESET: RESET_TOKEN_TTL}
+
+_purger_started = False
+_purger_lock = threading.Lock()
+
+
+def _utcnow():
+    # DB เก็บ UTC แบบ naive (ดู models.py)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _hash(raw: str) -> str:
+    return hashlib.sha256((raw or "").encode("utf-8")).hexdigest()
+
+
+def issue_token(user, purpose: str) -> str:
+    """
+    ออก token ใหม่ (เพิ่มลง session ไม่ commit) คืน token ดิบสำหรับใส่ในลิงก์ — DB เก็บแค่ hash
+    token ที่ยังไม่ได้ใช้ของผู้ใช้คนนี้ใน purpose เดียวกันจะถูกยกเลิก (ลิงก์เก่าใช้ไม่ได้)
+    user ต้องมี id แล้ว (ผู้ใช้ใหม่ให้ flush ก่อน)
+    """
+    return issue_tokens([user], purpose)[user.id]
+
+
+def issue_tokens(users, purpose: str) -> dict:
+    """แบบหลายคน: ยกเลิก token เก่าด้วย UPDATE เดียว แล้ว insert ทีเดียว คืน {user_id: token ดิบ}"""
+    ids = [u.id for u in users]
+    if not ids:
+        return {}
+    now = _utcnow()
+    db.session.execute(
+        update(AuthToken)
+        .where(AuthToken.user_id.in_(ids), AuthToken.purpose == purpose, AuthToken.used_at.is_(None))
+        .values(used_at=now)
+    )
+    raw = {uid: secrets.token_urlsafe(32) for uid in ids}
+    db.session.add_all([
+        AuthToken(token_hash=_hash(t), user_id=uid, purpose=purpose, expires_at=now + _TTL[purpose])
+        for uid, t in raw.items()
+    ])
+    return raw
+
+
+def peek_token(raw: str, purpose: str):
+    """คืน User ถ้า token ยังใช้ได้ (ไม่ consume) เช่นตอนแสดงฟอร์มตั้งรหัสใหม่"""
+    tok = AuthToken.query.filter_by(token_hash=_hash(raw), purpose=purpose).first()
+    if tok is None or tok.used_at is not None or tok.expires_at <= _utcnow():
+        return None
+    return db.session.get(User, tok.user_id)
+
+
+def consume_token(raw: str, purpose: str):
+    """
+    ใช้ token ครั้งเดียว: UPDATE แบบมีเงื่อนไข (ยังไม่ใช้ + ยังไม่หมดอายุ) ถ้าสองคำขอชนกันจะสำเร็จได้แค่คำขอเดียว
+    คืน User (อยู่ใน transaction เดียวกัน ผู้เรียกต้อง commit) หรือ None
+    """
+    now = _utcnow()
+    h = _hash(raw)
+    res = db.session.execute(
+        update(AuthToken)
+        .where(AuthToken.token_hash == h, AuthToken.purpose == purpose,
+               AuthToken.used_at.is_(None), AuthToken.expires_at > now)
+        .values(used_at=now)
+    )
+    if res.rowcount != 1:
+        return None
+    tok = AuthToken.query.filter_by(token_hash=h).first()
+    return db.session.get(User, tok.user_id) if tok else None
+
+
+def purge_expired_tokens() -> int:
+    """
+    ลบ token ที่หมดอายุ และ token ที่ใช้แล้วเกิน TOKEN_KEEP_USED (ต้องเรียกภายใต้ app context)
+    พร้อมลบแถวอีเมลใน outbox ที่จบงานแล้วเกิน TOKEN_KEEP_USED (แถวเก่าอาจยังมีลิงก์พร้อม token ดิบ)
+    คืนจำนวน token ที่ลบ
+    """
+    now = _utcnow()
+    n = AuthToken.query.filter(
+        or_(AuthToken.expires_at < now, AuthToken.used_at < now - TOKEN_KEEP_USED)
+    ).delete(synchronize_session=False)
+    emails = NotificationOutbox.query.filter(
+        NotificationOutbox.channel == "email",
+        NotificationOutbox.status.in_([NotificationOutbox.STATUS_SENT, NotificationOutbox.STATUS_FAILED]),
+        NotificationOutbox.created_at < now - TOKEN_KEEP_USED,
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if emails:
+        logger.info("purged %d finished email outbox rows", emails)
+    return n
+
+
+def _purge_loop(app, stop) -> None:
+    while not stop.wait(TOKEN_PURGE_INTERVAL):
+        with app.app_context():
+            try:
+                n = purge_expired_tokens()
+                if n:
+                    logger.info("purged %d expired auth tokens", n)
+            except Exception:
+                db.session.rollback()
+                logger.exception("auth token purge failed")
+            finally:
+                db.session.remove()
+
+
+def start_token_purger(app) -> bool:
+    """เริ่ม daemon thread ลบ token หมดอายุเป็นระยะ 1 ตัวต่อ process (เรียกซ้ำได้)"""
+    global _purger_started
+    if TOKEN_PURGE_INTERVAL <= 0:
+        return False
+    with _purger_lock:
+        if _purger_started:
+            return True
+        t = threading.Thread(target=_purge_loop, args=(app, threading.Event()), name="token-purger", daemon=True)
+        t.start()
+        _purger_started = True
+    return True
@@ -0,0 +1,187 @@
+import os
+import math
+
+from sqlalchemy import func, or_, update
+
+from models import db, User
+from .auth_service import send_verification_emails, send_password_reset_emails
+
+# ---- งานฝั่งแอดมินที่เกี่ยวกับบัญชีผู้ใช้: รายชื่อแบบแบ่งหน้า + กันถอนแอดมินคนสุดท้าย ---- #
+ADMIN_USERS_PER_PAGE = int(os.getenv("ADMIN_USERS_PER_PAGE", "50"))
+ADMIN_USERS_MAX_PER_PAGE = 200
+ADMIN_BULK_MAX = int(os.getenv("ADMIN_BULK_MAX", "500"))  # จำนวนผู้ใช้สูงสุดต่อคำสั่งแบบกลุ่ม
+
+BULK_ACTIONS = ("delete", "resend_verify", "force_reset", "grant_admin", "revoke_admin")
+
+
+class LastAdminError(Exception):
+    """การถอนสิทธิ์/ลบครั้งนี้จะทำให้ไม่เหลือแอดมินในระบบ"""
+
+
+def _parse_flag(value, field):
+    # "" / None = ไม่กรอง
+    if value in (None, ""):
+        return None
+    v = str(value).strip().lower()
+    if v in ("1", "true", "yes", "verified", "admin"):
+        return True
+    if v in ("0", "false", "no", "unverified", "user"):
+        return False
+    raise ValueError(f"{field} ไม่ถูกต้อง")
+
+
+def get_users_page(page=None, per_page=None, q=None, verified=None, admin=None) -> dict:
+    """
+    รายชื่อผู้ใช้ทีละหน้า เรียงตาม username
+    q = prefix ของ username หรือ email, verified/admin = กรองตามสถานะ ("" = ทั้งหมด)
+    คืน {"items", "total", "page", "pages", "per_page", "filters"}; ValueError = พารามิเตอร์ไม่ถูกต้อง
+    """
+    try:
+        page = int(page) if page not in (None, "") else 1
+        per_page = int(per_page) if per_page not in (None, "") else ADMIN_USERS_PER_PAGE
+    except ValueError as e:
+        raise ValueError("page/per_page ต้องเป็นตัวเลข") from e
+    page = max(1, page)
+    per_page = max(1, min(per_page, ADMIN_USERS_MAX_PER_PAGE))
+    q = (q or "").strip() or None
+    is_verified = _parse_flag(verified, "verified")
+    is_admin = _parse_flag(admin, "admin")
+
+    query = User.query
+    if q:
+        # prefix match → range scan บน unique index ของ username/email (MySQL ทำ index merge ให้)
+        query = query.filter(or_(
+            User.username.startswith(q, autoescape=True),
+            User.email.startswith(q, autoescape=True),
+        ))
+    if is_admin is not None:
+        query = query.filter(User.is_admin == is_admin)
+    if is_verified is not None:
+        query = query.filter(User.is_verified == is_verified)
+
+    total = query.order_by(None).with_entities(func.count(User.id)).scalar() or 0
+    pages = max(1, math.ceil(total / per_page))
+    page = min(page, pages)
+    items = query.order_by(User.username).offset((page - 1) * per_page).limit(per_page).all()
+    return {
+        "items": items,
+        "total": total,
+        "page": page,
+        "pages": pages,
+        "per_page": per_page,
+        "filters": {
+            "q": q or "",
+            "verified": "" if is_verified is None else ("1" if is_verified else "0"),
+            "admin": "" if is_admin is None else ("1" if is_admin else "0"),
+        },
+    }
+
+
+def count_admins(lock: bool = False) -> int:
+    """
+    จำนวนแอดมิน (COUNT เดียว ใช้ ix_user_admin_verified_username)
+    lock=True → SELECT ... FOR UPDATE ล็อกแถวแอดมินไว้จนจบ transaction
+    สองคำขอที่ถอนแอดมินพร้อมกันจึงต้องรอกัน ไม่เห็นจำนวนเก่าทั้งคู่
+    """
+    # ใช้ "= 1" ไม่ใช่ IS TRUE เพื่อให้ MySQL ใช้ index ได้
+    query = db.session.query(func.count(User.id)).filter(User.is_admin == True)  # noqa: E712
+    if lock:
+        query = query.with_for_update()
+    return query.scalar() or 0
+
+
+def set_admin(user: User, make_admin: bool) -> None:
+    """
+    เปลี่ยนสิทธิ์แอดมิน (ไม่ commit — ผู้เรียก commit ใน transaction เดียวกับการนับ)
+    ถอนแอดมินคนสุดท้าย → LastAdminError
+    """
+    if not make_admin and user.is_admin and count_admins(lock=True) <= 1:
+        raise LastAdminError("ไม่สามารถถอนสิทธิ์แอดมินคนสุดท้ายได้")
+    user.is_admin = bool(make_admin)
+
+
+def parse_user_ids(values) -> list:
+    """รายการ id จากฟอร์ม/JSON (ตัวเลขหรือสตริงคั่นด้วย comma) ตัดซ้ำ รักษาลำดับ; ValueError ถ้าไม่ถูกต้อง"""
+    ids = []
+    for v in values or []:
+        for part in str(v).split(","):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                ids.append(int(part))
+            except ValueError as e:
+                raise ValueError(f"user id ไม่ถูกต้อง: {part}") from e
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ValueError("ยังไม่ได้เลือกผู้ใช้")
+    if len(ids) > ADMIN_BULK_MAX:
+        raise ValueError(f"เลือกได้ไม่เกิน {ADMIN_BULK_MAX} คนต่อครั้ง")
+    return ids
+
+
+def bulk_user_action(action: str, user_ids, actor_id: int) -> dict:
+    """
+    ทำ action กับผู้ใช้หลายคนใน transaction เดียว:
+    SELECT ... FOR UPDATE ครั้งเดียว → ตัดคนที่ทำไม่ได้ → UPDATE/DELETE แบบ set-based ครั้งเดียว → commit
+    อีเมล (resend_verify/force_reset) เข้า outbox ใน transaction เดียวกันผ่านตัวส่งแบบกลุ่ม
+    คืน {"action", "results": {user_id: status}, "done": n}
+    status: ok, not_found, self, admin (ลบแอดมินไม่ได้), already_verified, already_admin, not_admin, last_admin
+    ผู้เรียกต้อง invalidate cache ของผู้ใช้ที่ status == "ok" เอง
+    """
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"action ต้องเป็นหนึ่งใน {', '.join(BULK_ACTIONS)}")
+    ids = parse_user_ids(user_ids)
+
+    try:
+        users = {u.id: u for u in User.query.filter(User.id.in_(ids)).order_by(User.id).with_for_update()}
+        results, targets = {}, []
+        for uid in ids:
+            user = users.get(uid)
+            if user is None:
+                results[uid] = "not_found"
+            elif uid == actor_id and action != "resend_verify":
+                results[uid] = "self"
+            elif action == "delete" and user.is_admin:
+                results[uid] = "admin"
+            elif action == "resend_verify" and user.is_verified:
+                results[uid] = "already_verified"
+            elif action == "grant_admin" and user.is_admin:
+                results[uid] = "already_admin"
+            elif action == "revoke_admin" and not user.is_admin:
+                results[uid] = "not_admin"
+            else:
+                targets.append(user)
+
+        if action == "revoke_admin" and targets:
+            # ต้องเหลือแอดมินอย่างน้อย 1 คน: นับแบบล็อกใน transaction นี้ แล้วถอนได้ไม่เกิน (จำนวน - 1)
+            keep = len(targets) - max(0, count_admins(lock=True) - 1)
+            if keep > 0:
+                for user in targets[-keep:]:
+                    results[user.id] = "last_admin"
+                targets = targets[:-keep]
+
+        target_ids = [u.id for u in targets]
+        if target_ids:
+            if action == "delete":
+                # auth_token ลบตามด้วย ON DELETE CASCADE
+                User.query.filter(User.id.in_(target_ids)).delete(synchronize_session=False)
+            elif action in ("grant_admin", "revoke_admin"):
+                db.session.execute(
+                    update(User).where(User.id.in_(target_ids))
+                    .values(is_admin=(action == "grant_admin"))
+                    .execution_options(synchronize_session=False)
+                )
+        if action == "resend_verify":
+            send_verification_emails(targets)   # commit + ปลุก worker
+        elif action == "force_reset":
+            send_password_reset_emails(targets)
+        else:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for uid in target_ids:
+        results[uid] = "ok"
+    return {"action": action, "results": results, "done": len(target_ids)}
@@ -0,0 +1,104 @@
+import os
+import time
+import tempfile
+import threading
+
+from flask_login import UserMixin
+
+from models import db, User
+
+# ---- cache ตัวตนผู้ใช้สำหรับ Flask-Login (ลด SELECT user ทุก request) ---- #
+# เก็บเฉพาะฟิลด์ที่ request/template ใช้ ไม่เก็บ password_hash/token
+# ล้าง cache ข้าม gunicorn worker ด้วย mtime ของไฟล์ stamp (stat 1 ครั้งต่อ request ไม่ต้องถาม DB)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # 0 = ปิด cache
+USER_CACHE_STAMP = os.getenv("USER_CACHE_STAMP") or os.path.join(tempfile.gettempdir(), "leaveapp_user_cache.stamp")
+
+_lock = threading.Lock()
+_cache = {}          # user_id -> (CachedUser, loaded_at)
+_seen_stamp = [None]
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+class CachedUser(UserMixin):
+    """snapshot ของ User ที่ใช้เป็น current_user; ถ้าต้องแก้ไข/ลบให้โหลด User จริงจาก DB"""
+
+    def __init__(self, user: User):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.is_admin = bool(user.is_admin)
+        self.is_verified = bool(user.is_verified)
+
+    def __repr__(self) -> str:
+        return f"<CachedUser '{self.username}'>"
+
+
+def _stamp():
+    try:
+        return os.stat(USER_CACHE_STAMP).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _sync_with_other_workers() -> None:
+    # worker อื่น invalidate → mtime ของ stamp เปลี่ยน → ล้างทั้ง cache (ผู้ใช้เปลี่ยนไม่บ่อย)
+    stamp = _stamp()
+    if stamp != _seen_stamp[0]:
+        _cache.clear()
+        _seen_stamp[0] = stamp
+
+
+def load_cached_user(user_id):
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    if USER_CACHE_TTL <= 0:
+        user = db.session.get(User, uid)
+        return CachedUser(user) if user else None
+
+    now = time.monotonic()
+    with _lock:
+        _sync_with_other_workers()
+        entry = _cache.get(uid)
+        if entry is not None and now - entry[1] < USER_CACHE_TTL:
+            _stats["hits"] += 1
+            return entry[0]
+        _stats["misses"] += 1
+
+    user = db.session.get(User, uid)
+    if user is None:
+        return None
+    snap = CachedUser(user)
+    with _lock:
+        _cache[uid] = (snap, now)
+    return snap
+
+
+def invalidate_user(user_id=None) -> None:
+    """ล้าง cache ของผู้ใช้คนนี้ (None = ทุกคน) ใน worker นี้ และส่งสัญญาณให้ worker อื่นล้างด้วย"""
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(int(user_id), None)
+        _stats["invalidations"] += 1
+        try:
+            with open(USER_CACHE_STAMP, "a"):
+                pass
+            prev = _stamp() or 0
+            now_ns = time.time_ns()
+            os.utime(USER_CACHE_STAMP, ns=(now_ns, max(now_ns, prev + 1)))  # ให้ mtime เปลี่ยนแน่ ๆ
+            _seen_stamp[0] = _stamp()
+        except OSError:
+            pass  # ไม่มีที่เขียน stamp → worker อื่นจะเห็นค่าใหม่เมื่อครบ TTL
+
+
+def get_user_cache_stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+        s["size"] = len(_cache)
+    total = s["hits"] + s["misses"]
+    s["hit_rate"] = round(s["hits"] / total, 3) if total else 0.0
+    s["ttl"] = USER_CACHE_TTL
+    return s
@@ -105,31 +105,10 @@ function initMonthSelect() {
 
 async function loadCalendar(month = getCurrentMonth()) {
   try {
-    const res = await axios.get(`/calendar?month=${month}`);
-    const data = res.data || [];
-
+    // [CHANGE] ให้ server แตกช่วงลาเป็นรายวันมาให้ (expand=days) ไม่ต้องไล่วันเองฝั่ง client
     // dayMap: {'2025-06-01': ['คุณเอ (ลาพักร้อน)', ...]}
-    const dayMap = Object.create(null);
-
-    // [CHANGE] ใช้ parseYMD เพื่อกันการเลื่อนวันเพราะ timezone
-    data.forEach((row) => {
-      const start = parseYMD(row["Start Date"]);
-      const end = parseYMD(row["End Date"]);
-      if (!start || !end) return;
-
-      // เดินวันจาก start..end แบบ “วันที่” ไม่ยุ่ง timezone
-      for (let d = new Date(start); d <= end; d.setDate(d.getDate() + 1)) {
-        const y = d.getFullYear();
-        const m = String(d.getMonth() + 1).padStart(2, "0");
-        const day = String(d.getDate()).padStart(2, "0");
-        const ymd = `${y}-${m}-${day}`;
-
-        if (ymd.startsWith(month)) {
-          if (!dayMap[ymd]) dayMap[ymd] = [];
-          dayMap[ymd].push(`${row["Name"]} (${row["Leave Type"]})`);
-        }
-      }
-    });
+    const res = await axios.get("/calendar", { params: { month, expand: "days" } });
+    const dayMap = res.data?.days || {};
 
     const calendar = document.getElementById("calendar");
     calendar.innerHTML = "";
@@ -222,88 +201,130 @@ document.getElementById("leaveForm").addEventListener("submit", async function (
 // ตารางรายการวันลาทั้งหมด
 // ================================
 
-async function loadLeaveTable() {
+// [CHANGE] ดึงทีละหน้าจาก /data?limit=&cursor= (เรียงบันทึกล่าสุดก่อน) แทนการโหลดทั้งประวัติ
+// [WHY] payload และหน่วยความจำเบราว์เซอร์คงที่ไม่ว่าข้อมูลจะสะสมกี่ปี
+const LEAVE_PAGE_SIZE = 50;
+const LEAVE_HEADERS = ["Timestamp", "Name", "Leave Type", "Start Date", "End Date", "Note"];
+const leaveTableState = { cursor: null, loading: false };
+
+function leaveTableFilters() {
+  // ช่องกรองใน _alltable.html (ไม่มีก็ได้)
+  const val = (id) => (document.getElementById(id)?.value || "").trim();
+  const params = {};
+  if (val("filterName")) params.name = val("filterName");
+  if (val("filterLeaveType")) params.leave_type = val("filterLeaveType");
+  if (val("filterDateFrom")) params.date_from = val("filterDateFrom");
+  if (val("filterDateTo")) params.date_to = val("filterDateTo");
+  return params;
+}
+
+function renderLeaveHeader(thead) {
+  // [CLEANUP] หัวตาราง (ไม่โชว์ code)
+  thead.innerHTML = "";
+  const headerRow = document.createElement("tr");
+  LEAVE_HEADERS.forEach((h) => {
+    const th = document.createElement("th");
+    th.textContent = h;
+    headerRow.appendChild(th);
+  });
+  const deleteTh = document.createElement("th");
+  deleteTh.textContent = "ลบ";
+  headerRow.appendChild(deleteTh);
+  thead.appendChild(headerRow);
+}
+
+const LEAVE_ID_RE = /^[0-9a-f]{32}$/;
+
+function renderLeaveRow(tbody, row) {
+  const headers = LEAVE_HEADERS;
+  const tr = document.createElement("tr");
+
+  headers.forEach((h) => {
+    const tdEl = document.createElement("td");
+    if (h === "Timestamp") {
+      tdEl.textContent = fmtBkkFromUTC(row[h]); // [CHANGE] แปลงเวลาเป็นไทย
+    } else {
+      tdEl.textContent = row[h] ?? "";
+    }
+    tr.appendChild(tdEl);
+  });
+
+  // ปุ่มลบ
+  const deleteTd = document.createElement("td");
+  const deleteBtn = document.createElement("button");
+  deleteBtn.textContent = "ลบ";
+  deleteBtn.className = "btn btn-danger btn-sm";
+  deleteBtn.onclick = async () => {
+    // [CHANGE] แถวที่มี leave id (คอลัมน์ code เป็น uuid hex 32 ตัว) ลบด้วย id → ลบตรงกันทั้ง MySQL และชีต
+    // แถวเก่า (ไม่มี code หรือ code เป็นรหัสลบที่ตั้งเอง) ใช้วิธีเดิม: timestamp + รหัสยืนยัน
+    let payload;
+    if (LEAVE_ID_RE.test(row["code"] || "")) {
+      if (!confirm("ยืนยันการลบรายการนี้?")) return;
+      payload = { id: row["code"] };
+    } else {
+      const code = prompt("กรอกรหัสลบเพื่อยืนยัน:");
+      // ยอมให้ผู้ใช้กดยืนยันโดยไม่กรอก code (ตามฝั่ง backend ที่ให้ fallback ลบด้วย timestamp ได้)
+      if (code === null) return;
+      payload = { timestamp: row["Timestamp"], code: code || "" };
+    }
+    try {
+      const r = await axios.post("/delete", payload);
+
+      if (r.data && r.data.success) {
+        alert("ลบข้อมูลสำเร็จ");
+        loadLeaveTable();
+        loadCalendar();
+      } else {
+        alert("ลบไม่สำเร็จ (รหัสไม่ตรงหรือหาแถวไม่เจอ)");
+      }
+    } catch (err) {
+      alert("เกิดข้อผิดพลาดในการลบ");
+    }
+  };
+
+  deleteTd.appendChild(deleteBtn);
+  tr.appendChild(deleteTd);
+  tbody.appendChild(tr);
+}
+
+// reset=true: เริ่มหน้าแรกใหม่ (หลังบันทึก/ลบ/เปลี่ยน filter); false: ต่อท้ายหน้าถัดไป
+async function loadLeaveTable(reset = true) {
+  if (leaveTableState.loading) return;
+  leaveTableState.loading = true;
+
+  const table = document.getElementById("leaveTable");
+  const thead = table.querySelector("thead");
+  const tbody = table.querySelector("tbody");
+  const moreBtn = document.getElementById("leaveLoadMore");
+
   try {
-    const res = await axios.get("/data");
-    const data = res.data || [];
+    const params = { ...leaveTableFilters(), limit: LEAVE_PAGE_SIZE };
+    if (!reset && leaveTableState.cursor) params.cursor = leaveTableState.cursor;
 
-    const table = document.getElementById("leaveTable");
-    const thead = table.querySelector("thead");
-    const tbody = table.querySelector("tbody");
+    const res = await axios.get("/data", { params });
+    const items = res.data?.items || [];
+    leaveTableState.cursor = res.data?.next_cursor || null;
 
-    thead.innerHTML = "";
-    tbody.innerHTML = "";
+    if (reset) {
+      renderLeaveHeader(thead);
+      tbody.innerHTML = "";
+    }
 
-    if (data.length === 0) {
+    if (reset && items.length === 0) {
       tbody.innerHTML = "<tr><td colspan='7'>ไม่มีข้อมูลวันลา</td></tr>";
-      return;
     }
 
-    // [CLEANUP] หัวตาราง (ไม่โชว์ code)
-    const headers = ["Timestamp", "Name", "Leave Type", "Start Date", "End Date", "Note"];
-    const headerRow = document.createElement("tr");
-    headers.forEach((h) => {
-      const th = document.createElement("th");
-      th.textContent = h;
-      headerRow.appendChild(th);
-    });
-    const deleteTh = document.createElement("th");
-    deleteTh.textContent = "ลบ";
-    headerRow.appendChild(deleteTh);
-    thead.appendChild(headerRow);
-
     // [CHANGE] เรนเดอร์ Timestamp เป็นเวลาไทย (UTC -> BKK) และใช้ textContent ทุกช่องเพื่อความปลอดภัย
-    data.forEach((row) => {
-      const tr = document.createElement("tr");
-
-      headers.forEach((h) => {
-        const tdEl = document.createElement("td");
-        if (h === "Timestamp") {
-          tdEl.textContent = fmtBkkFromUTC(row[h]); // [CHANGE] แปลงเวลาเป็นไทย
-        } else {
-          tdEl.textContent = row[h] ?? "";
-        }
-        tr.appendChild(tdEl);
-      });
-
-      // ปุ่มลบ
-      const deleteTd = document.createElement("td");
-      const deleteBtn = document.createElement("button");
-      deleteBtn.textContent = "ลบ";
-      deleteBtn.className = "btn btn-danger btn-sm";
-      deleteBtn.onclick = async () => {
-        const code = prompt("กรอกรหัสลบเพื่อยืนยัน:");
-        // [CHANGE] ยอมให้ผู้ใช้กดยืนยันโดยไม่กรอก code (ตามฝั่ง backend ที่ให้ fallback ลบด้วย timestamp ได้)
-        // ถ้าอยาก 'บังคับกรอก code เสมอ' ให้ยกเลิกตรงนี้เป็น: if (!code) return;
-        try {
-          const r = await axios.post("/delete", {
-            timestamp: row["Timestamp"],
-            code: code || "",
-          });
-
-          if (r.data && r.data.success) {
-            alert("ลบข้อมูลสำเร็จ");
-            loadLeaveTable();
-            loadCalendar();
-          } else {
-            alert("ลบไม่สำเร็จ (รหัสไม่ตรงหรือหาแถวไม่เจอ)");
-          }
-        } catch (err) {
-          alert("เกิดข้อผิดพลาดในการลบ");
-        }
-      };
-
-      deleteTd.appendChild(deleteBtn);
-      tr.appendChild(deleteTd);
-      tbody.appendChild(tr);
-    });
+    items.forEach((row) => renderLeaveRow(tbody, row));
+
+    if (moreBtn) moreBtn.classList.toggle("d-none", !leaveTableState.cursor);
   } catch (err) {
     console.error("loadLeaveTable failed:", err);
-    const table = document.getElementById("leaveTable");
-    const tbody = table.querySelector("tbody");
     if (tbody) {
       tbody.innerHTML = "<tr><td colspan='7'>โหลดข้อมูลไม่สำเร็จ</td></tr>";
     }
+  } finally {
+    leaveTableState.loading = false;
   }
 }
 
@@ -323,3 +344,9 @@ setTimeout(() => {
 initMonthSelect();
 loadCalendar();
 loadLeaveTable();
+
+document.getElementById("leaveLoadMore")?.addEventListener("click", () => loadLeaveTable(false));
+document.getElementById("leaveFilterForm")?.addEventListener("submit", (e) => {
+  e.preventDefault();
+  loadLeaveTable();
+});
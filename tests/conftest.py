@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# create_app ต้องมี env เหล่านี้ (ค่าปลอม; เทสต์ใช้ SQLite in-memory แทน MySQL)
+for key, value in {
+    "SECRET_KEY": "test",
+    "MYSQL_USER": "test",
+    "MYSQL_PASSWORD": "test",
+    "MYSQL_HOST": "localhost",
+    "MYSQL_DB": "test",
+    "ENABLE_BACKGROUND_WORKERS": "0",
+    "SHEETS_RATE_DB": os.path.join(tempfile.mkdtemp(), "sheets_rate.sqlite3"),
+}.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from models import db as _db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "SQLALCHEMY_ENGINE_OPTIONS": {},
+        "ENABLE_BACKGROUND_WORKERS": False,
+    })
+    with app.app_context():
+        _db.create_all()
+        yield app
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    return _db
@@ -0,0 +1,47 @@
+import io
+
+import pytest
+
+from services import leave_import_service
+
+
+def _csv(text):
+    return io.BytesIO(text.encode("utf-8-sig"))
+
+
+def test_validate_import_splits_valid_rows_from_errors():
+    stream = _csv(
+        "Name,Leave Type,Start Date,End Date,Note\n"
+        "สมชาย,ลาพักผ่อน,2024-05-01,2024-05-02,เที่ยว\n"
+        ",ลาป่วย,2024-05-01,2024-05-01,\n"
+        "สมหญิง,ลาป่วย,2024-05-03,2024-05-01,\n"
+        "สมศรี,ลาป่วย,01/05/2024,2024-05-01,\n"
+        "\n"
+        f"{'ก' * 101},ลาป่วย,2024-05-01,2024-05-01,\n"
+        f"สมปอง,{'x' * 51},2024-05-01,2024-05-01,\n"
+    )
+    valid, errors = leave_import_service.validate_import(stream, "csv")
+
+    assert [r["name"] for r in valid] == ["สมชาย"]
+    assert valid[0]["start_date"].isoformat() == "2024-05-01"
+    # เลขแถวในไฟล์ (หัวตาราง = 1) ข้ามแถวว่างแต่ยังนับบรรทัด
+    assert [e["row"] for e in errors] == [3, 4, 5, 7, 8]
+
+
+def test_missing_required_column_rejects_the_whole_file():
+    with pytest.raises(ValueError):
+        leave_import_service.validate_import(_csv("name,start_date,end_date\nก,2024-05-01,2024-05-01\n"), "csv")
+
+
+def test_row_limit(monkeypatch):
+    monkeypatch.setattr(leave_import_service, "LEAVE_IMPORT_MAX_ROWS", 1)
+    stream = _csv("name,leave_type,start_date,end_date\n"
+                  "ก,ลาป่วย,2024-05-01,2024-05-01\n"
+                  "ข,ลาป่วย,2024-05-01,2024-05-01\n")
+    with pytest.raises(ValueError):
+        leave_import_service.validate_import(stream, "csv")
+
+
+def test_non_utf8_csv_is_a_file_error():
+    with pytest.raises(ValueError):
+        leave_import_service.validate_import(io.BytesIO("name,leave_type\n".encode("cp874") + b"\xff\xfe\n"), "csv")
@@ -0,0 +1,48 @@
+from datetime import date, datetime
+
+import pytest
+
+from models import Leave
+from services import leave_service
+
+
+def test_cursor_round_trips_without_padding():
+    payload = {"t": "2024-05-01T08:30:00", "i": 42}
+    cursor = leave_service._encode_cursor(payload)
+    assert "=" not in cursor
+    assert leave_service._decode_cursor(cursor) == payload
+
+
+@pytest.mark.parametrize("cursor", ["!!!", "bm90LWpzb24", "WzEsMl0"])  # ไม่ใช่ base64 / ไม่ใช่ JSON / ไม่ใช่ dict
+def test_bad_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        leave_service._decode_cursor(cursor)
+
+
+@pytest.fixture
+def db_backend(db, monkeypatch):
+    monkeypatch.setattr(leave_service, "LEAVE_READ_BACKEND", "db")
+    same = datetime(2024, 5, 1, 8, 0, 0)
+    stamps = [datetime(2024, 5, 2, 9, 0, 0), same, same, same, datetime(2024, 4, 30, 7, 0, 0)]
+    for i, ts in enumerate(stamps):
+        db.session.add(Leave(name=f"user{i}", leave_type="ลาพักผ่อน", start_date=date(2024, 5, 1),
+                             end_date=date(2024, 5, 1), note="", timestamp=ts))
+    db.session.commit()
+    return db
+
+
+def test_keyset_pages_cover_every_row_once_across_timestamp_ties(db_backend):
+    seen, cursor = [], None
+    while True:
+        page = leave_service.get_leaves_page(limit=2, cursor=cursor)
+        seen += [row["Name"] for row in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    # ใหม่ -> เก่า; timestamp เท่ากันเรียงตาม id มากไปน้อย
+    assert seen == ["user0", "user3", "user2", "user1", "user4"]
+
+
+def test_cursor_without_keyset_fields_is_rejected_in_db_mode(db_backend):
+    with pytest.raises(ValueError):
+        leave_service.get_leaves_page(cursor=leave_service._encode_cursor({"o": 2}))
@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+import pytest
+
+from models import NotificationOutbox
+from services import outbox_service
+from services.telegram_service import SendResult
+
+
+def _item(db, **kw):
+    kw.setdefault("channel", "telegram")
+    kw.setdefault("message", "hello")
+    item = NotificationOutbox(**kw)
+    db.session.add(item)
+    db.session.commit()
+    return item.id
+
+
+def _fresh(db, item_id):
+    return db.session.get(NotificationOutbox, item_id, populate_existing=True)
+
+
+def test_claim_is_exclusive_until_the_lease_expires(db):
+    now = outbox_service._utcnow()
+    item_id = _item(db, next_attempt_at=now - timedelta(seconds=1))
+
+    assert outbox_service._claim(item_id, now) is True
+    item = _fresh(db, item_id)
+    assert item.status == NotificationOutbox.STATUS_SENDING
+    assert item.attempts == 1
+    assert item.next_attempt_at == now + timedelta(seconds=outbox_service.OUTBOX_LEASE_SECONDS)
+
+    # worker อื่นจองซ้ำระหว่าง lease ไม่ได้
+    assert outbox_service._claim(item_id, now) is False
+    # lease หมด (worker แรกตาย) → จองใหม่ได้ และนับ attempt เพิ่ม
+    later = now + timedelta(seconds=outbox_service.OUTBOX_LEASE_SECONDS + 1)
+    assert outbox_service._claim(item_id, later) is True
+    assert _fresh(db, item_id).attempts == 2
+
+
+def test_claim_skips_rows_not_yet_due_unless_due_only_is_false(db):
+    now = outbox_service._utcnow()
+    item_id = _item(db, next_attempt_at=now + timedelta(minutes=5))
+
+    assert outbox_service._claim(item_id, now) is False
+    assert outbox_service._claim(item_id, now, due_only=False) is True
+
+
+def test_failed_delivery_backs_off_then_fails_permanently(db, monkeypatch):
+    monkeypatch.setitem(outbox_service._CHANNELS, "telegram", lambda item: SendResult(False, error="boom"))
+    monkeypatch.setattr(outbox_service, "OUTBOX_MAX_ATTEMPTS", 2)
+    item_id = _item(db, next_attempt_at=outbox_service._utcnow() - timedelta(seconds=1))
+
+    assert outbox_service._deliver_single(item_id) is False
+    item = _fresh(db, item_id)
+    assert item.status == NotificationOutbox.STATUS_PENDING
+    assert item.last_error == "boom"
+    assert item.next_attempt_at > outbox_service._utcnow()
+
+    item.next_attempt_at = outbox_service._utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert outbox_service._deliver_single(item_id) is False
+    item = _fresh(db, item_id)
+    assert item.status == NotificationOutbox.STATUS_FAILED
+    assert item.attempts == 2
+
+
+def test_retry_after_postpones_the_row_and_stops_the_pass(db, monkeypatch):
+    monkeypatch.setitem(outbox_service._CHANNELS, "telegram",
+                        lambda item: SendResult(False, retry_after=30, error="429 Too Many Requests"))
+    item_id = _item(db, next_attempt_at=outbox_service._utcnow() - timedelta(seconds=1))
+
+    assert outbox_service._deliver_single(item_id) == "stop"
+    item = _fresh(db, item_id)
+    assert item.status == NotificationOutbox.STATUS_PENDING
+    assert item.next_attempt_at >= outbox_service._utcnow() + timedelta(seconds=25)
+
+
+def test_successful_delivery_marks_sent_and_scrubs_email_body(db, monkeypatch):
+    monkeypatch.setitem(outbox_service._CHANNELS, "email", lambda item: SendResult(True))
+    item_id = _item(db, channel="email", next_attempt_at=outbox_service._utcnow() - timedelta(seconds=1),
+                    message='{"to": "a@example.com", "subject": "s", "html": "https://x/reset/raw-token"}')
+
+    assert outbox_service._deliver_single(item_id) is True
+    item = _fresh(db, item_id)
+    assert item.status == NotificationOutbox.STATUS_SENT
+    assert item.sent_at is not None
+    assert "raw-token" not in item.message
+
+
+@pytest.mark.parametrize("n, header", [(1, False), (3, True)])
+def test_digest_header_counts_the_items_in_the_message(db, monkeypatch, n, header):
+    sent = []
+    monkeypatch.setattr(outbox_service, "deliver_once", lambda text, **kw: sent.append(text) or SendResult(True))
+    ids = [_item(db, message=f"leave {i}", digest=True) for i in range(n)]
+
+    assert outbox_service._deliver_digest(10) == n
+    assert len(sent) == 1
+    expected = outbox_service.TELEGRAM_DIGEST_HEADER.format(n=n)
+    assert sent[0].startswith(expected) is header
+    assert all(f"leave {i}" in sent[0] for i in range(n))
+    assert all(_fresh(db, i).status == NotificationOutbox.STATUS_SENT for i in ids)
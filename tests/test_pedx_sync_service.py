@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+from models import PedxRow, PedxSyncState
+from services import pedx_sync_service as pedx
+
+WS = "pedx"
+
+
+class FakeWorksheet:
+    def __init__(self, next_row):
+        self.next_row = next_row
+        self.updated, self.cleared, self.appended = [], [], []
+
+    def batch_update(self, data, **kw):
+        self.updated += data
+
+    def batch_clear(self, ranges):
+        self.cleared += ranges
+
+    def append_rows(self, rows, **kw):
+        start = self.next_row
+        self.appended += rows
+        self.next_row += len(rows)
+        return {"updates": {"updatedRange": f"{WS}!A{start}:D{start + len(rows) - 1}"}}
+
+
+def _cells(vn, vstdate, extra="x"):
+    return [vn, "HN", extra, vstdate.isoformat()]
+
+
+def test_delta_sync_classifies_changed_new_and_vanished_rows(db, monkeypatch):
+    today = date.today()
+    since = today - timedelta(days=1)
+    old_day = today - timedelta(days=30)
+
+    same, changed, vanished, old = (_cells("A", today), _cells("B", today),
+                                    _cells("C", since), _cells("D", old_day))
+    for n, cells in enumerate((same, changed, vanished, old), start=2):
+        db.session.add(PedxRow(worksheet=WS, vn=cells[0], vstdate=pedx._vstdate(cells),
+                               row_number=n, content_hash=pedx._row_hash(cells)))
+    state = PedxSyncState(worksheet=WS, start_date=old_day, watermark=today)
+    db.session.add(state)
+    db.session.commit()
+
+    fetched = [same, _cells("B", today, extra="edited"), _cells("E", today)]
+    ws = FakeWorksheet(next_row=6)
+    recorded = []
+    monkeypatch.setattr(pedx, "_fetch_since", lambda d: fetched)
+    monkeypatch.setattr(pedx, "_open_worksheet", lambda: ws)
+    monkeypatch.setattr(pedx, "sheets_call", lambda fn, *a, kind=None, priority=None, **kw: fn(*a, **kw))
+    # INSERT ... ON DUPLICATE KEY UPDATE เป็นของ MySQL → เก็บไว้ตรวจแทน
+    monkeypatch.setattr(pedx, "_record_appended", lambda w, rows, resp: recorded.append((rows, resp)))
+
+    result = pedx._delta_sync(WS, state, pedx._noop_progress)
+
+    assert (result["updated"], result["appended"], result["removed"]) == (1, 1, 1)
+    assert result["since"] == since.isoformat()
+    assert [u["range"] for u in ws.updated] == ["A3:D3"]            # B เขียนทับแถวเดิม
+    assert ws.cleared == ["4:4"]                                      # C หายจากช่วง → ล้างแถว
+    assert [r[0] for r in ws.appended] == ["E"]                       # E ใหม่ → append ท้ายชีต
+    assert recorded[0][0] == [fetched[2]]
+    assert db.session.get(PedxRow, (WS, "B")).content_hash == pedx._row_hash(fetched[1])
+    assert db.session.get(PedxRow, (WS, "C")) is None
+    assert db.session.get(PedxRow, (WS, "D")) is not None              # นอกช่วงที่ดึง ไม่แตะ
@@ -0,0 +1,90 @@
+import gspread
+import pytest
+import requests
+
+from services import sheets_scheduler as sched
+
+
+@pytest.fixture(autouse=True)
+def bucket(tmp_path, monkeypatch):
+    # ถังแยกต่อเทสต์ + เวลาแบบควบคุมได้
+    monkeypatch.setattr(sched, "SHEETS_RATE_DB", str(tmp_path / "bucket.sqlite3"))
+    monkeypatch.setattr(sched._local, "conn", None, raising=False)
+    monkeypatch.setattr(sched, "SHEETS_BURST", 3.0)
+    monkeypatch.setattr(sched, "SHEETS_BULK_RESERVE", 1.0)
+    monkeypatch.setitem(sched._RATES, sched.WRITE, 60.0)  # 1 token/วินาที
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(sched.time, "time", lambda: clock["now"])
+    return clock
+
+
+def test_bucket_allows_a_burst_then_asks_to_wait(bucket):
+    for _ in range(3):
+        assert sched._try_take(sched.WRITE, sched.INTERACTIVE) == 0
+    assert sched._try_take(sched.WRITE, sched.INTERACTIVE) == pytest.approx(1.0)
+
+    bucket["now"] += 1.0  # เติม 1 token
+    assert sched._try_take(sched.WRITE, sched.INTERACTIVE) == 0
+
+
+def test_bulk_leaves_the_reserve_for_interactive(bucket):
+    assert sched._try_take(sched.WRITE, sched.BULK) == 0   # 3 -> 2
+    assert sched._try_take(sched.WRITE, sched.BULK) == 0   # 2 -> 1
+    assert sched._try_take(sched.WRITE, sched.BULK) > 0    # เหลือ 1 = reserve
+    assert sched._try_take(sched.WRITE, sched.INTERACTIVE) == 0
+
+
+def test_waiting_interactive_call_holds_back_bulk(bucket):
+    for _ in range(3):
+        sched._try_take(sched.WRITE, sched.INTERACTIVE)
+    assert sched._try_take(sched.WRITE, sched.INTERACTIVE) == pytest.approx(1.0)
+
+    # interactive รออยู่ (จองทางไว้ถึง now + 1.5) → bulk ต้องหลีกแม้ถังจะมี token แล้ว
+    bucket["now"] += 1.0
+    assert sched._try_take(sched.WRITE, sched.BULK) > 0
+    bucket["now"] += 4.0
+    assert sched._try_take(sched.WRITE, sched.BULK) == 0
+
+
+def _api_error(status, retry_after=None):
+    resp = requests.models.Response()
+    resp.status_code = status
+    resp._content = b'{"error": {"code": %d, "message": "x", "status": "X"}}' % status
+    if retry_after is not None:
+        resp.headers["Retry-After"] = str(retry_after)
+    return gspread.exceptions.APIError(resp)
+
+
+def test_sheets_call_honours_retry_after(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(sched, "_acquire", lambda kind, priority: None)
+    monkeypatch.setattr(sched.time, "sleep", sleeps.append)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            raise _api_error(429, retry_after=7)
+        return "ok"
+
+    assert sched.sheets_call(fn, kind=sched.WRITE) == "ok"
+    assert sleeps == [7.0]
+
+
+def test_sheets_call_does_not_retry_5xx_writes(monkeypatch):
+    monkeypatch.setattr(sched, "_acquire", lambda kind, priority: None)
+    monkeypatch.setattr(sched.time, "sleep", lambda s: None)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise _api_error(503)
+
+    with pytest.raises(gspread.exceptions.APIError):
+        sched.sheets_call(fn, kind=sched.WRITE)
+    assert len(calls) == 1
+
+    calls.clear()
+    with pytest.raises(gspread.exceptions.APIError):
+        sched.sheets_call(fn, kind=sched.READ)
+    assert len(calls) == sched.SHEETS_MAX_RETRIES + 1
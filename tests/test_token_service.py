@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+import pytest
+
+from models import AuthToken, User
+from services import token_service
+
+
+@pytest.fixture
+def user(db):
+    u = User(username="alice", email="alice@example.com")
+    u.set_password("secret")
+    db.session.add(u)
+    db.session.commit()
+    return u
+
+
+def test_token_can_be_consumed_only_once(db, user):
+    raw = token_service.issue_token(user, AuthToken.PURPOSE_RESET)
+    db.session.commit()
+
+    assert token_service.peek_token(raw, AuthToken.PURPOSE_RESET) == user
+    assert token_service.consume_token(raw, AuthToken.PURPOSE_RESET) == user
+    db.session.commit()
+    assert token_service.consume_token(raw, AuthToken.PURPOSE_RESET) is None
+    assert token_service.peek_token(raw, AuthToken.PURPOSE_RESET) is None
+
+
+def test_token_is_bound_to_its_purpose(db, user):
+    raw = token_service.issue_token(user, AuthToken.PURPOSE_VERIFY)
+    db.session.commit()
+    assert token_service.consume_token(raw, AuthToken.PURPOSE_RESET) is None
+
+
+def test_expired_token_cannot_be_consumed(db, user):
+    raw = token_service.issue_token(user, AuthToken.PURPOSE_RESET)
+    db.session.commit()
+    tok = AuthToken.query.filter_by(token_hash=token_service._hash(raw)).one()
+    tok.expires_at = token_service._utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+    assert token_service.consume_token(raw, AuthToken.PURPOSE_RESET) is None
+
+
+def test_reissuing_revokes_the_previous_link(db, user):
+    old = token_service.issue_token(user, AuthToken.PURPOSE_RESET)
+    db.session.commit()
+    new = token_service.issue_token(user, AuthToken.PURPOSE_RESET)
+    db.session.commit()
+
+    assert token_service.consume_token(old, AuthToken.PURPOSE_RESET) is None
+    assert token_service.consume_token(new, AuthToken.PURPOSE_RESET) == user